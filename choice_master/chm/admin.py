@@ -2,32 +2,36 @@ import json
 
 from django.conf.urls import url
 from django.contrib import admin
-from django.core.exceptions import ValidationError
+from django.contrib import messages
 from django.http import Http404
 from django.http import JsonResponse
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
 from django.shortcuts import redirect
+from django.shortcuts import render
 from django.urls import reverse
+from django.utils.html import format_html
 from django.utils.translation import ugettext_lazy as _
 from django.views.decorators.csrf import csrf_exempt
-from lxml.etree import XMLSyntaxError
 
+from .export import JSONLinesExporter
+from .export import XMLExporter
+from .export import iter_questions
 from .forms import XMLFileForm
+from .jobs import fail_stale_jobs
+from .jobs import submit_import_job
+from .loader import QuestionLoader
+from .loader import accept_similar_questions
 from .messages import LoadQuestionsMessageManager
 from .models import Answer
 from .models import Flag
 from .models import FlaggedQuestion
+from .models import ImportJob
 from .models import Question
+from .models import SimilarQuestion
 from .models import Subject
 from .models import Topic
 from .models import XMLFile
-from .xml import XMLParser
-
-
-class SimilarQuestionError(Exception):
-    """When two questions are similar raise this error"""
-    def __init__(self, msg, data):
-        self.msg = msg
-        self.data = data
 
 
 class XMLFileAdmin(admin.ModelAdmin):
@@ -49,11 +53,20 @@ class XMLFileAdmin(admin.ModelAdmin):
             url('^acceptsimilarquestion/$',
                 self.admin_site.admin_view(self.accept_similar_question_view),
                 name='chm_accept_similar_question'),
+            url(r'^import/(?P<job_id>\d+)/$',
+                self.admin_site.admin_view(self.import_progress_view),
+                name='chm_import_progress'),
+            url(r'^import/(?P<job_id>\d+)/status/$',
+                self.admin_site.admin_view(self.import_status_view),
+                name='chm_import_status'),
+            url(r'^import/(?P<job_id>\d+)/finish/$',
+                self.admin_site.admin_view(self.import_finish_view),
+                name='chm_import_finish'),
         ]
         return urls + super(XMLFileAdmin, self).get_urls()
 
     @staticmethod
-    def load_question(data, mm, request, ignore_similar=False):
+    def load_question(data, mm, ignore_similar=False):
         """
         Parse the data, create all the instances of the corresponding models,
         validate them and then save them. Handle all the validation errors that
@@ -61,90 +74,92 @@ class XMLFileAdmin(admin.ModelAdmin):
         MessageManager
         :param data: The data to be parsed
         :param mm: A message manager to handle messages
-        :param request: The request
         :param ignore_similar: load the questions regarless of the existence
                                of similar questions
         :type data: dict[string, T]
         :type mm: messages.LoadQuestionsMessageManager
         :type ignore_similar: bool
         """
-        try:
-            subject = Subject.objects.get(name=data['subject'])
-            topic = Topic.objects.get(name=data['topic'], subject=subject)
-
-            question = Question(text=data['question'], topic=topic)
-            question.full_clean()
-            answers = []
-            for ans in data['answers']:
-                answer = Answer()
-                answer.text = ans['text']
-                answer.is_correct = ans['is_correct']
-                answers.append(answer)
-
-            if question.similar_exists() and not ignore_similar:
-                raise SimilarQuestionError(_("A similar question exists"),
-                                           data)
-            else:
-                question.save()
-                for answer in answers:
-                    answer.question = question
-                    answer.full_clean()
-                    answer.save()
-                mm.added.append(question)
-
-        except Subject.DoesNotExist:
-            mm.no_subject.append((data['subject'], data['question']))
-
-        except Topic.DoesNotExist:
-            mm.no_topic.append((data['topic'], data['question']))
-
-        except ValidationError as err:
-            mm.validation_error.append((err, data['question']))
-
-        except SimilarQuestionError as err:
-            request.session['duplicates'].append(err.data)
+        loader = QuestionLoader(mm, ignore_similar=ignore_similar)
+        loader.load([data])
 
     def load_questions_view(self, request):
         """
-        Parse and load the questions and answers from the specified file into
-        the database. Handle any validation error showing the corresponding
-        message.
+        Start loading the questions and answers from the specified file into
+        the database in background, and redirect to the page showing the
+        progress of the load.
         :param request: The request
         :return: The response
         """
-        request.session['duplicates'] = []
-        mm = LoadQuestionsMessageManager()
-        try:
-            form = XMLFileForm(request.POST, request.FILES)
-            if form.is_valid():
-                xmlfile = request.FILES['file']
-                parser = XMLParser(xmlfile)
-                for data in parser.parse_questions():
-                    self.load_question(data, mm, request)
-            else:
-                mm.form_is_valid = False
-                mm.set_messages(request)
-                print(reverse('admin:chm_xmlfile_add'))
-                return redirect(reverse('admin:chm_xmlfile_add'))
-
-        except XMLSyntaxError as err:
-            mm.syntax_error = err
+        form = XMLFileForm(request.POST, request.FILES)
+        if not form.is_valid():
+            mm = LoadQuestionsMessageManager()
+            mm.form_is_valid = False
+            mm.set_messages(request)
+            return redirect(reverse('admin:chm_xmlfile_add'))
 
-        mm.set_messages(request)
+        job = ImportJob.objects.create(file=request.FILES['file'])
+        submit_import_job(job)
+        return redirect(reverse('admin:chm_import_progress', args=[job.pk]))
+
+    def import_progress_view(self, request, job_id):
+        """
+        Show the progress of a load of questions
+        :param request: The request
+        :param job_id: The primary key of the ImportJob
+        :return: The response
+        """
+        fail_stale_jobs()
+        job = get_object_or_404(ImportJob, pk=job_id)
+        context = dict(
+            self.admin_site.each_context(request),
+            title=_('Loading questions'),
+            job=job,
+        )
+        return render(request, 'import_progress.html', context)
+
+    def import_status_view(self, request, job_id):
+        """
+        Return the progress of a load of questions
+        :param request: The request
+        :param job_id: The primary key of the ImportJob
+        :return: The response
+        """
+        # do not poll forever jobs which were interrupted
+        fail_stale_jobs()
+        job = get_object_or_404(ImportJob, pk=job_id)
+        return JsonResponse(job.to_json())
+
+    def import_finish_view(self, request, job_id):
+        """
+        Show the outcome of a finished load of questions. Handle any
+        validation error showing the corresponding message.
+        :param request: The request
+        :param job_id: The primary key of the ImportJob
+        :return: The response
+        """
+        job = get_object_or_404(ImportJob, pk=job_id)
+        if not job.is_done():
+            return redirect(reverse('admin:chm_import_progress',
+                                    args=[job.pk]))
+
+        for level, msg in json.loads(job.messages):
+            messages.add_message(request, level, msg)
         return redirect(reverse('admin:chm_question_changelist'))
 
     def accept_similar_question_view(self, request):
         """
-        Save the given question in the POST request ignoring if a similar
-        one exists
+        Save the similar question given in the POST request ignoring that a
+        similar one exists
         :param request: The request
         :return: The response
         """
         if request.method == 'POST':
-            data = json.loads(request.POST['data'])
+            similar_question = get_object_or_404(SimilarQuestion,
+                                                 pk=request.POST['id'])
             mm = LoadQuestionsMessageManager()
-            self.load_question(data, mm, request, ignore_similar=True)
-            return JsonResponse({'ok': True})
+            accept_similar_questions([similar_question], mm)
+            return JsonResponse({'ok': bool(mm.added)})
         else:
             raise Http404(_("Nothing to see here."))
 
@@ -160,16 +175,14 @@ class QuestionAdmin(admin.ModelAdmin):
     inlines = (AnswerInline,)
     list_display = ['get_text', 'get_topic_name', 'get_subject_name']
     fields = ['topic', 'text']
+    actions = ['export_xml', 'export_jsonl']
 
     change_list_template = 'change_question_list.html'
 
     def changelist_view(self, request, extra_context=None):
         extra_context = extra_context or {}
 
-        extra_context['duplicates'] = request.session.pop('duplicates',
-                                                          False)
-
-        extra_context['dup_json'] = json.dumps(extra_context['duplicates'])
+        extra_context['similar_questions'] = SimilarQuestion.objects.count()
 
         return super(QuestionAdmin, self).changelist_view(
             request, extra_context=extra_context,
@@ -191,6 +204,87 @@ class QuestionAdmin(admin.ModelAdmin):
 
     get_subject_name.short_description = 'Subject'
 
+    def export(self, request, queryset, exporter):
+        """
+        Stream the export of the given questions, so that the response is
+        sent while the questions are fetched. If there is nothing to export
+        an error is shown instead and the changelist is displayed again
+        :param request: The request of the action
+        :param queryset: The questions to export
+        :param exporter: The exporter serializing the questions
+        :type request: HttpRequest
+        :type queryset: QuerySet
+        :type exporter: XMLExporter | JSONLinesExporter
+        :rtype: StreamingHttpResponse | NoneType
+        """
+        if not exporter.exportable(queryset):
+            self.message_user(request,
+                              _('None of the selected questions can be '
+                                'exported, they have no correct answers'),
+                              messages.ERROR)
+            return None
+
+        response = StreamingHttpResponse(
+            exporter.export(iter_questions(queryset)),
+            content_type=exporter.content_type,
+        )
+        response['Content-Disposition'] = \
+            'attachment; filename="questions.{}"'.format(exporter.extension)
+        return response
+
+    def export_xml(self, request, queryset):
+        """Download the selected questions as an XML file"""
+        return self.export(request, queryset, XMLExporter())
+
+    export_xml.short_description = _('Export selected questions to XML')
+
+    def export_jsonl(self, request, queryset):
+        """Download the selected questions as a JSON Lines file"""
+        return self.export(request, queryset, JSONLinesExporter())
+
+    export_jsonl.short_description = _(
+        'Export selected questions to JSON Lines')
+
+
+class SimilarQuestionAdmin(admin.ModelAdmin):
+    """
+    The staged questions which were not loaded because similar questions
+    exist. Each one can be accepted, loading it anyway, or rejected.
+    """
+    model = SimilarQuestion
+    list_display = ['text', 'topic', 'subject', 'datetime', 'get_accept']
+    list_filter = ['subject', 'job']
+    list_per_page = 50
+    actions = ['accept_selected', 'reject_selected']
+    fields = ['subject', 'topic', 'text']
+    readonly_fields = ['subject', 'topic', 'text']
+
+    change_list_template = 'change_similar_question_list.html'
+
+    def get_accept(self, obj):
+        return format_html('<button class="accept" data-id="{}">{}</button>',
+                           obj.pk, _('Add it anyway'))
+
+    get_accept.short_description = ''
+
+    def accept_selected(self, request, queryset):
+        """Load the selected questions even if similar questions exist"""
+        mm = LoadQuestionsMessageManager()
+        accept_similar_questions(queryset.order_by('pk'), mm)
+        mm.set_messages(request)
+
+    accept_selected.short_description = _('Add selected questions anyway')
+
+    def reject_selected(self, request, queryset):
+        """Discard the selected questions"""
+        count, _deleted = queryset.delete()
+        self.message_user(request, _('Discarded {0} questions').format(count))
+
+    reject_selected.short_description = _('Discard selected questions')
+
+    def has_add_permission(self, request):
+        return False
+
 
 class TopicAdmin(admin.ModelAdmin):
     model = Topic
@@ -233,6 +327,7 @@ class FlaggedQuestionAdmin(admin.ModelAdmin):
 
 admin.site.register(Question, QuestionAdmin)
 admin.site.register(FlaggedQuestion, FlaggedQuestionAdmin)
+admin.site.register(SimilarQuestion, SimilarQuestionAdmin)
 admin.site.register(Subject)
 admin.site.register(XMLFile, XMLFileAdmin)
 admin.site.register(Topic, TopicAdmin)
@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class ChmConfig(AppConfig):
     name = 'chm'
+
+    def ready(self):
+        # register the system checks
+        from chm import checks  # noqa
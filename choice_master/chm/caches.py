@@ -0,0 +1,115 @@
+"""
+Caches for app chm. They use Django's cache framework, so they are kept in
+the memory of each process unless a shared cache (e.g. memcached) is
+configured in the CACHES setting. The signals in chm.models invalidate
+them, so a shared cache is required when the site is served by several
+processes (see chm.checks).
+"""
+
+# django imports
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+
+CORRECT_ANSWERS_KEY = 'chm:correct_answers:{}'
+QUESTION_KEY = 'chm:question:{}'
+
+# the entries are invalidated when the questions, their answers or their
+# topics change, the timeout only frees the questions which are not used
+# any more
+TIMEOUT = 60 * 60 * 24
+
+
+def correct_answers(question_id):
+    """
+    Return the primary keys of the correct answers of the given question.
+    The answers are only read the first time.
+    :param question_id: The primary key of the question
+    :type question_id: int
+    :rtype: frozenset[int]
+    """
+    key = CORRECT_ANSWERS_KEY.format(question_id)
+    pks = cache.get(key)
+    if pks is None:
+        # chm.models depends on this module
+        Answer = apps.get_model('chm', 'Answer')
+        pks = list(Answer.objects.filter(
+            question_id=question_id,
+            is_correct=True
+        ).values_list('pk', flat=True))
+        cache.set(key, pks, TIMEOUT)
+    return frozenset(pks)
+
+
+def correct_answers_many(question_ids):
+    """
+    Return the primary keys of the correct answers of each of the given
+    questions. The answers of all the questions which are not cached are
+    read with a single query.
+    :param question_ids: The primary keys of the questions
+    :type question_ids: list[int]
+    :rtype: dict[int, frozenset[int]]
+    """
+    keys = dict((CORRECT_ANSWERS_KEY.format(pk), pk) for pk in question_ids)
+    cached = cache.get_many(list(keys))
+    result = dict((keys[key], pks) for key, pks in cached.items())
+
+    missing = [pk for pk in question_ids if pk not in result]
+    if missing:
+        Answer = apps.get_model('chm', 'Answer')
+        for pk in missing:
+            result[pk] = []
+        for question_id, pk in Answer.objects.filter(
+                question_id__in=missing,
+                is_correct=True).values_list('question_id', 'pk'):
+            result[question_id].append(pk)
+        cache.set_many(dict((CORRECT_ANSWERS_KEY.format(pk), result[pk])
+                            for pk in missing), TIMEOUT)
+
+    return dict((pk, frozenset(pks)) for pk, pks in result.items())
+
+
+def questions_json(question_ids):
+    """
+    Return each of the given questions converted to json format (see
+    Question.to_json). The questions which are not cached are read with two
+    queries, one for the questions and their topics and one for their
+    answers.
+    :param question_ids: The primary keys of the questions
+    :type question_ids: list[int]
+    :return: The questions which exist, by primary key
+    :rtype: dict[int, dict[string, T]]
+    """
+    keys = dict((QUESTION_KEY.format(pk), pk) for pk in question_ids)
+    cached = cache.get_many(list(keys))
+    result = dict((keys[key], data) for key, data in cached.items())
+
+    missing = [pk for pk in question_ids if pk not in result]
+    if missing:
+        Question = apps.get_model('chm', 'Question')
+        questions = Question.objects.filter(
+            pk__in=missing
+        ).select_related('topic').prefetch_related('answers')
+        fetched = dict((question.pk, question.to_json())
+                       for question in questions)
+        cache.set_many(dict((QUESTION_KEY.format(pk), data)
+                            for pk, data in fetched.items()), TIMEOUT)
+        result.update(fetched)
+
+    return result
+
+
+def invalidate_questions(question_ids):
+    """
+    Forget everything cached about the given questions, now and when the
+    current transaction commits: until then, other requests still read the
+    old rows and may cache them again.
+    :param question_ids: The primary keys of the questions
+    :type question_ids: iterable[int]
+    """
+    keys = []
+    for pk in question_ids:
+        keys.append(CORRECT_ANSWERS_KEY.format(pk))
+        keys.append(QUESTION_KEY.format(pk))
+    cache.delete_many(keys)
+    transaction.on_commit(lambda: cache.delete_many(keys))
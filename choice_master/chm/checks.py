@@ -0,0 +1,33 @@
+"""
+System checks for app chm
+"""
+
+# django imports
+from django.conf import settings
+from django.core.checks import Warning
+from django.core.checks import register
+
+# backends which are not shared among processes
+PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def shared_cache_check(app_configs, **kwargs):
+    """
+    Warn when the default cache is kept by each process outside of
+    development: an edited question would still be graded and shown as
+    before by the processes which cached it (see chm.caches)
+    """
+    backend = settings.CACHES['default']['BACKEND']
+    if settings.DEBUG or backend not in PROCESS_CACHES:
+        return []
+    return [Warning(
+        'The default cache ({}) is not shared among processes'.format(
+            backend),
+        hint='Configure a shared cache such as memcached in CACHES, '
+             'unless the site is served by a single process.',
+        id='chm.W001',
+    )]
@@ -0,0 +1,176 @@
+"""
+Export of questions for app chm
+"""
+
+# python imports
+import json
+
+# django imports
+from django.db.models import Prefetch
+from lxml import etree
+
+# project imports
+from chm.models import Answer
+
+
+CHUNK_SIZE = 1000
+
+
+def iter_questions(queryset, chunk_size=CHUNK_SIZE):
+    """
+    Yield the questions of the given queryset along with their answers,
+    their topics and their subjects. Questions are fetched in chunks ordered
+    by primary key, each one with a constant amount of queries, so the
+    memory used does not depend on the size of the queryset.
+    :param queryset: The questions to export
+    :param chunk_size: The amount of questions fetched at once
+    :type queryset: QuerySet
+    :type chunk_size: int
+    :rtype: Question
+    """
+    queryset = queryset.select_related('topic__subject').prefetch_related(
+        Prefetch('answers', queryset=Answer.objects.order_by('pk'))
+    ).order_by('pk')
+
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else \
+            queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        for question in chunk:
+            yield question
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+def question_data(question):
+    """
+    Converts a Question to the format returned by XMLParser
+    :param question: The question, with its answers prefetched
+    :type question: Question
+    :return: A dictionary containing: 'subject', 'topic', 'question' and
+    'answers' (list of dictionaries containing: 'text' and 'is_correct')
+    :rtype: dict[string, T]
+    """
+    return {
+        'subject': question.topic.subject.name,
+        'topic': question.topic.name,
+        'question': question.text,
+        'answers': [{'text': answer.text, 'is_correct': answer.is_correct}
+                    for answer in question.answers.all()],
+    }
+
+
+class JSONLinesExporter(object):
+    """
+    Serialize questions as JSON Lines: one object per line in the format
+    returned by XMLParser.
+    """
+    content_type = 'application/x-ndjson'
+    extension = 'jsonl'
+
+    def __init__(self):
+        self.exported = 0
+        self.skipped = 0
+
+    @staticmethod
+    def exportable(queryset):
+        """
+        Whether the given questions make a valid export. An empty file is a
+        valid JSON Lines file, so any queryset can be exported.
+        :param queryset: The questions to export
+        :type queryset: QuerySet
+        :rtype: bool
+        """
+        return True
+
+    def export(self, questions):
+        """
+        Yield the lines of the export of the given questions
+        :param questions: The questions, with their answers prefetched
+        :type questions: iterable[Question]
+        :rtype: string
+        """
+        for question in questions:
+            self.exported += 1
+            yield json.dumps(question_data(question), ensure_ascii=False) + \
+                '\n'
+
+
+class XMLExporter(object):
+    """
+    Serialize questions as an XML file valid against the schema used to
+    load them (see XMLParser). The file is written one question at a time,
+    the whole tree is never built.
+
+    The schema requires at least one correct answer, so questions without
+    correct answers can not be exported and are skipped. It also requires at
+    least one question, so check the queryset with exportable() first.
+    """
+    content_type = 'application/xml'
+    extension = 'xml'
+
+    def __init__(self):
+        self.exported = 0
+        self.skipped = 0
+
+    @staticmethod
+    def exportable(queryset):
+        """
+        Whether the given questions make a valid export. The schema requires
+        at least one question, so some question must have a correct answer.
+        :param queryset: The questions to export
+        :type queryset: QuerySet
+        :rtype: bool
+        """
+        return queryset.filter(answers__is_correct=True).exists()
+
+    def export(self, questions):
+        """
+        Yield the chunks of the export of the given questions
+        :param questions: The questions, with their answers prefetched
+        :type questions: iterable[Question]
+        :rtype: string
+        """
+        yield '<?xml version="1.0" encoding="UTF-8"?>\n<file>\n'
+        for question in questions:
+            element = self.element(question_data(question))
+            if element is None:
+                self.skipped += 1
+                continue
+            self.exported += 1
+            yield '  ' + etree.tostring(element, encoding='unicode')
+        yield '</file>\n'
+
+    @staticmethod
+    def element(data):
+        """
+        Build the element of a question
+        :param data: The question in the format returned by XMLParser
+        :type data: dict[string, T]
+        :return: The element, or None if the question has no correct answers
+        :rtype: etree.Element | NoneType
+        """
+        if not any(answer['is_correct'] for answer in data['answers']):
+            return None
+
+        element = etree.Element('question', subject=data['subject'],
+                                topic=data['topic'])
+        element.text = '\n    '
+        element.tail = '\n'
+        text = etree.SubElement(element, 'text')
+        text.text = data['question']
+        for answer in data['answers']:
+            text.tail = '\n    '
+            text = etree.SubElement(
+                element, 'correct' if answer['is_correct'] else 'incorrect')
+            text.text = answer['text']
+        text.tail = '\n  '
+        return element
+
+
+EXPORTERS = {
+    'xml': XMLExporter,
+    'jsonl': JSONLinesExporter,
+}
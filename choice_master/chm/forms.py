@@ -1,26 +1,29 @@
 # python import
 import random
+import numpy as np
 
 # django imports
 from django import forms
-from django.db.models import Case
-from django.db.models import FloatField
-from django.db.models import Q
-from django.db.models import Sum
-from django.db.models import Value
-from django.db.models import When
+from django.db import transaction
+from django.utils import timezone
 from django.contrib.admin.widgets import FilteredSelectMultiple
 
 # project imports
+from chm.irt import estimate_abilities
+from chm.irt import information
+from chm.irt import logit_difficulties
+from chm.irt import to_arrays
 from chm.models import Question
+from chm.models import QuestionMastery
 from chm.models import QuestionOnQuiz
 from chm.models import Quiz
+from chm.models import ReviewSchedule
 from chm.models import Topic
+from chm.models import TopicDifficultyCount
 from chm.models import XMLFile
-
-NOT_ANSWERED = QuestionOnQuiz.STATUS.not_answered
-WRONG = QuestionOnQuiz.STATUS.wrong
-RIGHT = QuestionOnQuiz.STATUS.right
+from chm.sampling import allocate
+from chm.sampling import sample
+from chm.sampling import sample_ids_by_range
 
 
 class XMLFileForm(forms.ModelForm):
@@ -35,10 +38,20 @@ class QuizForm(forms.Form):
     RANDOM = '1'
     MIN_DIFFICULTY = '2'
     HELP_IMPROVE = '3'
+    SPACED_REPETITION = '4'
+    STRATIFIED = '5'
+    STRATIFIED_EQUAL = '6'
+    ADAPTIVE = '7'
 
     SELECTION_ALGORITHMS = ((RANDOM, 'Random'),
                             (MIN_DIFFICULTY, 'Select minimum difficulty'),
-                            (HELP_IMPROVE, 'Based on previows errors'))
+                            (HELP_IMPROVE, 'Based on previows errors'),
+                            (SPACED_REPETITION, 'Spaced repetition'),
+                            (STRATIFIED, 'Proportional to each topic and '
+                                         'difficulty'),
+                            (STRATIFIED_EQUAL, 'Balanced among topics and '
+                                               'difficulties'),
+                            (ADAPTIVE, 'Adapted to your ability'))
 
     topics = forms.ModelMultipleChoiceField(
         queryset=Topic.objects.all(),
@@ -94,14 +107,20 @@ class QuizForm(forms.Form):
         """
         cleaned_data = super(QuizForm, self).clean()
         assert self.candidates is not None
+        min_difficulty = None
         if self.cleaned_data['selection_algorithm'] == self.MIN_DIFFICULTY:
+            min_difficulty = cleaned_data['min_difficulty']
             self.candidates = self.candidates.filter(
-                difficulty__gte=cleaned_data['min_difficulty']
+                difficulty__gte=min_difficulty
             )
-        if self.candidates.count() < cleaned_data['nr_of_questions']:
+        count = TopicDifficultyCount.objects.questions(
+            cleaned_data['topics'],
+            min_difficulty
+        )
+        if count < cleaned_data['nr_of_questions']:
             msg = ('{} questions meet the current criteria. '
                    'You can try choosing fewer questions or more '
-                   'topics.'.format(len(self.candidates)))
+                   'topics.'.format(count))
             if cleaned_data['selection_algorithm'] == self.MIN_DIFFICULTY:
                 if cleaned_data['min_difficulty'] > 1:
                     msg += (' You could also try with a'
@@ -113,20 +132,30 @@ class QuizForm(forms.Form):
         return cleaned_data
 
     def make_quiz(self):
-        """Make a quiz based on user input"""
+        """
+        Make a quiz based on user input. The quiz is saved in a single
+        transaction and returned with the json of its questions already
+        fetched, in a fixed amount of queries (see Quiz.prefetch), so it is
+        shown without further queries.
+        :rtype: Quiz
+        """
         assert self.is_valid()
-        quiz = Quiz.objects.create(
-            user=self.user,
-            nr_of_questions=self.cleaned_data['nr_of_questions'],
-            seconds_per_question=self.cleaned_data['seconds_per_question'],
-        )
-        for topic in self.cleaned_data['topics']:
-            quiz.topics.add(topic)
+        with transaction.atomic():
+            quiz = Quiz.objects.create(
+                user=self.user,
+                nr_of_questions=self.cleaned_data['nr_of_questions'],
+                seconds_per_question=self.cleaned_data['seconds_per_question'],
+            )
+            quiz.topics.add(*self.cleaned_data['topics'])
 
-        # add questions to the quiz
-        for question in self.choose_questions():
-            QuestionOnQuiz.objects.create(question=question, quiz=quiz)
+            # add questions to the quiz
+            questions = self.choose_questions()
+            QuestionOnQuiz.objects.bulk_create(
+                QuestionOnQuiz(question=question, quiz=quiz)
+                for question in questions
+            )
 
+        quiz.prefetch([question.pk for question in questions])
         return quiz
 
     def choose_questions(self):
@@ -139,42 +168,173 @@ class QuizForm(forms.Form):
         selection_algorithm = self.cleaned_data['selection_algorithm']
 
         if selection_algorithm in [QuizForm.RANDOM, QuizForm.MIN_DIFFICULTY]:
-            candidates = list(self.candidates)
-            random.shuffle(candidates)
+            # only the ids of the candidates are fetched to draw the sample
+            candidates = sample(self.candidates,
+                                self.cleaned_data['nr_of_questions'])
         elif selection_algorithm == QuizForm.HELP_IMPROVE:
             # order by amount of previous errors
-            candidates = self.candidates.annotate(
-
-                # we'll add column with some 'score' to order the questions
-                score=Sum(
-                    Case(
-
-                        # how many times did the user leave the question blank?
-                        When(Q(questiononquiz__quiz__user=self.user) &
-                             Q(questiononquiz__state=NOT_ANSWERED),
-                             then=1),
-
-                        # how many times did the user hit the correct answer?
-                        When(Q(questiononquiz__quiz__user=self.user) &
-                             Q(questiononquiz__state=RIGHT),
-                             then=-1),
-
-                        # how many times did the user provide a wrong answer?
-                        When(Q(questiononquiz__quiz__user=self.user) &
-                             Q(questiononquiz__state=WRONG),
-                             then=2),
-
-                        # may be the user never saw the question
-                        default=Value(0),
-                        output_field=FloatField(),
-                    )
-                )
-            ).order_by('score')
-            candidates = list(candidates)
+            candidates = self.least_mastered(
+                self.cleaned_data['nr_of_questions']
+            )
+        elif selection_algorithm == QuizForm.SPACED_REPETITION:
+            candidates = self.due_soonest(
+                self.cleaned_data['nr_of_questions']
+            )
+        elif selection_algorithm in [QuizForm.STRATIFIED,
+                                     QuizForm.STRATIFIED_EQUAL]:
+            candidates = self.stratified(
+                self.cleaned_data['nr_of_questions'],
+                equal=selection_algorithm == QuizForm.STRATIFIED_EQUAL
+            )
+        elif selection_algorithm == QuizForm.ADAPTIVE:
+            candidates = self.most_informative(
+                self.cleaned_data['nr_of_questions']
+            )
         else:
             assert False
         return candidates[:self.cleaned_data['nr_of_questions']]
 
+    def least_mastered(self, k):
+        """
+        Choose the k candidates with the lowest mastery score of the user
+        (see QuestionMastery). The questions the user never saw have score
+        0. Each query reads the k first rows of an index.
+        :param k: The amount of questions to choose
+        :type k: int
+        :return: The questions, ordered by score
+        :rtype: list[Question]
+        """
+        mastery = QuestionMastery.objects.filter(
+            user=self.user,
+            question__in=self.candidates
+        )
+        pks = list(mastery.filter(score__lt=0).order_by(
+            'score').values_list('question_id', flat=True)[:k])
+
+        # the questions with score 0, seen or not
+        if len(pks) < k:
+            pks += self.candidates.exclude(
+                pk__in=mastery.exclude(score=0).values('question_id')
+            ).values_list('pk', flat=True)[:k - len(pks)]
+
+        if len(pks) < k:
+            pks += mastery.filter(score__gt=0).order_by(
+                'score').values_list('question_id', flat=True)[:k - len(pks)]
+
+        questions = Question.objects.in_bulk(pks)
+        return [questions[pk] for pk in pks]
+
+    def stratified(self, k, equal=False):
+        """
+        Choose k candidates at random, splitting them among the topics and,
+        within each topic, among the difficulties. The split is proportional
+        to the amount of questions of each topic and difficulty (see
+        TopicDifficultyCount), or as equal as possible. Every topic and
+        difficulty is sampled with its own indexed queries, so the time
+        spent depends on k and not on the amount of questions.
+        :param k: The amount of questions to choose
+        :param equal: Split the questions equally instead of proportionally
+        :type k: int
+        :type equal: bool
+        :return: The questions, in random order
+        :rtype: list[Question]
+        """
+        strata = {}
+        for count in TopicDifficultyCount.objects.filter(
+                topic__in=self.cleaned_data['topics'],
+                count__gt=0):
+            strata.setdefault(count.topic_id, {})[count.difficulty] = \
+                count.count
+
+        topics = allocate(k, dict((topic_id, sum(sizes.values()))
+                                  for topic_id, sizes in strata.items()),
+                          equal)
+        pks = []
+        for topic_id, n in topics.items():
+            difficulties = allocate(n, strata[topic_id], equal)
+            for difficulty, m in difficulties.items():
+                if m:
+                    pks += sample_ids_by_range(Question.objects.filter(
+                        topic_id=topic_id,
+                        difficulty=difficulty
+                    ), m)
+
+        random.shuffle(pks)
+        questions = Question.objects.in_bulk(pks)
+        return [questions[pk] for pk in pks]
+
+    def most_informative(self, k):
+        """
+        Choose the k candidates which tell the most about the ability of the
+        user (see chm.irt): the ones whose difficulty is the closest to the
+        ability of the user in their topic, estimated from the previous
+        answers of the user. Ties are broken at random.
+        :param k: The amount of questions to choose
+        :type k: int
+        :return: The questions, the most informative first
+        :rtype: list[Question]
+        """
+        topics = np.array(sorted(t.pk for t in self.cleaned_data['topics']))
+
+        history = QuestionOnQuiz.objects.filter(
+            quiz__user=self.user,
+            question__topic__in=self.cleaned_data['topics']
+        ).exclude(
+            state=QuestionOnQuiz.STATUS.not_answered
+        ).values_list('question__topic_id', 'question__calibrated_difficulty',
+                      'question__real_difficulty', 'state')
+        topic_ids, calibrated, real, states = to_arrays(history, 4)
+        ability = estimate_abilities(
+            np.searchsorted(topics, topic_ids),
+            logit_difficulties(calibrated, real),
+            (states == QuestionOnQuiz.STATUS.right).astype(float),
+            len(topics)
+        )
+
+        pks, topic_ids, calibrated, real = to_arrays(
+            self.candidates.values_list('pk', 'topic_id',
+                                        'calibrated_difficulty',
+                                        'real_difficulty'), 4)
+        info = information(
+            ability[np.searchsorted(topics, topic_ids)],
+            logit_difficulties(calibrated, real)
+        )
+        order = np.lexsort((np.random.random(len(info)), -info))[:k]
+
+        questions = Question.objects.in_bulk(pks[order].tolist())
+        return [questions[pk] for pk in pks[order].tolist()]
+
+    def due_soonest(self, k):
+        """
+        Choose k candidates by their spaced repetition schedule (see
+        ReviewSchedule): first the reviews which are due, then questions the
+        user never saw, and then the reviews due soonest. Each query reads
+        the k first rows of an index.
+        :param k: The amount of questions to choose
+        :type k: int
+        :return: The questions, in the order they should be reviewed
+        :rtype: list[Question]
+        """
+        now = timezone.now()
+        schedules = ReviewSchedule.objects.filter(
+            user=self.user,
+            question__in=self.candidates
+        )
+        pks = list(schedules.filter(due__lte=now).order_by(
+            'due').values_list('question_id', flat=True)[:k])
+
+        if len(pks) < k:
+            pks += self.candidates.exclude(
+                pk__in=schedules.values('question_id')
+            ).order_by('pk').values_list('pk', flat=True)[:k - len(pks)]
+
+        if len(pks) < k:
+            pks += schedules.filter(due__gt=now).order_by(
+                'due').values_list('question_id', flat=True)[:k - len(pks)]
+
+        questions = Question.objects.in_bulk(pks)
+        return [questions[pk] for pk in pks]
+
 
 class FlagForm(forms.Form):
     """Form used to flag a question"""
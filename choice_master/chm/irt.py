@@ -0,0 +1,151 @@
+"""
+Item response theory (Rasch model) for app chm. The probability that a
+user of ability theta answers right a question of difficulty b is
+1 / (1 + exp(b - theta)), both measured in logits.
+"""
+
+# python imports
+import numpy as np
+
+# the difficulties voted by the users (from 1 to 5) are centered at 0
+DIFFICULTY_OFFSET = 3.0
+
+# standard deviation of the normal priors of abilities and difficulties,
+# they keep the estimates finite when every answer is right (or wrong)
+PRIOR_SD = 1.0
+
+ITERATIONS = 20
+
+
+def difficulty_to_logit(difficulty):
+    """
+    Convert voted difficulties to logits
+    :type difficulty: float | np.ndarray
+    :rtype: float | np.ndarray
+    """
+    return np.asarray(difficulty, dtype=float) - DIFFICULTY_OFFSET
+
+
+def to_arrays(rows, n):
+    """
+    Transpose rows of values into NumPy arrays
+    :param rows: The rows, each one with n values
+    :param n: The amount of values of every row
+    :type rows: iterable[tuple]
+    :type n: int
+    :rtype: list[np.ndarray]
+    """
+    rows = list(rows)
+    if not rows:
+        return [np.array([], dtype=object) for _ in range(n)]
+    return [np.array(column) for column in zip(*rows)]
+
+
+def logit_difficulties(calibrated, real):
+    """
+    The difficulties of questions in logits: the calibrated ones if they
+    were calibrated and the voted ones otherwise
+    :param calibrated: The calibrated difficulties, None if missing
+    :param real: The voted difficulties
+    :type calibrated: np.ndarray
+    :type real: np.ndarray
+    :rtype: np.ndarray
+    """
+    calibrated = calibrated.astype(float)
+    return np.where(np.isnan(calibrated), difficulty_to_logit(real),
+                    calibrated)
+
+
+def probability(theta, b):
+    """
+    The probability of a right answer
+    :param theta: The abilities of the users
+    :param b: The difficulties of the questions
+    :type theta: np.ndarray
+    :type b: np.ndarray
+    :rtype: np.ndarray
+    """
+    return 1.0 / (1.0 + np.exp(b - theta))
+
+
+def information(theta, b):
+    """
+    The Fisher information of the questions about the abilities of the
+    users: the most informative questions are the ones the users answer
+    right half of the times.
+    :type theta: np.ndarray
+    :type b: np.ndarray
+    :rtype: np.ndarray
+    """
+    p = probability(theta, b)
+    return p * (1.0 - p)
+
+
+def estimate_abilities(groups, b, outcomes, n_groups, prior_sd=PRIOR_SD,
+                       iterations=ITERATIONS):
+    """
+    Estimate the ability of every group of answers (e.g. the answers of a
+    user to the questions of a topic) given the difficulties of the
+    questions. This is the maximum a posteriori estimate with a standard
+    normal prior, found with Newton's method on all the groups at once.
+    :param groups: The group of every answer, from 0 to n_groups - 1
+    :param b: The difficulty of the question of every answer
+    :param outcomes: 1 for every right answer and 0 for every wrong one
+    :param n_groups: The amount of groups
+    :type groups: np.ndarray
+    :type b: np.ndarray
+    :type outcomes: np.ndarray
+    :type n_groups: int
+    :return: The ability of every group
+    :rtype: np.ndarray
+    """
+    theta = np.zeros(n_groups)
+    precision = 1.0 / prior_sd ** 2
+    for _ in range(iterations):
+        p = probability(theta[groups], b)
+        gradient = np.bincount(groups, outcomes - p, n_groups) - \
+            theta * precision
+        hessian = np.bincount(groups, p * (1.0 - p), n_groups) + precision
+        theta += gradient / hessian
+    return theta
+
+
+def calibrate(users, questions, outcomes, n_users, prior_b,
+              prior_sd=PRIOR_SD, iterations=ITERATIONS):
+    """
+    Fit the difficulty of the questions and the ability of the users to
+    the given answers, alternating Newton steps for both of them. The
+    difficulties are shrunk towards their priors, so questions with few
+    answers keep their voted difficulty.
+    :param users: The user of every answer, from 0 to n_users - 1
+    :param questions: The question of every answer, from 0 to
+    len(prior_b) - 1
+    :param outcomes: 1 for every right answer and 0 for every wrong one
+    :param n_users: The amount of users
+    :param prior_b: The prior difficulty of every question
+    :type users: np.ndarray
+    :type questions: np.ndarray
+    :type outcomes: np.ndarray
+    :type n_users: int
+    :type prior_b: np.ndarray
+    :return: The difficulty of every question and the ability of every user
+    :rtype: (np.ndarray, np.ndarray)
+    """
+    n_questions = len(prior_b)
+    b = np.array(prior_b, dtype=float)
+    theta = np.zeros(n_users)
+    precision = 1.0 / prior_sd ** 2
+    for _ in range(iterations):
+        p = probability(theta[users], b[questions])
+        gradient = np.bincount(users, outcomes - p, n_users) - \
+            theta * precision
+        hessian = np.bincount(users, p * (1.0 - p), n_users) + precision
+        theta += gradient / hessian
+
+        p = probability(theta[users], b[questions])
+        gradient = np.bincount(questions, p - outcomes, n_questions) - \
+            (b - prior_b) * precision
+        hessian = np.bincount(questions, p * (1.0 - p), n_questions) + \
+            precision
+        b += gradient / hessian
+    return b, theta
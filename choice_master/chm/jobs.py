@@ -0,0 +1,127 @@
+"""
+Background jobs for app chm
+"""
+
+# python imports
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+# django imports
+from django.db import connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from lxml.etree import XMLSyntaxError
+
+# project imports
+from chm.loader import QuestionLoader
+from chm.loader import file_hash
+from chm.loader import resume_load
+from chm.messages import LoadQuestionsMessageManager
+from chm.models import ImportJob
+from chm.xml import XMLParser
+
+logger = logging.getLogger(__name__)
+
+# Imports write to the same tables, running several of them at once would
+# only make them wait for each other
+executor = ThreadPoolExecutor(max_workers=1)
+
+# jobs which did not make progress for this long are considered interrupted,
+# e.g. by a restart of the process running them
+STALE_AFTER = timedelta(minutes=15)
+
+INTERRUPTED = 'the server stopped while loading the file, upload it again ' \
+              'to resume the load'
+
+
+def submit_import_job(job):
+    """
+    Run the given job in background once the current transaction commits
+    :param job: The job to run
+    :type job: ImportJob
+    """
+    transaction.on_commit(lambda: executor.submit(_run_in_thread, job.pk))
+
+
+def _run_in_thread(job_id):
+    try:
+        run_import_job(job_id)
+    finally:
+        # Django only closes the connections of the request threads
+        connection.close()
+
+
+def run_import_job(job_id):
+    """
+    Load the questions of the file uploaded for the given job. The progress
+    of the job is updated every time a batch of questions is committed, and
+    a previously interrupted load of the same file is resumed. Jobs which
+    are no longer pending are not run again.
+    :param job_id: The primary key of the job to run
+    :type job_id: int
+    """
+    jobs = ImportJob.objects.filter(pk=job_id)
+    if not jobs.filter(state=ImportJob.STATUS.pending).update(
+            state=ImportJob.STATUS.running, updated=timezone.now()):
+        return
+    job = ImportJob.objects.get(pk=job_id)
+
+    def on_batch(processed, added, duplicates):
+        jobs.update(processed=F('processed') + processed,
+                    added=F('added') + len(added),
+                    rejected=F('rejected') + processed - len(added),
+                    updated=timezone.now())
+
+    mm = LoadQuestionsMessageManager()
+    state = ImportJob.STATUS.finished
+    try:
+        job.file.open('rb')
+        try:
+            loader = QuestionLoader(mm, atomic=False, job=job)
+            resume_load(loader, file_hash(job.file),
+                        XMLParser(job.file).parse_questions(), on_batch)
+        finally:
+            job.file.close()
+    except XMLSyntaxError as err:
+        mm.syntax_error = err
+    except Exception as err:
+        logger.exception('Import job %s failed', job_id)
+        mm.failure = err
+        state = ImportJob.STATUS.failed
+
+    jobs.update(
+        state=state,
+        messages=json.dumps([(level, str(msg))
+                             for level, msg in mm.get_messages()]),
+        updated=timezone.now(),
+    )
+
+
+def fail_stale_jobs(now=None):
+    """
+    Set as failed the running jobs which did not make progress for
+    STALE_AFTER. Jobs run in the process which received the file, so they
+    never finish if that process stops. The loaded questions were
+    committed, so the load resumes when the file is uploaded again.
+    Pending jobs are left alone: they wait for the jobs before them, which
+    may take longer than STALE_AFTER.
+    :param now: The current time, now by default
+    :type now: datetime
+    :return: The amount of jobs set as failed
+    :rtype: int
+    """
+    now = now or timezone.now()
+    mm = LoadQuestionsMessageManager()
+    mm.failure = INTERRUPTED
+    return ImportJob.objects.filter(
+        state=ImportJob.STATUS.running,
+        updated__lt=now - STALE_AFTER,
+    ).update(
+        state=ImportJob.STATUS.failed,
+        messages=json.dumps([(level, str(msg))
+                             for level, msg in mm.get_messages()]),
+        updated=now,
+    )
@@ -0,0 +1,386 @@
+"""
+Bulk loading of questions for app chm
+"""
+
+# python imports
+import hashlib
+from collections import Counter
+from itertools import islice
+
+# django imports
+from django.core.exceptions import ValidationError
+from django.db import DatabaseError
+from django.db import transaction
+from django.db.models import F
+from django.utils.translation import ugettext_lazy as _
+
+# project imports
+from chm.caches import invalidate_questions
+from chm.models import Answer
+from chm.models import ImportCheckpoint
+from chm.models import Question
+from chm.models import QuestionGram
+from chm.models import SimilarQuestion
+from chm.models import Subject
+from chm.models import Topic
+from chm.models import TopicDifficultyCount
+from chm.similarity import is_similar
+
+
+def chunks(iterable, size):
+    """
+    Yield lists of at most size elements taken from the iterable
+    :param iterable: The elements to split
+    :param size: The maximum size of each list
+    :type size: int
+    :rtype: list
+    """
+    iterator = iter(iterable)
+    chunk = list(islice(iterator, size))
+    while chunk:
+        yield chunk
+        chunk = list(islice(iterator, size))
+
+
+class TopicCache(object):
+    """
+    Resolve subjects and topics by name. Each name is looked up in the
+    database only once, even if it does not exist.
+    """
+
+    def __init__(self):
+        self.subjects = {}
+        self.topics = {}
+
+    def subject(self, name):
+        """
+        Return the subject with the given name
+        :raise Subject.DoesNotExist: If there is no such subject
+        :rtype: Subject
+        """
+        if name not in self.subjects:
+            self.subjects[name] = Subject.objects.filter(name=name).first()
+        if self.subjects[name] is None:
+            raise Subject.DoesNotExist
+        return self.subjects[name]
+
+    def topic(self, subject_name, name):
+        """
+        Return the topic with the given name of the given subject
+        :raise Subject.DoesNotExist: If there is no such subject
+        :raise Topic.DoesNotExist: If there is no such topic
+        :rtype: Topic
+        """
+        subject = self.subject(subject_name)
+        key = (subject.pk, name)
+        if key not in self.topics:
+            self.topics[key] = Topic.objects.filter(
+                name=name,
+                subject=subject
+            ).first()
+        if self.topics[key] is None:
+            raise Topic.DoesNotExist
+        return self.topics[key]
+
+
+class SimilarQuestionError(Exception):
+    """When two questions are similar raise this error"""
+    def __init__(self, msg, data):
+        self.msg = msg
+        self.data = data
+
+
+class QuestionLoader(object):
+    """
+    The QuestionLoader object loads parsed questions (see XMLParser) into
+    the database. Questions are validated and saved in batches: every batch
+    is saved with a few bulk inserts inside its own savepoint, and the whole
+    load happens inside a single transaction. Non atomic loaders commit
+    every batch on its own instead.
+
+    The outcome of every question is reported to the given MessageManager,
+    and the questions rejected for being similar to existing ones are
+    staged as SimilarQuestion instances, waiting for an administrator to
+    review them.
+    """
+    BATCH_SIZE = 500
+
+    # texts of new questions looked up at once, within the limit of query
+    # parameters of every database
+    LOOKUP_SIZE = 500
+
+    def __init__(self, mm, batch_size=BATCH_SIZE, ignore_similar=False,
+                 atomic=True, job=None):
+        """
+        :param mm: A message manager to handle messages
+        :param batch_size: The amount of questions saved at once
+        :param ignore_similar: load the questions regarless of the existence
+                               of similar questions
+        :param atomic: load all the questions in a single transaction
+        :param job: The job loading the questions, if any
+        :type mm: messages.LoadQuestionsMessageManager
+        :type batch_size: int
+        :type ignore_similar: bool
+        :type atomic: bool
+        :type job: ImportJob
+        """
+        self.mm = mm
+        self.batch_size = batch_size
+        self.ignore_similar = ignore_similar
+        self.atomic = atomic
+        self.job = job
+        self.topics = TopicCache()
+
+    def load(self, questions, on_batch=None):
+        """
+        Load the given questions. If the loader is atomic, nothing is added
+        when any error (e.g. a syntax error in the file being parsed)
+        interrupts the load.
+        :param questions: The data of the questions to load
+        :param on_batch: Called with the amount of processed questions, the
+        saved questions and the data of the staged questions of every batch.
+        Non atomic loaders call it inside the transaction of the batch, so
+        whatever it records is committed along with the batch.
+        :type questions: iterable[dict[string, T]]
+        :type on_batch: callable
+        """
+        if not self.atomic:
+            for batch in chunks(questions, self.batch_size):
+                with transaction.atomic():
+                    added, duplicates = self.load_batch(batch)
+                    if on_batch is not None:
+                        on_batch(len(batch), added, duplicates)
+                self.report(added, duplicates)
+            return
+
+        results = []
+        with transaction.atomic():
+            for batch in chunks(questions, self.batch_size):
+                added, duplicates = self.load_batch(batch)
+                results.append((len(batch), added, duplicates))
+        for processed, added, duplicates in results:
+            self.report(added, duplicates)
+            if on_batch is not None:
+                on_batch(processed, added, duplicates)
+
+    def report(self, added, duplicates):
+        """Report the outcome of a committed batch"""
+        self.mm.added.extend(added)
+        self.mm.similar += len(duplicates)
+
+    def load_batch(self, batch):
+        """
+        Validate and save a batch of questions
+        :param batch: The data of the questions to load
+        :type batch: list[dict[string, T]]
+        :return: The saved questions and the data of the staged ones
+        :rtype: (list[Question], list[dict[string, T]])
+        """
+        existing = set(Question.objects.filter(
+            text__in=[data['question'] for data in batch]
+        ).values_list('topic_id', 'text'))
+
+        pending = []
+        duplicates = []
+        for data in batch:
+            try:
+                pending.append(self.validate(data, existing, pending))
+
+            except Subject.DoesNotExist:
+                self.mm.no_subject.append((data['subject'], data['question']))
+
+            except Topic.DoesNotExist:
+                self.mm.no_topic.append((data['topic'], data['question']))
+
+            except ValidationError as err:
+                self.mm.validation_error.append((err, data['question']))
+
+            except SimilarQuestionError as err:
+                duplicates.append(err.data)
+
+        try:
+            with transaction.atomic():
+                self.save(pending, duplicates)
+        except DatabaseError as err:
+            error = ValidationError(_('Database error: {}').format(err))
+            for question, answers in pending:
+                self.mm.validation_error.append((error, question.text))
+            for data in duplicates:
+                self.mm.validation_error.append((error, data['question']))
+            return [], []
+
+        return [question for question, answers in pending], duplicates
+
+    def validate(self, data, existing, pending):
+        """
+        Create the instances of the question and its answers and validate
+        them
+        :param data: The data of the question
+        :param existing: The (topic, text) pairs of the existing questions
+        :param pending: The questions of the batch which will be saved
+        :type data: dict[string, T]
+        :type existing: set[(int, string)]
+        :type pending: list[(Question, list[Answer])]
+        :return: The question and its answers
+        :rtype: (Question, list[Answer])
+        """
+        topic = self.topics.topic(data['subject'], data['topic'])
+        question = Question(text=data['question'], topic=topic)
+        question.clean_fields(exclude=['topic'])
+        question.clean_difficulty()
+
+        answers = []
+        for ans in data['answers']:
+            answer = Answer(text=ans['text'], is_correct=ans['is_correct'])
+            answer.clean_fields(exclude=['question'])
+            answers.append(answer)
+
+        batch_questions = [q for q, a in pending if q.topic_id == topic.pk]
+        if (topic.pk, question.text) in existing or \
+                question.text in [q.text for q in batch_questions]:
+            raise ValidationError(_('The question already exists'))
+
+        if not self.ignore_similar:
+            if question.similar_exists() or \
+                    any(is_similar(question.text, q.text)
+                        for q in batch_questions):
+                raise SimilarQuestionError(_("A similar question exists"),
+                                           data)
+
+        return question, answers
+
+    def save(self, pending, duplicates):
+        """
+        Save the validated questions and their answers, and stage the similar
+        questions, using bulk inserts
+        :param pending: The questions and answers to save
+        :param duplicates: The data of the similar questions
+        :type pending: list[(Question, list[Answer])]
+        :type duplicates: list[dict[string, T]]
+        """
+        SimilarQuestion.objects.bulk_create(
+            SimilarQuestion.from_data(data, job=self.job)
+            for data in duplicates
+        )
+        if not pending:
+            return
+
+        questions = [question for question, answers in pending]
+        last_pk = Question.objects.order_by('-pk').values_list(
+            'pk', flat=True).first() or 0
+        Question.objects.bulk_create(questions)
+
+        # Not every database returns the primary keys of the new rows. They
+        # are looked up among the rows added after the last one, which
+        # assumes that questions are only added by a single writer at once
+        # (see import_questions and chm.jobs): a batch whose rows can not be
+        # told apart from concurrent ones is rolled back.
+        if questions[0].pk is None:
+            pks = {}
+            texts = set(question.text for question in questions)
+            for chunk in chunks(texts, self.LOOKUP_SIZE):
+                for pk, topic_id, text in Question.objects.filter(
+                        pk__gt=last_pk,
+                        text__in=chunk
+                ).values_list('pk', 'topic_id', 'text'):
+                    pks.setdefault((topic_id, text), []).append(pk)
+            for question in questions:
+                found = pks.get((question.topic_id, question.text), [])
+                if len(found) != 1:
+                    raise DatabaseError(
+                        'questions were added concurrently, the batch can '
+                        'not be saved')
+                question.pk = found[0]
+
+        for question, answers in pending:
+            for answer in answers:
+                answer.question = question
+        Answer.objects.bulk_create(
+            answer for question, answers in pending for answer in answers
+        )
+        QuestionGram.objects.index(questions)
+        invalidate_questions(question.pk for question in questions)
+        # bulk inserts do not send the signals keeping the counters
+        TopicDifficultyCount.objects.add(Counter(
+            (question.topic_id, question.difficulty) for question in questions
+        ))
+
+
+def file_hash(f, chunk_size=64 * 1024):
+    """
+    Compute the hash identifying the contents of a file. The file is read
+    from the beginning and left at the beginning.
+    :param f: A file opened in binary mode
+    :param chunk_size: The amount of bytes read at once
+    :type chunk_size: int
+    :return: The hexadecimal SHA-256 digest of the file
+    :rtype: string
+    """
+    digest = hashlib.sha256()
+    f.seek(0)
+    for chunk in iter(lambda: f.read(chunk_size), b''):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def resume_load(loader, digest, questions, on_batch=None):
+    """
+    Load the questions of a file with a non atomic loader, recording a
+    checkpoint with every committed batch. The questions committed by a
+    previous load of the same file are skipped, without validating them
+    again.
+    :param loader: The loader used to load the questions
+    :param digest: The hash of the file (see file_hash)
+    :param questions: The data of all the questions of the file, in order
+    :param on_batch: Called for every batch, as in QuestionLoader.load
+    :type loader: QuestionLoader
+    :type digest: string
+    :type questions: iterable[dict[string, T]]
+    :type on_batch: callable
+    :return: The amount of questions skipped
+    :rtype: int
+    """
+    assert not loader.atomic, 'Atomic loads can not be resumed'
+    checkpoint, created = ImportCheckpoint.objects.get_or_create(
+        file_hash=digest
+    )
+    checkpoints = ImportCheckpoint.objects.filter(pk=checkpoint.pk)
+
+    def checkpoint_batch(processed, added, duplicates):
+        checkpoints.update(processed=F('processed') + processed)
+        if on_batch is not None:
+            on_batch(processed, added, duplicates)
+
+    questions = iter(questions)
+    skipped = 0
+    for data in islice(questions, checkpoint.processed):
+        skipped += 1
+    loader.mm.skipped += skipped
+    loader.load(questions, checkpoint_batch)
+    return skipped
+
+
+def accept_similar_questions(similar_questions, mm,
+                             batch_size=QuestionLoader.BATCH_SIZE):
+    """
+    Load the given staged questions regardless of the existence of similar
+    questions. The questions which are added are removed from the staging
+    table, the ones rejected for any other reason are kept.
+    :param similar_questions: The staged questions to accept
+    :param mm: A message manager to handle messages
+    :param batch_size: The amount of questions saved at once
+    :type similar_questions: iterable[SimilarQuestion]
+    :type mm: messages.LoadQuestionsMessageManager
+    :type batch_size: int
+    """
+    similar_questions = list(similar_questions)
+    loader = QuestionLoader(mm, batch_size=batch_size, ignore_similar=True)
+    loader.load(sq.to_data() for sq in similar_questions)
+
+    added = set((q.topic.subject.name, q.topic.name, q.text)
+                for q in mm.added)
+    SimilarQuestion.objects.filter(pk__in=[
+        sq.pk for sq in similar_questions
+        if (sq.subject, sq.topic, sq.text) in added
+    ]).delete()
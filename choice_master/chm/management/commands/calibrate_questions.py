@@ -0,0 +1,69 @@
+import numpy as np
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import FloatField
+from django.db.models import Value
+from django.db.models import When
+
+from chm.irt import ITERATIONS
+from chm.irt import calibrate
+from chm.irt import difficulty_to_logit
+from chm.irt import to_arrays
+from chm.loader import chunks
+from chm.models import Question
+from chm.models import QuestionOnQuiz
+
+
+class Command(BaseCommand):
+    help = 'Fit the difficulty of the questions to all the answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=ITERATIONS,
+                            help='Amount of Newton steps')
+        parser.add_argument('--chunk-size', type=int, default=250,
+                            help='Amount of questions read and updated at '
+                                 'once')
+
+    def handle(self, *args, **options):
+        answers = QuestionOnQuiz.objects.exclude(
+            state=QuestionOnQuiz.STATUS.not_answered
+        ).values_list('quiz__user', 'question', 'state')
+        users, questions, states = to_arrays(answers.iterator(), 3)
+        if not len(questions):
+            self.stdout.write('There are no answers to calibrate with')
+            return
+
+        # number the users and the questions from 0
+        user_ids, users = np.unique(users.astype(int), return_inverse=True)
+        question_ids, questions = np.unique(questions.astype(int),
+                                            return_inverse=True)
+        real = {}
+        for chunk in chunks(question_ids.tolist(), options['chunk_size']):
+            real.update(Question.objects.filter(
+                pk__in=chunk
+            ).values_list('pk', 'real_difficulty'))
+
+        difficulties, abilities = calibrate(
+            users, questions,
+            (states == QuestionOnQuiz.STATUS.right).astype(float),
+            len(user_ids),
+            difficulty_to_logit([real[pk] for pk in question_ids.tolist()]),
+            iterations=options['iterations'],
+        )
+
+        # a single query updates every chunk of questions
+        with transaction.atomic():
+            for chunk in chunks(zip(question_ids.tolist(),
+                                    difficulties.tolist()),
+                                options['chunk_size']):
+                Question.objects.filter(
+                    pk__in=[pk for pk, b in chunk]
+                ).update(calibrated_difficulty=Case(
+                    *[When(pk=pk, then=Value(b)) for pk, b in chunk],
+                    output_field=FloatField()
+                ))
+        self.stdout.write(
+            'Calibrated {} questions with {} answers of {} users'.format(
+                len(question_ids), len(states), len(user_ids)))
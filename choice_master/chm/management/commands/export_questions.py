@@ -0,0 +1,54 @@
+import io
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from chm.export import CHUNK_SIZE
+from chm.export import EXPORTERS
+from chm.export import iter_questions
+from chm.models import Question
+
+
+class Command(BaseCommand):
+    help = 'Export the questions and their answers to XML or JSON Lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(EXPORTERS),
+                            default='xml', help='Format of the export')
+        parser.add_argument('--output', default='-',
+                            help='File to write, the standard output by '
+                                 'default')
+        parser.add_argument('--subject',
+                            help='Export only the questions of this subject')
+        parser.add_argument('--topic',
+                            help='Export only the questions of this topic')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE,
+                            help='Amount of questions fetched at once')
+
+    def handle(self, *args, **options):
+        questions = Question.objects.all()
+        if options['subject']:
+            questions = questions.filter(
+                topic__subject__name=options['subject'])
+        if options['topic']:
+            questions = questions.filter(topic__name=options['topic'])
+
+        exporter = EXPORTERS[options['format']]()
+        if not exporter.exportable(questions):
+            raise CommandError('There are no questions to export')
+        chunks = exporter.export(iter_questions(questions,
+                                                options['chunk_size']))
+        if options['output'] == '-':
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
+        else:
+            with io.open(options['output'], 'w', encoding='utf-8') as f:
+                for chunk in chunks:
+                    f.write(chunk)
+
+        # the summary does not go to the standard output, which may be the
+        # export itself
+        self.stderr.write('Exported {} questions'.format(exporter.exported))
+        if exporter.skipped:
+            self.stderr.write('Skipped {} questions without correct answers'
+                              .format(exporter.skipped))
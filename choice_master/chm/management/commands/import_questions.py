@@ -0,0 +1,153 @@
+import glob
+import multiprocessing
+import time
+
+from django.contrib import messages
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.db import connection
+from lxml.etree import XMLSyntaxError
+
+from chm.loader import QuestionLoader
+from chm.loader import chunks
+from chm.loader import file_hash
+from chm.loader import resume_load
+from chm.models import ImportCheckpoint
+from chm.messages import LoadQuestionsMessageManager
+from chm.xml import XMLParser
+
+
+# chunks of questions of each file which are kept in memory while the
+# previous files are loaded
+QUEUE_SIZE = 4
+
+
+def parse_file(path, queue, chunk_size):
+    """
+    Parse and validate the questions of the given file as a stream, putting
+    them in the given queue in chunks of chunk_size questions, so that the
+    memory used does not depend on the size of the file. This function
+    runs in the worker processes. The first item put in the queue is the
+    hash of the file, then ('questions', list) for every chunk and finally
+    ('end', error), the error being None if the whole file was parsed.
+    :param path: The path of the file
+    :param queue: The queue receiving the questions
+    :param chunk_size: The amount of questions of every chunk
+    :type path: string
+    :type queue: multiprocessing.Queue
+    :type chunk_size: int
+    """
+    try:
+        with open(path, 'rb') as f:
+            queue.put(('hash', file_hash(f)))
+            for chunk in chunks(XMLParser(f).parse_questions(), chunk_size):
+                queue.put(('questions', chunk))
+    except (IOError, XMLSyntaxError) as err:
+        queue.put(('end', str(err)))
+    except Exception as err:
+        # the command waits for the end of every file
+        queue.put(('end', 'unexpected error: {!r}'.format(err)))
+    else:
+        queue.put(('end', None))
+
+
+def receive(queue, result):
+    """
+    Yield the questions put in the queue by parse_file, in order, and keep
+    the amount of questions and the error found in result
+    :type queue: multiprocessing.Queue
+    :type result: dict[string, T]
+    :rtype: iterable[dict[string, T]]
+    """
+    while True:
+        kind, value = queue.get()
+        if kind == 'end':
+            result['error'] = value
+            return
+        result['questions'] += len(value)
+        for data in value:
+            yield data
+
+
+class Command(BaseCommand):
+    help = 'Load the questions of the given XML files into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+',
+                            help='Files or glob patterns of files to load')
+        parser.add_argument('--workers', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Amount of processes parsing files')
+        parser.add_argument('--batch-size', type=int,
+                            default=QuestionLoader.BATCH_SIZE,
+                            help='Amount of questions saved at once')
+        parser.add_argument('--ignore-similar', action='store_true',
+                            help='Load questions even if similar ones exist')
+        parser.add_argument('--restart', action='store_true',
+                            help='Load the files from the beginning, even if '
+                                 'a previous load was interrupted')
+
+    def handle(self, *args, **options):
+        paths = []
+        for pattern in options['paths']:
+            matches = sorted(glob.glob(pattern))
+            if not matches:
+                raise CommandError('No file matches {}'.format(pattern))
+            paths.extend(p for p in matches if p not in paths)
+
+        mm = LoadQuestionsMessageManager()
+        loader = QuestionLoader(mm, batch_size=options['batch_size'],
+                                ignore_similar=options['ignore_similar'],
+                                atomic=False)
+        processed = 0
+        skipped = 0
+        start = time.time()
+
+        # Files are parsed and validated by a pool of processes, while this
+        # process is the only one writing to the database. The questions
+        # are sent back in chunks through a bounded queue per file, which
+        # is read once the previous files are loaded.
+        connection.close()
+        manager = multiprocessing.Manager()
+        pool = multiprocessing.Pool(options['workers'])
+        try:
+            queues = []
+            for path in paths:
+                queue = manager.Queue(QUEUE_SIZE)
+                pool.apply_async(parse_file,
+                                 (path, queue, options['batch_size']))
+                queues.append((path, queue))
+
+            for path, queue in queues:
+                kind, digest = queue.get()
+                if kind == 'end':
+                    self.stderr.write('{}: {}'.format(path, digest))
+                    continue
+                if options['restart']:
+                    ImportCheckpoint.objects.filter(file_hash=digest).delete()
+                result = {'questions': 0, 'error': None}
+                count = resume_load(loader, digest, receive(queue, result))
+                if result['error'] is not None:
+                    # the questions before the error were loaded
+                    self.stderr.write('{}: {}'.format(path, result['error']))
+                processed += result['questions'] - count
+                skipped += count
+                self.stdout.write('{}: {} questions ({} already loaded)'
+                                  .format(path, result['questions'], count))
+        finally:
+            pool.terminate()
+            manager.shutdown()
+
+        elapsed = time.time() - start
+        for level, msg in mm.get_messages():
+            if level == messages.ERROR:
+                self.stderr.write(str(msg))
+
+        self.stdout.write(
+            'Added {} of {} questions from {} files ({} similar to existing '
+            'ones pending review, {} already loaded) in {:.2f} seconds '
+            '({:.1f} questions/sec)'
+            .format(len(mm.added), processed, len(paths), mm.similar,
+                    skipped, elapsed,
+                    processed / elapsed if elapsed else 0.0)
+        )
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import IntegerField
+from django.db.models import Sum
+from django.db.models import When
+
+from chm.loader import chunks
+from chm.models import QuestionMastery
+from chm.models import QuestionOnQuiz
+from chm.models import Quiz
+
+RIGHT = QuestionOnQuiz.STATUS.right
+WRONG = QuestionOnQuiz.STATUS.wrong
+NOT_ANSWERED = QuestionOnQuiz.STATUS.not_answered
+
+
+def count(**conditions):
+    return Sum(Case(When(then=1, **conditions), default=0,
+                    output_field=IntegerField()))
+
+
+class Command(BaseCommand):
+    help = 'Compute the mastery of every user from the history of answers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Amount of rows inserted at once')
+
+    def handle(self, *args, **options):
+        history = QuestionOnQuiz.objects.values(
+            'quiz__user', 'question'
+        ).annotate(
+            right=count(state=RIGHT),
+            wrong=count(state=WRONG),
+            # the blanks are recorded when the quiz is finished
+            blank=count(state=NOT_ANSWERED,
+                        quiz__state=Quiz.STATUS.finished),
+        ).order_by('quiz__user', 'question')
+
+        rows = (
+            QuestionMastery(
+                user_id=row['quiz__user'],
+                question_id=row['question'],
+                right=row['right'],
+                wrong=row['wrong'],
+                blank=row['blank'],
+                score=(row['right'] * QuestionMastery.WEIGHTS[RIGHT] +
+                       row['wrong'] * QuestionMastery.WEIGHTS[WRONG] +
+                       row['blank'] * QuestionMastery.WEIGHTS[NOT_ANSWERED]),
+            )
+            for row in history.iterator()
+            if row['right'] or row['wrong'] or row['blank']
+        )
+
+        total = 0
+        with transaction.atomic():
+            QuestionMastery.objects.all().delete()
+            for chunk in chunks(rows, options['chunk_size']):
+                QuestionMastery.objects.bulk_create(chunk)
+                total += len(chunk)
+        self.stdout.write('Recorded the mastery of {} questions'.format(total))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from chm.models import Question
+from chm.models import QuestionGram
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the index used to look for similar questions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Amount of questions indexed at once')
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+        total = 0
+        with transaction.atomic():
+            QuestionGram.objects.all().delete()
+            last_pk = 0
+            while True:
+                chunk = list(Question.objects.filter(
+                    pk__gt=last_pk
+                ).order_by('pk')[:chunk_size])
+                if not chunk:
+                    break
+                QuestionGram.objects.index(chunk)
+                last_pk = chunk[-1].pk
+                total += len(chunk)
+        self.stdout.write('Indexed {} questions'.format(total))
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import IntegerField
+from django.db.models import Max
+from django.db.models import Sum
+from django.db.models import When
+
+from chm.loader import chunks
+from chm.models import QuestionOnQuiz
+from chm.models import Quiz
+from chm.models import TopicStats
+
+
+def count(state):
+    return Sum(Case(When(state=state, then=1), default=0,
+                    output_field=IntegerField()))
+
+
+class Command(BaseCommand):
+    help = 'Compute the statistics of every user from the finished quizzes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000,
+                            help='Amount of rows inserted at once')
+
+    def handle(self, *args, **options):
+        history = QuestionOnQuiz.objects.filter(
+            quiz__state=Quiz.STATUS.finished
+        ).values(
+            'quiz__user', 'question__topic'
+        ).annotate(
+            right=count(QuestionOnQuiz.STATUS.right),
+            wrong=count(QuestionOnQuiz.STATUS.wrong),
+            blank=count(QuestionOnQuiz.STATUS.not_answered),
+            # the quizzes only record when they started
+            last_activity=Max('quiz__datetime'),
+        ).order_by('quiz__user', 'question__topic')
+
+        rows = (
+            TopicStats(
+                user_id=row['quiz__user'],
+                topic_id=row['question__topic'],
+                right=row['right'],
+                wrong=row['wrong'],
+                blank=row['blank'],
+                last_activity=row['last_activity'],
+            )
+            for row in history.iterator()
+        )
+
+        total = 0
+        with transaction.atomic():
+            TopicStats.objects.all().delete()
+            for chunk in chunks(rows, options['chunk_size']):
+                TopicStats.objects.bulk_create(chunk)
+                total += len(chunk)
+        self.stdout.write('Recorded the statistics of {} topics'.format(total))
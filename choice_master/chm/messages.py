@@ -11,7 +11,12 @@ class LoadQuestionsMessageManager():
     INVALID_FORM = _('Please, select a valid file.')
     NO_SUBJECT = _('Not added (The subject "{0}" does not exist): "{1}"')
     NO_TOPIC = _('Not added (The topic "{0}" does not exist): "{1}"')
+    SIMILAR = _('Not added {0} questions because similar questions exist. '
+                'They are waiting to be reviewed in "Similar questions".')
+    SKIPPED = _('Skipped {0} questions already loaded by a previous load of '
+                'the same file')
     SYNTAX_ERROR = _('Syntax error:  "{0}"')
+    FAILURE = _('The load was interrupted by an unexpected error: "{0}"')
     VALIDATION_ERROR = _('{0}. In question "{1}"')
 
     def __init__(self):
@@ -20,32 +25,60 @@ class LoadQuestionsMessageManager():
         self.form_is_valid = True
         self.no_subject = []
         self.no_topic = []
+        self.similar = 0
+        self.skipped = 0
         self.syntax_error = None
+        self.failure = None
         self.validation_error = []
 
-    def set_messages(self, request):
+    def get_messages(self):
         """
-        Set all the messages using django.contrib.messages.
+        Return all the messages as a list of (level, message) pairs.
         Call this function once every question has been processed.
-        :param request: The request
-        :type request: HttpRequest
+        :return: The messages
+        :rtype: list[(int, string)]
         """
+        result = []
         if self.added:
-            messages.success(request, self.ADDED.format(len(self.added)))
+            result.append((messages.SUCCESS,
+                           self.ADDED.format(len(self.added))))
+
+        if self.skipped:
+            result.append((messages.INFO,
+                           self.SKIPPED.format(self.skipped)))
+
+        if self.similar:
+            result.append((messages.WARNING,
+                           self.SIMILAR.format(self.similar)))
 
         if not self.form_is_valid:
-            messages.error(request, self.INVALID_FORM)
+            result.append((messages.ERROR, self.INVALID_FORM))
 
         for s, q in self.no_subject:
-            messages.error(request, self.NO_SUBJECT.format(s, q))
+            result.append((messages.ERROR, self.NO_SUBJECT.format(s, q)))
 
         for t, q in self.no_topic:
-            messages.error(request, self.NO_TOPIC.format(t, q))
+            result.append((messages.ERROR, self.NO_TOPIC.format(t, q)))
 
         if self.syntax_error:
-            messages.error(request,
-                           self.SYNTAX_ERROR.format(self.syntax_error))
+            result.append((messages.ERROR,
+                           self.SYNTAX_ERROR.format(self.syntax_error)))
+
+        if self.failure:
+            result.append((messages.ERROR,
+                           self.FAILURE.format(self.failure)))
 
         for e, q in self.validation_error:
             msg = self.VALIDATION_ERROR.format('; '.join(e.messages), q)
-            messages.error(request, msg)
+            result.append((messages.ERROR, msg))
+        return result
+
+    def set_messages(self, request):
+        """
+        Set all the messages using django.contrib.messages.
+        Call this function once every question has been processed.
+        :param request: The request
+        :type request: HttpRequest
+        """
+        for level, msg in self.get_messages():
+            messages.add_message(request, level, msg)
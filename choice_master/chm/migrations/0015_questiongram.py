@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:15
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from chm.similarity import qgrams
+
+
+def index_questions(apps, schema_editor):
+    Question = apps.get_model('chm', 'Question')
+    QuestionGram = apps.get_model('chm', 'QuestionGram')
+    for question in Question.objects.all().iterator():
+        QuestionGram.objects.bulk_create(
+            QuestionGram(topic_id=question.topic_id, question_id=question.pk,
+                         gram=gram)
+            for gram in qgrams(question.text)
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chm', '0014_auto_20161120_2335'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionGram',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('gram', models.CharField(max_length=3)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='grams', to='chm.Question')),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chm.Topic')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='questiongram',
+            index_together=set([('topic', 'gram')]),
+        ),
+        migrations.RunPython(index_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:26
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chm', '0015_questiongram'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('file', models.FileField(upload_to='imports')),
+                ('datetime', models.DateTimeField(auto_now_add=True)),
+                ('state', models.CharField(choices=[('pending', 'pending'), ('running', 'running'), ('finished', 'finished'), ('failed', 'failed')], default='pending', max_length=20)),
+                ('processed', models.IntegerField(default=0)),
+                ('added', models.IntegerField(default=0)),
+                ('rejected', models.IntegerField(default=0)),
+                ('duplicates', models.TextField(default='[]')),
+                ('messages', models.TextField(default='[]')),
+            ],
+        ),
+    ]
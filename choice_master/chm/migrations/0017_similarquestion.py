@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:30
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chm', '0016_importjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SimilarQuestion',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('subject', models.CharField(max_length=200)),
+                ('topic', models.CharField(max_length=200)),
+                ('text', models.CharField(max_length=300)),
+                ('data', models.TextField()),
+                ('datetime', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.RemoveField(
+            model_name='importjob',
+            name='duplicates',
+        ),
+        migrations.AddField(
+            model_name='similarquestion',
+            name='job',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='similar_questions', to='chm.ImportJob'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:37
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chm', '0018_importcheckpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuestionMastery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('right', models.IntegerField(default=0)),
+                ('wrong', models.IntegerField(default=0)),
+                ('blank', models.IntegerField(default=0)),
+                ('score', models.IntegerField(default=0)),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mastery', to='chm.Question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='questionmastery',
+            unique_together=set([('user', 'question')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='questionmastery',
+            index_together=set([('user', 'score')]),
+        ),
+    ]
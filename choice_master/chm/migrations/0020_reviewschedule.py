@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:39
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chm', '0019_questionmastery'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReviewSchedule',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('repetitions', models.IntegerField(default=0)),
+                ('interval', models.FloatField(default=0.0)),
+                ('ease', models.FloatField(default=2.5)),
+                ('due', models.DateTimeField()),
+                ('question', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='schedules', to='chm.Question')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='reviewschedule',
+            unique_together=set([('user', 'question')]),
+        ),
+        migrations.AlterIndexTogether(
+            name='reviewschedule',
+            index_together=set([('user', 'due')]),
+        ),
+    ]
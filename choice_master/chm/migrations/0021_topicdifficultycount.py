@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:40
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_questions(apps, schema_editor):
+    Question = apps.get_model('chm', 'Question')
+    TopicDifficultyCount = apps.get_model('chm', 'TopicDifficultyCount')
+    TopicDifficultyCount.objects.bulk_create(
+        TopicDifficultyCount(topic_id=row['topic'],
+                             difficulty=row['difficulty'],
+                             count=row['count'])
+        for row in Question.objects.values('topic', 'difficulty').annotate(
+            count=models.Count('pk')).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chm', '0020_reviewschedule'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicDifficultyCount',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('difficulty', models.IntegerField()),
+                ('count', models.IntegerField(default=0)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='counts', to='chm.Topic')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='topicdifficultycount',
+            unique_together=set([('topic', 'difficulty')]),
+        ),
+        migrations.RunPython(count_questions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:41
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chm', '0021_topicdifficultycount'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='question',
+            index_together=set([('topic', 'difficulty')]),
+        ),
+    ]
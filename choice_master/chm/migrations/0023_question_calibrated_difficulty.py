@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:43
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chm', '0022_question_topic_difficulty_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='calibrated_difficulty',
+            field=models.FloatField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+FIELDS = {
+    'not_answered': 'blank',
+    'right': 'right',
+    'wrong': 'wrong',
+}
+
+
+def save_results(apps, schema_editor):
+    Quiz = apps.get_model('chm', 'Quiz')
+    QuizSubjectResult = apps.get_model('chm', 'QuizSubjectResult')
+    QuestionOnQuiz = apps.get_model('chm', 'QuestionOnQuiz')
+    rows = QuestionOnQuiz.objects.filter(quiz__state='finished').values(
+        'quiz', 'question__topic__subject', 'state'
+    ).annotate(total=models.Count('pk')).order_by()
+
+    quizzes = {}
+    results = {}
+    for row in rows:
+        quiz = quizzes.setdefault(row['quiz'], dict.fromkeys(
+            FIELDS.values(), 0))
+        key = (row['quiz'], row['question__topic__subject'])
+        if key not in results:
+            results[key] = QuizSubjectResult(quiz_id=key[0],
+                                             subject_id=key[1])
+        field = FIELDS[row['state']]
+        quiz[field] += row['total']
+        setattr(results[key], field,
+                getattr(results[key], field) + row['total'])
+
+    for pk, counts in quizzes.items():
+        Quiz.objects.filter(pk=pk).update(**counts)
+    QuizSubjectResult.objects.bulk_create(results.values())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chm', '0023_question_calibrated_difficulty'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuizSubjectResult',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('right', models.IntegerField(default=0)),
+                ('wrong', models.IntegerField(default=0)),
+                ('blank', models.IntegerField(default=0)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='blank',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='right',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='wrong',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='quizsubjectresult',
+            name='quiz',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='results', to='chm.Quiz'),
+        ),
+        migrations.AddField(
+            model_name='quizsubjectresult',
+            name='subject',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='chm.Subject'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='quizsubjectresult',
+            unique_together=set([('quiz', 'subject')]),
+        ),
+        migrations.RunPython(save_results, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10.2 on 2026-10-18 10:53
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count(state):
+    return models.Sum(models.Case(models.When(state=state, then=1), default=0,
+                                  output_field=models.IntegerField()))
+
+
+def record_stats(apps, schema_editor):
+    QuestionOnQuiz = apps.get_model('chm', 'QuestionOnQuiz')
+    TopicStats = apps.get_model('chm', 'TopicStats')
+    TopicStats.objects.bulk_create(
+        TopicStats(user_id=row['quiz__user'],
+                   topic_id=row['question__topic'],
+                   right=row['right'],
+                   wrong=row['wrong'],
+                   blank=row['blank'],
+                   last_activity=row['last_activity'])
+        for row in QuestionOnQuiz.objects.filter(
+            quiz__state='finished'
+        ).values('quiz__user', 'question__topic').annotate(
+            right=count('right'),
+            wrong=count('wrong'),
+            blank=count('not_answered'),
+            last_activity=models.Max('quiz__datetime'),
+        ).order_by()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('chm', '0024_quiz_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TopicStats',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('right', models.IntegerField(default=0)),
+                ('wrong', models.IntegerField(default=0)),
+                ('blank', models.IntegerField(default=0)),
+                ('last_activity', models.DateTimeField(blank=True, null=True)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='stats', to='chm.Topic')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='topicstats',
+            unique_together=set([('user', 'topic')]),
+        ),
+        migrations.RunPython(record_stats, migrations.RunPython.noop),
+    ]
@@ -3,22 +3,44 @@ Models for app chm
 """
 
 # python imports
+import json
+from datetime import timedelta
 from allauth.account.signals import user_signed_up
 from model_utils import Choices
 from math import floor
 
 # django imports
 from django.db import models
+from django.db import transaction
+from django.db.models import Case
 from django.db.models import Count
+from django.db.models import F
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models import When
+from django.db.models.functions import Length
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_save
 from django.dispatch import receiver
 from django.contrib import messages
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from django.utils.translation import ugettext_lazy as _
 
 # project imports
 from choice_master import settings
+from chm.caches import invalidate_questions
+from chm.caches import questions_json
+from chm.repetition import INITIAL_EASE
+from chm.repetition import sm2
+from chm.similarity import MAX_DISTANCE
+from chm.similarity import QGRAM_SIZE
 from chm.similarity import is_similar
+from chm.similarity import min_shared_qgrams
+from chm.similarity import qgrams
+from chm.stats import learning_coeffs
 
 
 class XMLFile(models.Model):
@@ -30,6 +52,123 @@ class XMLFile(models.Model):
     file = models.FileField(upload_to=settings.MEDIA_ROOT)
 
 
+class ImportJob(models.Model):
+    """
+    An ImportJob is created every time a file of questions is uploaded. The
+    questions are loaded in background (see chm.jobs) and the job keeps
+    track of the progress, so that it can be polled while it runs.
+    """
+
+    STATUS = Choices(
+        'pending',
+        'running',
+        'finished',
+        'failed',
+    )
+
+    file = models.FileField(upload_to='imports')
+    datetime = models.DateTimeField(auto_now_add=True)
+    state = models.CharField(choices=STATUS,
+                             default=STATUS.pending,
+                             max_length=20)
+
+    # amount of questions processed so far, and how many of them were
+    # added to the database or rejected
+    processed = models.IntegerField(default=0)
+    added = models.IntegerField(default=0)
+    rejected = models.IntegerField(default=0)
+
+    # JSON encoded list of (level, message) pairs to show once finished
+    messages = models.TextField(default='[]')
+
+    # last time the job made progress, a job which does not make progress
+    # for a while was interrupted (see chm.jobs.fail_stale_jobs)
+    updated = models.DateTimeField(default=timezone.now)
+
+    def is_done(self):
+        """
+        :return: True only if the job is not going to make any more progress
+        :rtype: bool
+        """
+        return self.state in (self.STATUS.finished, self.STATUS.failed)
+
+    def to_json(self):
+        """
+        Converts an ImportJob to json format
+        :return: The progress of the job formated as a dictionary
+        :rtype: dict[string, T]
+        """
+        return {
+            'id': self.id,
+            'state': self.state,
+            'done': self.is_done(),
+            'processed': self.processed,
+            'added': self.added,
+            'rejected': self.rejected,
+        }
+
+
+class ImportCheckpoint(models.Model):
+    """
+    An ImportCheckpoint records how many questions of a file were already
+    loaded. It is identified by a hash of the contents of the file, so an
+    interrupted load resumes from the checkpoint when the same file is
+    loaded again, whether it is uploaded or given to import_questions.
+    """
+    file_hash = models.CharField(max_length=64, unique=True)
+
+    # amount of questions (in document order) whose batch was committed
+    processed = models.IntegerField(default=0)
+    datetime = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return '{} ({} questions)'.format(self.file_hash, self.processed)
+
+
+class SimilarQuestion(models.Model):
+    """
+    A question which was not loaded because a similar one already exists.
+    It stays in this staging table until an administrator accepts it, so
+    that it is loaded anyway, or rejects it.
+    """
+    subject = models.CharField(max_length=200)
+    topic = models.CharField(max_length=200)
+    text = models.CharField(max_length=300)
+
+    # JSON encoded data of the question, as returned by XMLParser
+    data = models.TextField()
+
+    # the job which tried to load the question, if any
+    job = models.ForeignKey('ImportJob', null=True, blank=True,
+                            on_delete=models.SET_NULL,
+                            related_name='similar_questions')
+    datetime = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def from_data(cls, data, job=None):
+        """
+        Create (without saving) a SimilarQuestion from the data of a
+        question, as returned by XMLParser
+        :param data: The data of the question
+        :param job: The job which tried to load the question
+        :type data: dict[string, T]
+        :type job: ImportJob
+        :rtype: SimilarQuestion
+        """
+        return cls(subject=data['subject'], topic=data['topic'],
+                   text=data['question'], data=json.dumps(data), job=job)
+
+    def to_data(self):
+        """
+        :return: The data of the question, as returned by XMLParser
+        :rtype: dict[string, T]
+        """
+        return json.loads(self.data)
+
+    def __str__(self):
+        return self.text
+
+
 class Subject(models.Model):
     """Subject Model"""
     name = models.CharField(max_length=200)
@@ -37,18 +176,12 @@ class Subject(models.Model):
 
     def learning_coeff(self, user):
         """
-        Return user knowledge as a float in [0..10]
+        Return user knowledge as a float in [0..100] (see learning_coeffs)
         :return: The user learning coefficient
         :rtype: float
         """
-
-        # get all topics, even if user didn't answer any questions yet
-        topics = self.topics.all()
-        try:
-            lc = sum([t.learning_coeff(user) for t in topics]) / topics.count()
-        except ZeroDivisionError:
-            lc = float()  # 0.0
-        return lc
+        subject_coeffs, topic_coeffs = learning_coeffs(user, [self.pk])
+        return subject_coeffs.get(self.pk, 0.0)
 
     def similar_exists(self):
         """
@@ -82,22 +215,13 @@ class Topic(models.Model):
 
     def learning_coeff(self, user):
         """
-        Return user knowledge as a float in [0..10]
+        Return user knowledge as a float in [0..100] (see learning_coeffs)
         :return: The user learning coefficient
         :rtype: float
         """
-        qoq = QuestionOnQuiz.objects.filter(
-            question__topic=self,
-            quiz__user=user,
-            quiz__state=Quiz.STATUS.finished,
-        ).exclude(state=QuestionOnQuiz.STATUS.not_answered)
-
-        correct = qoq.filter(state=QuestionOnQuiz.STATUS.right)
-        try:
-            lc = correct.count() / qoq.count()
-        except ZeroDivisionError:
-            lc = float()  # 0.0
-        return lc * 100
+        subject_coeffs, topic_coeffs = learning_coeffs(user,
+                                                       [self.subject_id])
+        return topic_coeffs.get(self.pk, 0.0)
 
     def similar_exists(self):
         """
@@ -136,6 +260,14 @@ class Question(models.Model):
     real_difficulty = models.FloatField(default=1.0)
     difficulty = models.IntegerField(default=1)
 
+    # difficulty in logits fitted to the answers of the users (see chm.irt
+    # and the calibrate_questions command)
+    calibrated_difficulty = models.FloatField(null=True, blank=True)
+
+    class Meta:
+        # used to sample questions of a topic and difficulty
+        index_together = (('topic', 'difficulty'),)
+
     @staticmethod
     def round_down(n):
         return int(n + 0.49)
@@ -170,18 +302,26 @@ class Question(models.Model):
         :return: True only if a similar question exists in the database
         :rtype: bool
         """
-        queryset = Question.objects.filter(
-            topic=self.topic
+        queryset = QuestionGram.objects.candidates(
+            self.topic_id, self.text
         ).exclude(pk=self.pk)
         for q in queryset:
             if is_similar(self.text, q.text):
                 return True
         return False
 
-    def clean(self):
+    def clean_difficulty(self):
+        """
+        Check the difficulty of the question is consistent with its real
+        difficulty.
+        :raise ValidationError: If the difficulty is inconsistent
+        """
         if self.difficulty != self.round_down(self.real_difficulty):
             raise ValidationError(_('The question has an inconsistent'
                                     'difficulty'))
+
+    def clean(self):
+        self.clean_difficulty()
         try:
             if self.is_repeated():
                 raise ValidationError(_('The question already exists'))
@@ -206,6 +346,131 @@ class Question(models.Model):
         return self.text
 
 
+class QuestionGramManager(models.Manager):
+    """Manager used to keep and query the similarity index"""
+
+    def index(self, questions):
+        """
+        Replace the q-grams stored for the given questions. This method
+        should be called every time the text or the topic of a question
+        changes.
+        :param questions: The questions to index
+        :type questions: list[Question]
+        """
+        self.filter(question__in=[q.pk for q in questions]).delete()
+        self.bulk_create(
+            QuestionGram(topic_id=q.topic_id, question_id=q.pk, gram=gram)
+            for q in questions
+            for gram in qgrams(q.text)
+        )
+
+    def candidates(self, topic, text):
+        """
+        Return the questions of the topic that might be similar to the text.
+        Any question which is not returned is guaranteed not to be similar,
+        so only the returned ones need to be compared with the text.
+        :param topic: The topic (or its primary key) of the questions
+        :param text: The text to compare
+        :type topic: Topic | int
+        :type text: string
+        :return: The candidate questions
+        :rtype: QuerySet
+        """
+        k = MAX_DISTANCE - 1
+        queryset = Question.objects.annotate(
+            length=Length('text')
+        ).filter(
+            topic=topic,
+            length__gte=len(text) - k,
+            length__lte=len(text) + k,
+        )
+
+        grams = qgrams(text)
+        needed = min_shared_qgrams(grams)
+        if needed > 0:
+            ids = self.filter(
+                topic=topic,
+                gram__in=grams,
+            ).values('question').annotate(
+                shared=Count('id')
+            ).filter(
+                shared__gte=needed
+            ).values('question')
+            queryset = queryset.filter(pk__in=ids)
+        return queryset
+
+
+class QuestionGram(models.Model):
+    """
+    A q-gram of the text of a question. Questions are indexed by the
+    q-grams of their texts, so that looking for similar questions only
+    requires to compare the questions that share enough q-grams.
+    """
+    topic = models.ForeignKey('Topic')
+    question = models.ForeignKey('Question', related_name='grams')
+    gram = models.CharField(max_length=QGRAM_SIZE)
+
+    objects = QuestionGramManager()
+
+    class Meta:
+        index_together = (('topic', 'gram'),)
+
+
+class TopicDifficultyCountManager(models.Manager):
+    """Manager used to keep and query the amount of questions"""
+
+    def add(self, counts):
+        """
+        Add the given amounts to the counters
+        :param counts: The amount of questions to add (negative to remove)
+        of each (topic, difficulty) pair
+        :type counts: dict[(int, int), int]
+        """
+        for (topic_id, difficulty), amount in counts.items():
+            if amount == 0:
+                continue
+            updated = self.filter(
+                topic_id=topic_id,
+                difficulty=difficulty
+            ).update(count=F('count') + amount)
+            # when a topic is deleted its counters may go before its
+            # questions, so they are never created to be decremented
+            if not updated and amount > 0:
+                self.create(topic_id=topic_id, difficulty=difficulty,
+                            count=amount)
+
+    def questions(self, topics, min_difficulty=None):
+        """
+        Return the amount of questions of the given topics
+        :param topics: The topics
+        :param min_difficulty: Count only the questions of at least this
+        difficulty
+        :type topics: iterable[Topic]
+        :type min_difficulty: int
+        :rtype: int
+        """
+        counts = self.filter(topic__in=topics)
+        if min_difficulty is not None:
+            counts = counts.filter(difficulty__gte=min_difficulty)
+        return counts.aggregate(total=Sum('count'))['total'] or 0
+
+
+class TopicDifficultyCount(models.Model):
+    """
+    The amount of questions of a topic with a given difficulty. It is kept
+    up to date every time a question is created, deleted or voted, so the
+    questions meeting some criteria are counted without reading them.
+    """
+    topic = models.ForeignKey('Topic', related_name='counts')
+    difficulty = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    objects = TopicDifficultyCountManager()
+
+    class Meta:
+        unique_together = (('topic', 'difficulty'),)
+
+
 class Answer(models.Model):
     """Answer Model"""
     text = models.CharField(max_length=300)
@@ -284,33 +549,192 @@ class Quiz(models.Model):
                              default=STATUS.in_progress,
                              max_length=20)
 
-    def score(self, **kwargs):
+    # RESULT (see save_result)
+
+    # amount of questions answered right, wrong or left blank, only
+    # computed when the quiz finishes
+    right = models.IntegerField(default=0)
+    wrong = models.IntegerField(default=0)
+    blank = models.IntegerField(default=0)
+
+    def finish(self):
+        """
+        Set the quiz as finished and save its result (see save_result). The
+        questions the user did not answer are recorded as left blank in the
+        mastery of the user (see QuestionMastery). Finishing a quiz twice
+        has no effect.
+        """
+        with transaction.atomic():
+            finished = Quiz.objects.filter(pk=self.pk).exclude(
+                state=Quiz.STATUS.finished
+            ).update(state=Quiz.STATUS.finished)
+            self.state = Quiz.STATUS.finished
+            if not finished:
+                return
+
+            blank = QuestionOnQuiz.objects.filter(
+                quiz=self,
+                state=QuestionOnQuiz.STATUS.not_answered
+            ).values_list('question_id', flat=True)
+            blank = list(blank)
+            QuestionMastery.objects.add(self.user_id, blank,
+                                        QuestionOnQuiz.STATUS.not_answered)
+            ReviewSchedule.objects.review(self.user_id, blank,
+                                          QuestionOnQuiz.STATUS.not_answered)
+            counts = self.count_answers()
+            self.save_result(counts)
+            TopicStats.objects.add(self.user_id, counts)
+
+    def abort(self):
+        """
+        Set the quiz as aborted. If the quiz was finished, its answers are
+        taken out of the statistics of the user (see TopicStats).
+        """
+        with transaction.atomic():
+            state = Quiz.objects.select_for_update().filter(
+                pk=self.pk
+            ).values_list('state', flat=True).get()
+            Quiz.objects.filter(pk=self.pk).update(state=Quiz.STATUS.aborted)
+            self.state = Quiz.STATUS.aborted
+            if state == Quiz.STATUS.finished:
+                TopicStats.objects.add(self.user_id, self.count_answers(), -1)
+
+    def count_answers(self):
+        """
+        Count the questions of the quiz in each state for each topic, with a
+        single aggregate query
+        :return: The topic, its subject, the state and the amount of
+        questions of every topic and state
+        :rtype: list[dict[string, T]]
+        """
+        return list(QuestionOnQuiz.objects.filter(quiz=self).values(
+            'question__topic', 'question__topic__subject', 'state'
+        ).annotate(total=Count('pk')).order_by())
+
+    def save_result(self, counts):
+        """
+        Save the amount of questions in each state, in total and for each
+        subject of the quiz (see QuizSubjectResult), so that the results of
+        the quiz are shown without counting its answers again.
+        :param counts: The answers of the quiz (see count_answers)
+        :type counts: list[dict[string, T]]
+        """
+        results = {}
+        self.right = self.wrong = self.blank = 0
+        for row in counts:
+            subject_id = row['question__topic__subject']
+            if subject_id not in results:
+                results[subject_id] = QuizSubjectResult(quiz=self,
+                                                        subject_id=subject_id)
+            field = QuestionMastery.FIELDS[row['state']]
+            for result in (self, results[subject_id]):
+                setattr(result, field, getattr(result, field) + row['total'])
+
+        with transaction.atomic():
+            Quiz.objects.filter(pk=self.pk).update(
+                right=self.right, wrong=self.wrong, blank=self.blank)
+            QuizSubjectResult.objects.filter(quiz=self).delete()
+            QuizSubjectResult.objects.bulk_create(results.values())
+
+    def lock(self):
+        """
+        Lock the quiz until the end of the current transaction, so that it
+        does not finish (see finish) while answers are being saved
+        :return: Whether the quiz is in progress
+        :rtype: bool
+        """
+        return bool(Quiz.objects.select_for_update().filter(
+            pk=self.pk,
+            state=Quiz.STATUS.in_progress
+        ).values_list('pk', flat=True))
+
+    def answer(self, states):
+        """
+        Save the answers of the user to several questions at once, with a
+        single update, and record them in the mastery of the user (see
+        QuestionOnQuiz.answer). Questions which are not in the quiz are
+        ignored, and so are all the answers if the quiz is not in progress,
+        since its result was already recorded.
+        :param states: The state of the answer (right or wrong) to each
+        question, by the primary key of the question
+        :type states: dict[int, string]
+        :return: The amount of questions answered
+        :rtype: int
+        """
+        with transaction.atomic():
+            if not self.lock():
+                return 0
+            qoqs = list(QuestionOnQuiz.objects.select_for_update().filter(
+                quiz=self,
+                question_id__in=list(states)
+            ))
+            changed = [qoq for qoq in qoqs
+                       if qoq.state != states[qoq.question_id]]
+            if not changed:
+                return len(qoqs)
+
+            old_states = {}
+            new_states = {}
+            for qoq in changed:
+                old_states.setdefault(qoq.state, []).append(qoq.question_id)
+                qoq.state = states[qoq.question_id]
+                new_states.setdefault(qoq.state, []).append(qoq.question_id)
+
+            QuestionOnQuiz.objects.filter(
+                pk__in=[qoq.pk for qoq in changed]
+            ).update(state=Case(
+                *[When(question_id__in=pks, then=Value(state))
+                  for state, pks in new_states.items()],
+                output_field=models.CharField()
+            ))
+
+            for state, pks in old_states.items():
+                if state != QuestionOnQuiz.STATUS.not_answered:
+                    QuestionMastery.objects.add(self.user_id, pks, state, -1)
+            for state, pks in new_states.items():
+                QuestionMastery.objects.add(self.user_id, pks, state)
+                ReviewSchedule.objects.review(self.user_id, pks, state)
+        return len(qoqs)
+
+    def score(self):
         """
-        Return float indicating ratio of correct answers
-        :return: The ratio of correct answers
+        Return the percentage of right answers of the finished quiz
+        :return: The percentage of right answers
         :rtype: float
         """
-        qq = QuestionOnQuiz.objects.filter(quiz=self, **kwargs)
-        correct = qq.filter(state=QuestionOnQuiz.STATUS.right)
-        try:
-            score = correct.count() / qq.count()
-        except ZeroDivisionError:
-            score = 0
-        return score * 100
+        total = self.right + self.wrong + self.blank
+        return 100 * self.right / total if total else 0
 
     def detailed_score(self):
         """
-        Return queryset detailing total amount of answers in each state
-        :return: The total amount of answers in each state
-        :rtype: QuerySet
+        Return the total amount of answers in each state of the finished
+        quiz, leaving out the states without answers
+        :return: The state and total of answers of each state
+        :rtype: list[dict[string, T]]
+        """
+        return [{'state': state, 'total': getattr(self, field)}
+                for state, field in sorted(QuestionMastery.FIELDS.items())
+                if getattr(self, field)]
+
+    def prefetch(self, question_ids):
+        """
+        Fetch the json of the questions of the quiz, with a single read of
+        the cache and at most two queries for the questions which are not
+        cached (see questions_json), so that to_json does not query them
+        :param question_ids: The primary keys of the questions of the quiz,
+        in order
+        :type question_ids: list[int]
         """
-        qq = QuestionOnQuiz.objects.filter(quiz=self)
-        return qq.values('state').annotate(total=Count('state'))
+        payloads = questions_json(question_ids)
+        self._prefetched_questions = [payloads[pk] for pk in question_ids]
 
     def to_json(self, exclude_answered=False):
         """"
         Converts a Quiz to json format. Only save id and seconds to
-        use them later.
+        use them later. The questions are read from the cache (see
+        questions_json), so only the questions of the quiz are queried when
+        all of them are cached, and nothing at all if they were prefetched
+        (see prefetch).
         :return: An quiz formated as a dictionary
         :rtype: dict[string, T]
         """
@@ -319,17 +743,45 @@ class Quiz(models.Model):
             'seconds': self.seconds_per_question,
         }
 
-        questions_qs = QuestionOnQuiz.objects.filter(quiz=self)
+        prefetched = getattr(self, '_prefetched_questions', None)
+        if prefetched is not None and not exclude_answered:
+            result['questions'] = prefetched
+            return result
 
+        questions = self.questions.order_by('pk')
         if exclude_answered:
-            questions_qs = questions_qs.filter(
-                state=QuestionOnQuiz.STATUS.not_answered
-            )
+            questions = questions.filter(
+                state=QuestionOnQuiz.STATUS.not_answered)
+        pks = list(questions.values_list('question_id', flat=True))
 
-        result['questions'] = [qoq.question.to_json() for qoq in questions_qs]
+        payloads = questions_json(pks)
+        result['questions'] = [payloads[pk] for pk in pks]
         return result
 
 
+class QuizSubjectResult(models.Model):
+    """
+    The result of a finished quiz on the questions of one of its subjects,
+    saved when the quiz finishes (see Quiz.save_result)
+    """
+    quiz = models.ForeignKey('Quiz', related_name='results')
+    subject = models.ForeignKey('Subject')
+    right = models.IntegerField(default=0)
+    wrong = models.IntegerField(default=0)
+    blank = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = (('quiz', 'subject'),)
+
+    def score(self):
+        """
+        Return the percentage of right answers on the subject
+        :rtype: float
+        """
+        total = self.right + self.wrong + self.blank
+        return 100 * self.right / total if total else 0
+
+
 class QuestionOnQuiz(models.Model):
     """
     A question on a Quiz deserves its own table.
@@ -359,6 +811,350 @@ class QuestionOnQuiz(models.Model):
                              default=STATUS.not_answered,
                              max_length=20)
 
+    def answer(self, state):
+        """
+        Save the answer of the user, given by its state, and record it in
+        the mastery of the user (see QuestionMastery). A previous answer to
+        the same question is forgotten. The answer is ignored if the quiz is
+        not in progress, since its result (and its blanks) were already
+        recorded when it finished.
+        :param state: The state of the answer: right or wrong
+        :type state: string
+        :return: Whether the answer was saved
+        :rtype: bool
+        """
+        with transaction.atomic():
+            if not self.quiz.lock():
+                return False
+            old_state = self.state
+            self.state = state
+            self.save()
+            if old_state == state:
+                return True
+            user_id = self.quiz.user_id
+            if old_state != self.STATUS.not_answered:
+                QuestionMastery.objects.add(user_id, [self.question_id],
+                                            old_state, -1)
+            QuestionMastery.objects.add(user_id, [self.question_id], state)
+            ReviewSchedule.objects.review(user_id, [self.question_id], state)
+        return True
+
+
+class QuestionMasteryManager(models.Manager):
+    """Manager used to keep the mastery of the users up to date"""
+
+    def add(self, user_id, question_ids, state, amount=1):
+        """
+        Record that the given user answered the given questions with the
+        given state. The rows of the questions the user never saw are
+        created.
+        :param user_id: The primary key of the user
+        :param question_ids: The primary keys of the questions
+        :param state: The state of the answers (see QuestionOnQuiz.STATUS)
+        :param amount: How many answers to record, negative to forget them
+        :type user_id: int
+        :type question_ids: list[int]
+        :type state: string
+        :type amount: int
+        """
+        if not question_ids:
+            return
+        field = self.model.FIELDS[state]
+        score = self.model.WEIGHTS[state] * amount
+
+        with transaction.atomic():
+            rows = self.filter(user_id=user_id, question_id__in=question_ids)
+            existing = set(rows.values_list('question_id', flat=True))
+            rows.update(**{field: F(field) + amount,
+                           'score': F('score') + score})
+            self.bulk_create(
+                self.model(user_id=user_id, question_id=pk,
+                           score=score, **{field: amount})
+                for pk in question_ids if pk not in existing
+            )
+
+
+class QuestionMastery(models.Model):
+    """
+    How well a user masters a question: the amount of times the user
+    answered it right or wrong or left it blank, and a score weighting
+    them. It is updated every time the user answers a question, and the
+    blanks every time the user finishes a quiz, so the questions can be
+    ordered by score without going through the history of the user.
+    Run the rebuild_question_mastery command to compute it from scratch.
+    """
+    # weight of each answer in the score
+    WEIGHTS = {
+        QuestionOnQuiz.STATUS.not_answered: 1,
+        QuestionOnQuiz.STATUS.right: -1,
+        QuestionOnQuiz.STATUS.wrong: 2,
+    }
+    # field counting each kind of answer
+    FIELDS = {
+        QuestionOnQuiz.STATUS.not_answered: 'blank',
+        QuestionOnQuiz.STATUS.right: 'right',
+        QuestionOnQuiz.STATUS.wrong: 'wrong',
+    }
+
+    user = models.ForeignKey(User)
+    question = models.ForeignKey('Question', related_name='mastery')
+    right = models.IntegerField(default=0)
+    wrong = models.IntegerField(default=0)
+    blank = models.IntegerField(default=0)
+    score = models.IntegerField(default=0)
+
+    objects = QuestionMasteryManager()
+
+    class Meta:
+        unique_together = (('user', 'question'),)
+        index_together = (('user', 'score'),)
+
+
+class ReviewScheduleManager(models.Manager):
+    """Manager used to schedule the reviews of the questions"""
+
+    # fields changed by every review
+    FIELDS = (
+        ('repetitions', models.IntegerField()),
+        ('interval', models.FloatField()),
+        ('ease', models.FloatField()),
+        ('due', models.DateTimeField()),
+    )
+
+    # schedules updated at once, each one takes 8 query parameters
+    CHUNK_SIZE = 100
+
+    def review(self, user_id, question_ids, state, now=None):
+        """
+        Schedule the next review of the given questions after the given user
+        answered them with the given state
+        :param user_id: The primary key of the user
+        :param question_ids: The primary keys of the questions
+        :param state: The state of the answers (see QuestionOnQuiz.STATUS)
+        :param now: When the questions were answered, now by default
+        :type user_id: int
+        :type question_ids: list[int]
+        :type state: string
+        :type now: datetime
+        """
+        if not question_ids:
+            return
+        now = now or timezone.now()
+        quality = self.model.QUALITY[state]
+
+        with transaction.atomic():
+            schedules = dict(
+                (schedule.question_id, schedule)
+                for schedule in self.select_for_update().filter(
+                    user_id=user_id,
+                    question_id__in=question_ids
+                )
+            )
+            new = []
+            for pk in question_ids:
+                schedule = schedules.get(pk)
+                if schedule is None:
+                    schedule = self.model(user_id=user_id, question_id=pk)
+                    new.append(schedule)
+                schedule.review(quality, now)
+            self.bulk_create(new)
+
+            # a single query updates every chunk of schedules
+            existing = list(schedules.values())
+            for start in range(0, len(existing), self.CHUNK_SIZE):
+                chunk = existing[start:start + self.CHUNK_SIZE]
+                self.filter(pk__in=[schedule.pk for schedule in chunk]).update(
+                    **dict((name, Case(
+                        *[When(pk=schedule.pk,
+                               then=Value(getattr(schedule, name)))
+                          for schedule in chunk],
+                        output_field=field
+                    )) for name, field in self.FIELDS))
+
+
+class ReviewSchedule(models.Model):
+    """
+    The spaced repetition schedule of a question for a user, computed with
+    the SM-2 algorithm (see chm.repetition) every time the user answers the
+    question. Questions are chosen by their due date, which is indexed for
+    each user.
+    """
+    # quality of each kind of answer, from 0 to 5
+    QUALITY = {
+        QuestionOnQuiz.STATUS.not_answered: 0,
+        QuestionOnQuiz.STATUS.wrong: 1,
+        QuestionOnQuiz.STATUS.right: 4,
+    }
+
+    user = models.ForeignKey(User)
+    question = models.ForeignKey('Question', related_name='schedules')
+
+    # amount of consecutive right answers
+    repetitions = models.IntegerField(default=0)
+    # days between the last review and the next one
+    interval = models.FloatField(default=0.0)
+    ease = models.FloatField(default=INITIAL_EASE)
+    due = models.DateTimeField()
+
+    objects = ReviewScheduleManager()
+
+    class Meta:
+        unique_together = (('user', 'question'),)
+        index_together = (('user', 'due'),)
+
+    def review(self, quality, now):
+        """
+        Schedule the next review after an answer of the given quality. This
+        method does not save.
+        :param quality: The quality of the answer, from 0 to 5
+        :param now: When the question was answered
+        :type quality: int
+        :type now: datetime
+        """
+        self.repetitions, self.interval, self.ease = sm2(
+            self.repetitions, self.interval, self.ease, quality
+        )
+        self.due = now + timedelta(days=self.interval)
+
+
+class TopicStatsManager(models.Manager):
+    """Manager used to keep the statistics of the users up to date"""
+
+    def add(self, user_id, counts, amount=1, now=None):
+        """
+        Record the answers of a quiz of the given user. The rows of the
+        topics the user never answered are created.
+        :param user_id: The primary key of the user
+        :param counts: The answers of the quiz (see Quiz.count_answers)
+        :param amount: 1 to record the answers, -1 to forget them
+        :param now: When the quiz finished, only used to record answers
+        :type user_id: int
+        :type counts: list[dict[string, T]]
+        :type amount: int
+        :type now: datetime
+        """
+        topics = {}
+        for row in counts:
+            fields = topics.setdefault(row['question__topic'], {})
+            fields[TopicStats.FIELDS[row['state']]] = row['total'] * amount
+        if not topics:
+            return
+
+        with transaction.atomic():
+            rows = self.select_for_update().filter(user_id=user_id,
+                                                   topic_id__in=list(topics))
+            existing = set(rows.values_list('topic_id', flat=True))
+            now = now or timezone.now()
+            for topic_id in existing:
+                values = dict((field, F(field) + n)
+                              for field, n in topics[topic_id].items())
+                if amount > 0:
+                    values['last_activity'] = now
+                rows.filter(topic_id=topic_id).update(**values)
+            if amount > 0:
+                self.bulk_create(
+                    self.model(user_id=user_id, topic_id=topic_id,
+                               last_activity=now, **fields)
+                    for topic_id, fields in topics.items()
+                    if topic_id not in existing
+                )
+
+
+class TopicStats(models.Model):
+    """
+    The amount of questions of a topic which a user answered right or
+    wrong or left blank in finished quizzes. It is updated when a quiz
+    finishes (or is aborted after finishing), so the statistics of the user
+    are read without going through the history of the user. Run the
+    rebuild_topic_stats command to compute it from scratch.
+    """
+    FIELDS = QuestionMastery.FIELDS
+
+    user = models.ForeignKey(User)
+    topic = models.ForeignKey('Topic', related_name='stats')
+    right = models.IntegerField(default=0)
+    wrong = models.IntegerField(default=0)
+    blank = models.IntegerField(default=0)
+
+    # when the user last finished a quiz with questions of the topic
+    last_activity = models.DateTimeField(null=True, blank=True)
+
+    objects = TopicStatsManager()
+
+    class Meta:
+        unique_together = (('user', 'topic'),)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=FlaggedQuestion)
+def question_saved_callback(sender, instance, created, update_fields,
+                            **kwargs):
+    """Keep the similarity index in sync with the questions"""
+    if created or update_fields is None or \
+            {'text', 'topic'}.intersection(update_fields):
+        QuestionGram.objects.index([instance])
+
+
+@receiver(pre_save, sender=Question)
+@receiver(pre_save, sender=FlaggedQuestion)
+def question_pre_save_callback(sender, instance, update_fields, **kwargs):
+    """Remember where the question was counted before saving it"""
+    instance._counted = None
+    if instance.pk is not None and (update_fields is None or
+                                    {'topic', 'difficulty'}.intersection(
+                                        update_fields)):
+        instance._counted = Question.objects.filter(
+            pk=instance.pk
+        ).values_list('topic_id', 'difficulty').first()
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=FlaggedQuestion)
+def question_counted_callback(sender, instance, created, update_fields,
+                              **kwargs):
+    """Keep the amount of questions of each topic in sync"""
+    if not created and instance._counted is None:
+        return
+    key = (instance.topic_id, instance.difficulty)
+    if key != instance._counted:
+        counts = {key: 1}
+        if instance._counted is not None:
+            counts[instance._counted] = -1
+        TopicDifficultyCount.objects.add(counts)
+
+
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=FlaggedQuestion)
+def question_deleted_callback(sender, instance, **kwargs):
+    """Keep the amount of questions of each topic in sync"""
+    TopicDifficultyCount.objects.add(
+        {(instance.topic_id, instance.difficulty): -1}
+    )
+
+
+@receiver(post_save, sender=Answer)
+@receiver(post_delete, sender=Answer)
+def answer_changed_callback(sender, instance, **kwargs):
+    """Forget the cached answers of the question"""
+    invalidate_questions([instance.question_id])
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=FlaggedQuestion)
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=FlaggedQuestion)
+def question_changed_callback(sender, instance, **kwargs):
+    """Forget the cached question"""
+    invalidate_questions([instance.pk])
+
+
+@receiver(post_save, sender=Topic)
+def topic_saved_callback(sender, instance, created, **kwargs):
+    """Forget the cached questions of the topic, which include its name"""
+    if not created:
+        invalidate_questions(Question.objects.filter(
+            topic=instance).values_list('pk', flat=True))
+
 
 @receiver(user_signed_up)
 def user_signed_up_callback(sender, request, user, **kwargs):
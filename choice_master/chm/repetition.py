@@ -0,0 +1,36 @@
+INITIAL_EASE = 2.5
+MIN_EASE = 1.3
+
+# quality of each kind of answer, from 0 (complete blackout) to 5 (perfect
+# response). Answers below PASSING_QUALITY restart the repetitions.
+PASSING_QUALITY = 3
+
+
+def sm2(repetitions, interval, ease, quality):
+    """
+    Compute the next review of an item with the SM-2 algorithm
+    :param repetitions: The amount of consecutive passing reviews
+    :param interval: The days since the previous review was scheduled
+    :param ease: The ease factor of the item
+    :param quality: The quality of the answer, from 0 to 5
+    :type repetitions: int
+    :type interval: float
+    :type ease: float
+    :type quality: int
+    :return: The new repetitions, interval (in days) and ease factor
+    :rtype: (int, float, float)
+    """
+    if quality >= PASSING_QUALITY:
+        if repetitions == 0:
+            interval = 1.0
+        elif repetitions == 1:
+            interval = 6.0
+        else:
+            interval = round(interval * ease)
+        repetitions += 1
+    else:
+        repetitions = 0
+        interval = 1.0
+
+    ease += 0.1 - (5 - quality) * (0.08 + (5 - quality) * 0.02)
+    return repetitions, interval, max(MIN_EASE, ease)
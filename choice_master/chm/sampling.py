@@ -0,0 +1,140 @@
+"""
+Random sampling of questions for app chm
+"""
+
+# python imports
+import random
+
+# django imports
+from django.db.models import Max
+from django.db.models import Min
+
+
+def sample_ids(queryset, k, rng=random):
+    """
+    Draw k distinct primary keys uniformly at random from the queryset.
+    Only the primary keys are fetched, as a stream, and at most k of them
+    are kept (reservoir sampling), so the memory used depends on k and not
+    on the size of the queryset.
+    :param queryset: The instances to draw from
+    :param k: The amount of primary keys to draw
+    :param rng: The source of randomness
+    :type queryset: QuerySet
+    :type k: int
+    :type rng: random.Random
+    :return: The primary keys, in random order. All of them if there are
+    less than k.
+    :rtype: list[int]
+    """
+    reservoir = []
+    pks = queryset.order_by().values_list('pk', flat=True)
+    for i, pk in enumerate(pks.iterator()):
+        if i < k:
+            reservoir.append(pk)
+        else:
+            # keep the i-th primary key with probability k / (i + 1)
+            j = rng.randint(0, i)
+            if j < k:
+                reservoir[j] = pk
+    rng.shuffle(reservoir)
+    return reservoir
+
+
+def sample(queryset, k, rng=random):
+    """
+    Draw k distinct instances uniformly at random from the queryset. Only
+    the chosen rows are fetched (see sample_ids).
+    :param queryset: The instances to draw from
+    :param k: The amount of instances to draw
+    :param rng: The source of randomness
+    :type queryset: QuerySet
+    :type k: int
+    :type rng: random.Random
+    :return: The instances, in random order
+    :rtype: list[Model]
+    """
+    pks = sample_ids(queryset, k, rng)
+    instances = queryset.model._default_manager.in_bulk(pks)
+    return [instances[pk] for pk in pks]
+
+
+def sample_ids_by_range(queryset, k, rng=random):
+    """
+    Draw k distinct primary keys at random from the queryset, looking up
+    the first primary key after a random pivot between the lowest and the
+    highest ones. Each primary key is an index lookup, so the time spent
+    depends on k and not on the size of the queryset. Primary keys after
+    big gaps (e.g. of deleted rows) are slightly more likely to be drawn.
+    :param queryset: The instances to draw from
+    :param k: The amount of primary keys to draw
+    :param rng: The source of randomness
+    :type queryset: QuerySet
+    :type k: int
+    :type rng: random.Random
+    :return: The primary keys. All of them if there are less than k.
+    :rtype: list[int]
+    """
+    pks = queryset.order_by('pk').values_list('pk', flat=True)
+    bounds = queryset.aggregate(low=Min('pk'), high=Max('pk'))
+    if k <= 0 or bounds['low'] is None:
+        return []
+
+    chosen = []
+    for _ in range(4 * k):
+        pk = pks.filter(pk__gte=rng.randint(bounds['low'],
+                                            bounds['high'])).first()
+        if pk not in chosen:
+            chosen.append(pk)
+            if len(chosen) == k:
+                return chosen
+
+    # too many collisions, the queryset is not much bigger than k
+    return chosen + list(pks.exclude(pk__in=chosen)[:k - len(chosen)])
+
+
+def allocate(k, sizes, equal=False, rng=random):
+    """
+    Split k draws among strata without drawing more than the size of any
+    of them
+    :param k: The amount of draws
+    :param sizes: The size of each stratum
+    :param equal: Give the same amount to every stratum (as long as they
+    are big enough) instead of an amount proportional to its size
+    :param rng: The source of randomness breaking ties
+    :type k: int
+    :type sizes: dict[T, int]
+    :type equal: bool
+    :type rng: random.Random
+    :return: The draws of each stratum, which add up to k or to the total
+    size if it is smaller
+    :rtype: dict[T, int]
+    """
+    allocation = dict.fromkeys(sizes, 0)
+    total = sum(sizes.values())
+    remaining = min(k, total)
+    if not remaining:
+        return allocation
+
+    if not equal:
+        # largest remainder method
+        for key, size in sizes.items():
+            allocation[key] = remaining * size // total
+        keys = sorted(sizes, key=lambda key: (remaining * sizes[key] % total,
+                                              rng.random()), reverse=True)
+        remaining -= sum(allocation.values())
+        for key in keys[:remaining]:
+            allocation[key] += 1
+        return allocation
+
+    while remaining:
+        open_keys = [key for key in sizes if allocation[key] < sizes[key]]
+        share = remaining // len(open_keys)
+        if share == 0:
+            for key in rng.sample(open_keys, remaining):
+                allocation[key] += 1
+            break
+        for key in open_keys:
+            n = min(share, sizes[key] - allocation[key])
+            allocation[key] += n
+            remaining -= n
+    return allocation
@@ -1,3 +1,7 @@
+MAX_DISTANCE = 5
+QGRAM_SIZE = 3
+
+
 def distance(str1, str2):
     """
     Compute the Levenshtein distance between str1 and str2
@@ -8,32 +12,136 @@ def distance(str1, str2):
     :return: the Levenshtein distance between str1 and str2
     :rtype: int
     """
-    distance_table = dict()
+    # only the previous row of the table is needed to compute the next one
+    previous = list(range(len(str2) + 1))
+
+    for i in range(1, len(str1) + 1):
+        current = [i] + [0] * len(str2)
+        for j in range(1, len(str2) + 1):
+            current[j] = min(current[j - 1] + 1,
+                             previous[j] + 1,
+                             previous[j - 1] +
+                             (not str1[i - 1] == str2[j - 1]))
+        previous = current
+    return previous[len(str2)]
+
+
+def distance_within(str1, str2, k):
+    """
+    Compute the Levenshtein distance between str1 and str2 only if it is not
+    greater than k.
+
+    Only the cells of the table lying at most k diagonals away from the main
+    one are computed, and the computation stops as soon as every cell of a
+    row is greater than k, so the cost is O(k * min(len(str1), len(str2)))
+    instead of O(len(str1) * len(str2)).
+
+    :param str1: String to compute distance
+    :param str2: String to compute distance
+    :param k: The maximum distance of interest
+    :type str1: string
+    :type str2: string
+    :type k: int
+    :return: the Levenshtein distance between str1 and str2, or None if it is
+    greater than k
+    :rtype: int | NoneType
+    """
+    if k < 0 or abs(len(str1) - len(str2)) > k:
+        return None
+
+    # iterate over the shortest string, so that there are fewer rows
+    if len(str1) > len(str2):
+        str1, str2 = str2, str1
 
-    for i in range(len(str1) + 1):
-        distance_table[i] = dict()
-        distance_table[i][0] = i
+    # Each row only keeps the 2k + 1 cells of the band: the cell (i, j) is
+    # stored at index j - i + k. The extra last cell is a sentinel so that
+    # the cell above the rightmost one of the band can always be read.
+    width = 2 * k + 1
+    out_of_band = k + 1
 
-    for i in range(len(str2) + 1):
-        distance_table[0][i] = i
+    previous = [out_of_band] * (width + 1)
+    for j in range(min(k, len(str2)) + 1):
+        previous[j + k] = j
 
     for i in range(1, len(str1) + 1):
-        for j in range(1, len(str2) + 1):
-            distance_table[i][j] = min(distance_table[i][j - 1] + 1,
-                                       distance_table[i - 1][j] + 1,
-                                       distance_table[i - 1][j - 1] +
-                                       (not str1[i - 1] == str2[j - 1]))
-    return distance_table[len(str1)][len(str2)]
+        current = [out_of_band] * (width + 1)
+        char = str1[i - 1]
+        row_min = out_of_band
+
+        first = max(0, k - i)
+        last = min(width - 1, len(str2) - i + k)
+        for b in range(first, last + 1):
+            j = i - k + b
+            if j == 0:
+                value = i
+            else:
+                value = previous[b] + (char != str2[j - 1])
+                above = previous[b + 1] + 1
+                if above < value:
+                    value = above
+                if b > 0:
+                    left = current[b - 1] + 1
+                    if left < value:
+                        value = left
+                if value > out_of_band:
+                    value = out_of_band
+            current[b] = value
+            if value < row_min:
+                row_min = value
+
+        if row_min > k:
+            return None
+        previous = current
+
+    result = previous[len(str2) - len(str1) + k]
+    return result if result <= k else None
 
 
-def is_similar(str1, str2):
+def is_similar(str1, str2, max_distance=MAX_DISTANCE):
     """
     Determine if the str1 is different from the str2
     :param str1: String to compare
     :param str2: String to compare
+    :param max_distance: The strings are similar only if their distance is
+    lower than this value
     :type str1: string
     :type str2: string
+    :type max_distance: int
     :return: True only if the strings are similar
     :rtype: bool
     """
-    return distance(str1, str2) < 5
+    return distance_within(str1, str2, max_distance - 1) is not None
+
+
+def qgrams(text, q=QGRAM_SIZE):
+    """
+    Return the set of substrings of length q of the given text
+    :param text: The text to split
+    :param q: The length of the substrings
+    :type text: string
+    :type q: int
+    :return: The distinct q-grams of the text
+    :rtype: set[string]
+    """
+    return {text[i:i + q] for i in range(len(text) - q + 1)}
+
+
+def min_shared_qgrams(grams, max_distance=MAX_DISTANCE, q=QGRAM_SIZE):
+    """
+    Return the minimum amount of distinct q-grams that a text with the given
+    q-grams shares with any text similar to it.
+
+    Every edit operation destroys at most q q-grams, so a text at distance d
+    keeps at least len(grams) - q * d of them. A result lower than 1 means
+    that the q-grams can not be used to discard any text.
+
+    :param grams: The distinct q-grams of a text
+    :param max_distance: The threshold used by is_similar
+    :param q: The length of the q-grams
+    :type grams: set[string]
+    :type max_distance: int
+    :type q: int
+    :return: The minimum amount of shared q-grams
+    :rtype: int
+    """
+    return len(grams) - q * (max_distance - 1)
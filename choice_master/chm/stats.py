@@ -0,0 +1,154 @@
+"""
+Statistics of the users of app chm
+"""
+
+# python imports
+from collections import defaultdict
+
+# django imports
+from django.apps import apps
+
+# most points shown in the performance chart of a subject
+CHART_POINTS = 200
+
+
+def learning_coeffs(user, subject_ids=None):
+    """
+    Return the learning coefficients of the user: the percentage of right
+    answers among the answered questions of the finished quizzes, for each
+    topic, and the average of the coefficients of the topics of each
+    subject. Topics without answers count as 0 in the average. The answers
+    are read from the statistics of the user (see TopicStats), so the cost
+    does not depend on the amount of quizzes the user took.
+    :param user: The user
+    :param subject_ids: The primary keys of the subjects, all the subjects
+    with questions in finished quizzes of the user if None
+    :type user: User
+    :type subject_ids: list[int] | None
+    :return: The coefficients (from 0 to 100) of the subjects and of their
+    topics, by primary key. Subjects without answers are left out.
+    :rtype: (dict[int, float], dict[int, float])
+    """
+    # chm.models depends on this module
+    Topic = apps.get_model('chm', 'Topic')
+    TopicStats = apps.get_model('chm', 'TopicStats')
+
+    rows = TopicStats.objects.filter(user=user)
+    if subject_ids is not None:
+        rows = rows.filter(topic__subject__in=subject_ids)
+    rows = rows.values_list('topic', 'topic__subject', 'right', 'wrong',
+                            'blank')
+
+    topic_coeffs = {}
+    subjects = set()
+    for topic_id, subject_id, right, wrong, blank in rows:
+        # the rows of aborted quizzes are left empty
+        if right or wrong or blank:
+            subjects.add(subject_id)
+            topic_coeffs[topic_id] = \
+                100 * right / (right + wrong) if right or wrong else 0.0
+
+    # get all topics, even if user didn't answer any questions yet
+    subject_topics = defaultdict(list)
+    topics = Topic.objects.filter(
+        subject__in=subjects
+    ).values_list('pk', 'subject')
+    for pk, subject_id in topics:
+        subject_topics[subject_id].append(topic_coeffs.setdefault(pk, 0.0))
+
+    subject_coeffs = dict((pk, sum(coeffs) / len(coeffs))
+                          for pk, coeffs in subject_topics.items())
+    return subject_coeffs, topic_coeffs
+
+
+def subject_scores(user, subject_id):
+    """
+    Return the score of each finished quiz of the user on the questions of
+    the given subject, read with a single query from the results saved when
+    the quizzes finished (see QuizSubjectResult). Every quiz appears once.
+    :param user: The user
+    :param subject_id: The primary key of the subject
+    :type user: User
+    :type subject_id: int
+    :return: The datetime and score (from 0 to 100) of every quiz, oldest
+    first
+    :rtype: list[(datetime, float)]
+    """
+    QuizSubjectResult = apps.get_model('chm', 'QuizSubjectResult')
+    Quiz = apps.get_model('chm', 'Quiz')
+    results = QuizSubjectResult.objects.filter(
+        quiz__user=user,
+        quiz__state=Quiz.STATUS.finished,
+        subject_id=subject_id,
+    ).select_related('quiz').order_by('quiz__datetime', 'quiz')
+    return [(result.quiz.datetime, result.score()) for result in results]
+
+
+def lttb(points, threshold):
+    """
+    Reduce a series to the given amount of points with the Largest Triangle
+    Three Buckets algorithm: the first and last points are kept, and of
+    every bucket in between, the point forming the largest triangle with
+    the previously chosen point and the average of the next bucket. Peaks
+    and valleys are kept, so the shape of the series does not change much.
+    :param points: The x and y of every point, sorted by x
+    :param threshold: The amount of points to keep
+    :type points: list[(float, float)]
+    :type threshold: int
+    :return: The points kept, in the same order
+    :rtype: list[(float, float)]
+    """
+    n = len(points)
+    if threshold >= n or threshold < 3:
+        return list(points)
+
+    sampled = [points[0]]
+    every = (n - 2) / (threshold - 2)
+    a = 0
+    for i in range(threshold - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n)
+        following = points[end:next_end]
+        avg_x = sum(x for x, y in following) / len(following)
+        avg_y = sum(y for x, y in following) / len(following)
+
+        ax, ay = points[a]
+        chosen = max(range(start, end), key=lambda j: abs(
+            (ax - avg_x) * (points[j][1] - ay) -
+            (ax - points[j][0]) * (avg_y - ay)))
+        sampled.append(points[chosen])
+        a = chosen
+    sampled.append(points[-1])
+    return sampled
+
+
+def downsample(scores, max_points=CHART_POINTS):
+    """
+    Bound the amount of points of a series of scores. When there are too
+    many, the scores of each day are averaged and, if there are still too
+    many days, they are reduced with lttb.
+    :param scores: The datetime and score of every quiz (see subject_scores)
+    :param max_points: The most points to return
+    :type scores: list[(datetime, float)]
+    :type max_points: int
+    :return: The datetime and score of every point, oldest first
+    :rtype: list[(datetime, float)]
+    """
+    if len(scores) <= max_points:
+        return scores
+
+    days = []
+    for when, score in scores:
+        day = when.replace(hour=0, minute=0, second=0, microsecond=0)
+        if days and days[-1][0] == day:
+            days[-1][1].append(score)
+        else:
+            days.append((day, [score]))
+    days = [(day, sum(day_scores) / len(day_scores))
+            for day, day_scores in days]
+
+    points = lttb([(day.timestamp(), score) for day, score in days],
+                  max_points)
+    when = dict((day.timestamp(), day) for day, score in days)
+    return [(when[x], score) for x, score in points]
@@ -2,34 +2,121 @@ from unittest import TestCase
 from os import path
 
 from .admin import XMLFileAdmin
+from .caches import CORRECT_ANSWERS_KEY
+from .caches import QUESTION_KEY
+from .caches import correct_answers
+from .caches import questions_json
+from .checks import shared_cache_check
+from .export import JSONLinesExporter
+from .export import XMLExporter
+from .export import iter_questions
+from .export import question_data
+from .forms import QuizForm
+from .irt import calibrate
+from .irt import estimate_abilities
+from .irt import probability
+from .jobs import STALE_AFTER
+from .jobs import fail_stale_jobs
+from .jobs import run_import_job
+from .loader import QuestionLoader
+from .loader import file_hash
+from .loader import resume_load
+from .management.commands.import_questions import parse_file
 from .messages import LoadQuestionsMessageManager
+from .repetition import INITIAL_EASE
+from .repetition import MIN_EASE
+from .repetition import sm2
+from .sampling import allocate
+from .sampling import sample_ids
+from .similarity import distance
+from .similarity import distance_within
 from .similarity import is_similar
+from .stats import downsample
+from .stats import learning_coeffs
+from .stats import lttb
+from .stats import subject_scores
+from .xml import DEFAULT_SCHEMA_VERSION
+from .xml import SchemaRegistry
 from .xml import XMLParser
+from .xml import schemas
 from . import factories
 from . import models
 from choice_master.settings import BASE_DIR
 from chm.models import Question
+from chm.models import Quiz
 from chm.models import Subject
 from chm.models import Topic
 
 
+from django.contrib import messages
 from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.db import transaction
+from django.db.models import Count
 from django.test import TestCase, RequestFactory
+from django.test import TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from unittest import mock
+from unittest import skipUnless
 from django.urls import reverse
+from django.utils import timezone
 from lxml import etree
-
+import numpy as np
+
+from collections import Counter
+from datetime import timedelta
+from io import BytesIO
+from io import StringIO
+import json
+import os
+import queue
 import random
+import shutil
 import string
+import tempfile
+import threading
 
 
-class Request():
+class QuestionStream():
     """
-    A Request toy to use in load_questions
-    Note that load_question only needs a session duplicates list
+    A file-like toy generating a valid XML file with many questions on the
+    fly, so that the file itself does not use any memory
     """
-    def __init__(self, sess=[]):
-        self.session = dict()
-        self.session['duplicates'] = sess
+    QUESTION = ('<question subject="S" topic="T">'
+                '<text>Question number {0} {1}</text>'
+                '<incorrect>{1}</incorrect>'
+                '<correct>{1}</correct>'
+                '</question>\n')
+
+    def __init__(self, n):
+        self.questions = iter(range(n))
+        self.buffer = b'<file>'
+        self.finished = False
+
+    def read(self, size=-1):
+        while (size < 0 or len(self.buffer) < size) and not self.finished:
+            try:
+                i = next(self.questions)
+                question = self.QUESTION.format(i, random_string(100))
+                self.buffer += question.encode('utf-8')
+            except StopIteration:
+                self.buffer += b'</file>'
+                self.finished = True
+        if size < 0:
+            size = len(self.buffer)
+        chunk, self.buffer = self.buffer[:size], self.buffer[size:]
+        return chunk
+
+
+def resident_memory():
+    """Return the amount of memory currently used by the process in bytes"""
+    with open('/proc/self/statm') as f:
+        pages = int(f.read().split()[1])
+    return pages * os.sysconf('SC_PAGE_SIZE')
 
 
 # This function is defined here for convinience
@@ -226,8 +313,6 @@ class TestAdministratorLoadingQuestions(TestCase):
         max_length = 30
         answers_length = 10
 
-        self.request = Request()
-
         self.data_list = []
         for x in range(cases):
             answers = []
@@ -270,7 +355,7 @@ class TestAdministratorLoadingQuestions(TestCase):
             mm = LoadQuestionsMessageManager()
 
             # Run the code to be tested
-            XMLFileAdmin.load_question(data, mm, self.request)
+            XMLFileAdmin.load_question(data, mm)
 
             self.assertEquals(mm.no_subject, [])
             self.assertEquals(mm.no_topic, [])
@@ -297,7 +382,7 @@ class TestAdministratorLoadingQuestions(TestCase):
             mm = LoadQuestionsMessageManager()
 
             # Run the code to be tested
-            XMLFileAdmin.load_question(data, mm, self.request)
+            XMLFileAdmin.load_question(data, mm)
 
             self.assertEquals(len(mm.no_subject), 1)
             self.assertEquals(len(mm.no_subject[0]), 2)
@@ -326,7 +411,7 @@ class TestAdministratorLoadingQuestions(TestCase):
             mm = LoadQuestionsMessageManager()
 
             # Run the code to be tested
-            XMLFileAdmin.load_question(data, mm, self.request)
+            XMLFileAdmin.load_question(data, mm)
 
             self.assertEquals(len(mm.no_topic), 1)
             self.assertEquals(len(mm.no_topic[0]), 2)
@@ -359,7 +444,7 @@ class TestAdministratorLoadingQuestions(TestCase):
             mm = LoadQuestionsMessageManager()
 
             # Run the code to be tested
-            XMLFileAdmin.load_question(data, mm, self.request)
+            XMLFileAdmin.load_question(data, mm)
             self.assertEquals(len(mm.validation_error), 1)
             self.assertEquals(len(mm.validation_error[0]), 2)
             self.assertEquals(len(mm.validation_error[0][0].messages), 1)
@@ -398,8 +483,8 @@ class TestAdministratorLoadingQuestions(TestCase):
             mm = LoadQuestionsMessageManager()
 
             # Run the code to be tested
-            XMLFileAdmin.load_question(data, mm, self.request)
-            self.assertEquals(len(self.request.session['duplicates']), i)
+            XMLFileAdmin.load_question(data, mm)
+            self.assertEquals(models.SimilarQuestion.objects.count(), i)
             i = i + 1
             self.assertEquals(mm.no_topic, [])
             self.assertEquals(mm.no_subject, [])
@@ -420,6 +505,553 @@ class TestAdministratorLoadingQuestions(TestCase):
                 self.assertFalse(exists)
 
 
+class TestQuestionLoader(TestCase):
+    """Testing the batched loading of questions"""
+
+    def setUp(self):
+        """Set up a subject and a topic to load questions into"""
+        self.subject = factories.SubjectFactory.create(name='S')
+        self.topic = factories.TopicFactory.create(name='T',
+                                                   subject=self.subject)
+        self.mm = LoadQuestionsMessageManager()
+
+    def data(self, text, subject='S', topic='T'):
+        return {
+            'subject': subject,
+            'topic': topic,
+            'question': text,
+            'answers': [{'text': 'right', 'is_correct': True},
+                        {'text': 'wrong', 'is_correct': False}],
+        }
+
+    def test_load_in_batches(self):
+        """Test every question and answer is saved whatever the batch size"""
+        texts = [random_string(30) for _ in range(25)]
+        loader = QuestionLoader(self.mm, batch_size=10)
+        loader.load(self.data(text) for text in texts)
+
+        self.assertEquals([q.text for q in self.mm.added], texts)
+        self.assertEquals(self.mm.similar, 0)
+        for question in self.mm.added:
+            self.assertIsNotNone(question.pk)
+            self.assertEquals(question.answers.count(), 2)
+            self.assertTrue(question.answers.get(text='right').is_correct)
+            self.assertTrue(models.QuestionGram.objects.filter(
+                question=question).exists())
+
+    def test_names_are_resolved_once(self):
+        """Test subjects and topics are not looked up for every question"""
+        batch = [self.data(random_string(30)) for _ in range(10)]
+        batch += [self.data(random_string(30), topic='X') for _ in range(10)]
+        loader = QuestionLoader(self.mm)
+        loader.load_batch(batch)
+        self.assertEquals(len(loader.topics.subjects), 1)
+        self.assertEquals(len(loader.topics.topics), 2)
+        self.assertEquals(len(self.mm.no_topic), 10)
+
+    def test_repeated_and_similar_in_the_same_batch(self):
+        """Test questions are compared with the previous ones of the batch"""
+        text = random_string(30)
+        loader = QuestionLoader(self.mm)
+        loader.load([self.data(text), self.data(text),
+                     self.data(text[:-1] + 'a')])
+
+        self.assertEquals(len(self.mm.added), 1)
+        self.assertEquals(len(self.mm.validation_error), 1)
+        self.assertEquals(self.mm.validation_error[0][0].messages,
+                          ['The question already exists'])
+        self.assertEquals(self.mm.similar, 1)
+        self.assertEquals(models.SimilarQuestion.objects.get().text,
+                          text[:-1] + 'a')
+        self.assertEquals(Question.objects.filter(topic=self.topic).count(),
+                          1)
+
+    def test_concurrent_questions(self):
+        """Test a batch whose new rows can not be told apart is rolled back"""
+        texts = [random_string(30) for _ in range(3)]
+        bulk_create = Question.objects.bulk_create
+
+        def concurrent_bulk_create(questions):
+            result = bulk_create(questions)
+            # another writer adds the same question meanwhile
+            Question.objects.create(text=texts[1], topic=self.topic)
+            return result
+
+        with mock.patch.object(Question.objects, 'bulk_create',
+                               concurrent_bulk_create):
+            QuestionLoader(self.mm).load(self.data(text) for text in texts)
+
+        self.assertEquals(self.mm.added, [])
+        self.assertEquals(len(self.mm.validation_error), 3)
+        self.assertIn('concurrently',
+                      self.mm.validation_error[0][0].messages[0])
+        self.assertFalse(Question.objects.filter(text__in=texts).exists())
+
+    def test_invalid_answer_rejects_question(self):
+        """Test a question is not saved if one of its answers is invalid"""
+        data = self.data(random_string(30))
+        data['answers'].append({'text': 'a' * 301, 'is_correct': False})
+        QuestionLoader(self.mm).load([data])
+
+        self.assertEquals(self.mm.added, [])
+        self.assertEquals(len(self.mm.validation_error), 1)
+        self.assertFalse(Question.objects.filter(
+            text=data['question']).exists())
+
+    def test_interrupted_load_saves_nothing(self):
+        """Test an error while loading rolls back every batch"""
+        def questions():
+            for _ in range(5):
+                yield self.data(random_string(30))
+            raise etree.XMLSyntaxError('error', None, 1, 1)
+
+        loader = QuestionLoader(self.mm, batch_size=2)
+        with self.assertRaises(etree.XMLSyntaxError):
+            loader.load(questions())
+        self.assertEquals(self.mm.added, [])
+        self.assertFalse(Question.objects.filter(topic=self.topic).exists())
+
+    def test_resume_interrupted_load(self):
+        """Test a load resumes after the last committed batch"""
+        texts = [random_string(30) for _ in range(5)]
+
+        def questions():
+            for text in texts[:3]:
+                yield self.data(text)
+            raise etree.XMLSyntaxError('error', None, 1, 1)
+
+        loader = QuestionLoader(self.mm, batch_size=2, atomic=False)
+        with self.assertRaises(etree.XMLSyntaxError):
+            resume_load(loader, 'hash', questions())
+        self.assertEquals([q.text for q in self.mm.added], texts[:2])
+        self.assertEquals(
+            models.ImportCheckpoint.objects.get(file_hash='hash').processed,
+            2)
+
+        # the committed questions are neither validated nor reported again
+        mm = LoadQuestionsMessageManager()
+        loader = QuestionLoader(mm, batch_size=2, atomic=False)
+        skipped = resume_load(loader, 'hash',
+                              [self.data(text) for text in texts])
+        self.assertEquals(skipped, 2)
+        self.assertEquals(mm.skipped, 2)
+        self.assertEquals([q.text for q in mm.added], texts[2:])
+        self.assertEquals(mm.validation_error, [])
+        self.assertEquals(Question.objects.filter(topic=self.topic).count(),
+                          5)
+        self.assertEquals(
+            models.ImportCheckpoint.objects.get(file_hash='hash').processed,
+            5)
+
+    def test_file_hash(self):
+        """Test files are identified by their contents"""
+        f = BytesIO(b'<file></file>')
+        digest = file_hash(f)
+        self.assertEquals(f.tell(), 0)
+        self.assertEquals(digest, file_hash(BytesIO(b'<file></file>')))
+        self.assertNotEqual(digest, file_hash(BytesIO(b'<file> </file>')))
+
+
+class TestSimilarQuestionReview(TestCase):
+    """Testing the review of questions similar to existing ones"""
+
+    def setUp(self):
+        """Stage some similar questions and log in as administrator"""
+        User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        subject = factories.SubjectFactory.create(name='S')
+        self.topic = factories.TopicFactory.create(name='T', subject=subject)
+
+        self.texts = [random_string(30) for _ in range(3)]
+        for text in self.texts:
+            factories.QuestionFactory.create(text=text, topic=self.topic)
+        mm = LoadQuestionsMessageManager()
+        QuestionLoader(mm).load({
+            'subject': 'S',
+            'topic': 'T',
+            'question': text[:-1] + 'a',
+            'answers': [{'text': 'right', 'is_correct': True}],
+        } for text in self.texts)
+        self.assertEquals(mm.similar, 3)
+        self.changelist_url = reverse('admin:chm_similarquestion_changelist')
+
+    def test_question_changelist_shows_pending_questions(self):
+        """Test the list of questions links to the staged questions"""
+        response = self.client.get(reverse('admin:chm_question_changelist'))
+        self.assertContains(response, '3 questions are waiting to be reviewed')
+        self.assertContains(response, self.changelist_url)
+
+    def test_accept_selected(self):
+        """Test accepted questions are loaded and removed from staging"""
+        pks = models.SimilarQuestion.objects.values_list('pk', flat=True)
+        response = self.client.post(self.changelist_url, {
+            'action': 'accept_selected',
+            '_selected_action': pks[:2],
+        }, follow=True)
+        self.assertContains(response, 'Added 2 questions')
+        self.assertEquals(models.SimilarQuestion.objects.count(), 1)
+        self.assertEquals(Question.objects.filter(topic=self.topic).count(),
+                          5)
+        accepted = [text[:-1] + 'a' for text in self.texts]
+        for question in Question.objects.filter(text__in=accepted):
+            self.assertEquals(question.answers.get().text, 'right')
+
+    def test_reject_selected(self):
+        """Test rejected questions are discarded"""
+        pks = models.SimilarQuestion.objects.values_list('pk', flat=True)
+        self.client.post(self.changelist_url, {
+            'action': 'reject_selected',
+            '_selected_action': pks[:2],
+        })
+        self.assertEquals(models.SimilarQuestion.objects.count(), 1)
+        self.assertEquals(Question.objects.filter(topic=self.topic).count(),
+                          3)
+
+    def test_accept_one(self):
+        """Test a single staged question can be accepted"""
+        similar_question = models.SimilarQuestion.objects.first()
+        response = self.client.post(
+            reverse('admin:chm_accept_similar_question'),
+            {'id': similar_question.pk})
+        self.assertEquals(response.json(), {'ok': True})
+        self.assertTrue(Question.objects.filter(
+            text=similar_question.text).exists())
+        self.assertFalse(models.SimilarQuestion.objects.filter(
+            pk=similar_question.pk).exists())
+
+        # the list of staged questions is paginated
+        response = self.client.get(self.changelist_url)
+        self.assertContains(response, 'Add it anyway', count=2)
+
+
+class TestImportJob(TestCase):
+    """Testing the background loading of uploaded files"""
+    NORMAL_TO_PARSE_PATH = path.join(BASE_DIR, 'static', 'xml_files', 'test',
+                                     'normal_to_parse.xml')
+
+    def setUp(self):
+        """Log in as administrator and keep uploaded files away"""
+        self.media_root = tempfile.mkdtemp()
+        self.settings = self.settings(MEDIA_ROOT=self.media_root)
+        self.settings.enable()
+        User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        subject = factories.SubjectFactory.create(name='Algebra')
+        self.topic = factories.TopicFactory.create(name='subesp',
+                                                   subject=subject)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def upload(self):
+        with open(self.NORMAL_TO_PARSE_PATH, 'rb') as f:
+            response = self.client.post(reverse('admin:chm_load_questions'),
+                                        {'file': f})
+        return response, models.ImportJob.objects.latest('pk')
+
+    def test_upload_creates_pending_job(self):
+        """Test the upload returns before loading any question"""
+        response, job = self.upload()
+        self.assertRedirects(response, reverse('admin:chm_import_progress',
+                                               args=[job.pk]))
+        self.assertEquals(job.state, models.ImportJob.STATUS.pending)
+        self.assertFalse(Question.objects.filter(topic=self.topic).exists())
+
+        response = self.client.get(reverse('admin:chm_import_status',
+                                           args=[job.pk]))
+        self.assertEquals(response.json()['done'], False)
+
+        # the outcome can not be seen until the job is done
+        response = self.client.get(reverse('admin:chm_import_finish',
+                                           args=[job.pk]))
+        self.assertRedirects(response, reverse('admin:chm_import_progress',
+                                               args=[job.pk]))
+
+    def test_run_job(self):
+        """Test the job loads the questions and records its progress"""
+        response, job = self.upload()
+        run_import_job(job.pk)
+
+        self.assertTrue(Question.objects.filter(
+            topic=self.topic, text='Cuanto es 2 mas 2?').exists())
+        response = self.client.get(reverse('admin:chm_import_status',
+                                           args=[job.pk]))
+        self.assertEquals(response.json(), {
+            'id': job.pk,
+            'state': models.ImportJob.STATUS.finished,
+            'done': True,
+            'processed': 3,
+            'added': 1,
+            'rejected': 2,
+        })
+
+        response = self.client.get(reverse('admin:chm_import_finish',
+                                           args=[job.pk]), follow=True)
+        self.assertRedirects(response,
+                             reverse('admin:chm_question_changelist'))
+        html = response.content.decode('utf-8')
+        self.assertIn('Added 1 questions', html)
+        self.assertIn('The subject &quot;AM2&quot; does not exist', html)
+
+    def test_upload_again(self):
+        """Test loading the same file again skips the loaded questions"""
+        response, job = self.upload()
+        run_import_job(job.pk)
+        response, job = self.upload()
+        run_import_job(job.pk)
+
+        job.refresh_from_db()
+        self.assertEquals(job.processed, 0)
+        self.assertIn('Skipped 3 questions', job.messages)
+        self.assertNotIn('already exists', job.messages)
+
+    def test_interrupted_job(self):
+        """Test jobs which stopped making progress are set as failed"""
+        response, job = self.upload()
+        response, stale = self.upload()
+        models.ImportJob.objects.filter(pk=stale.pk).update(
+            state=models.ImportJob.STATUS.running,
+            updated=timezone.now() - STALE_AFTER - timedelta(minutes=1))
+
+        response = self.client.get(reverse('admin:chm_import_status',
+                                           args=[stale.pk]))
+        self.assertEquals(response.json()['state'],
+                          models.ImportJob.STATUS.failed)
+        self.assertEquals(response.json()['done'], True)
+        stale.refresh_from_db()
+        self.assertIn('upload it again', stale.messages)
+
+        # jobs making progress are left alone
+        job.refresh_from_db()
+        self.assertEquals(job.state, models.ImportJob.STATUS.pending)
+        self.assertEquals(fail_stale_jobs(), 0)
+
+    def test_job_queued_behind_a_long_job(self):
+        """Test pending jobs are not failed while they wait their turn"""
+        response, job = self.upload()
+        models.ImportJob.objects.filter(pk=job.pk).update(
+            updated=timezone.now() - STALE_AFTER - timedelta(minutes=1))
+        self.assertEquals(fail_stale_jobs(), 0)
+
+        run_import_job(job.pk)
+        job.refresh_from_db()
+        self.assertEquals(job.state, models.ImportJob.STATUS.finished)
+        self.assertEquals(job.added, 1)
+
+    def test_job_is_run_once(self):
+        """Test jobs which are no longer pending are not run"""
+        response, job = self.upload()
+        models.ImportJob.objects.filter(pk=job.pk).update(
+            state=models.ImportJob.STATUS.failed)
+        run_import_job(job.pk)
+        job.refresh_from_db()
+        self.assertEquals(job.state, models.ImportJob.STATUS.failed)
+        self.assertEquals(job.processed, 0)
+        self.assertFalse(models.Question.objects.exists())
+
+    def test_invalid_file(self):
+        """Test a syntax error finishes the job with an error message"""
+        job = models.ImportJob.objects.create(
+            file=SimpleUploadedFile('bad.xml', b'<file><question>'))
+        run_import_job(job.pk)
+        job.refresh_from_db()
+        self.assertEquals(job.state, models.ImportJob.STATUS.finished)
+        self.assertIn('Syntax error', job.messages)
+
+
+class TestImportQuestionsCommand(TestCase):
+    """Testing the management command loading XML files"""
+    TEST_PATH = path.join(BASE_DIR, 'static', 'xml_files', 'test')
+
+    def setUp(self):
+        """Create the subjects and topics of the test files"""
+        for subject_name, topic_name in (('Algebra', 'subesp'),
+                                         ('AM2', 'Series de Taylor')):
+            subject = factories.SubjectFactory.create(name=subject_name)
+            factories.TopicFactory.create(name=topic_name, subject=subject)
+
+    def test_import_files(self):
+        """Test several files and patterns are loaded"""
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command('import_questions',
+                     path.join(self.TEST_PATH, 'normal_to_parse.xml'),
+                     path.join(self.TEST_PATH, 'valid_*.xml'),
+                     path.join(self.TEST_PATH, 'normal_to_parse.xml'),
+                     workers=2, stdout=stdout, stderr=stderr)
+
+        self.assertTrue(Question.objects.filter(
+            text='Cuanto es 2 mas 2?').exists())
+        self.assertTrue(Question.objects.filter(
+            text='Todos los patos son de color rojo?').exists())
+        self.assertIn('from 2 files', stdout.getvalue())
+        self.assertIn('questions/sec', stdout.getvalue())
+        self.assertIn('The subject "Probabilidad" does not exist',
+                      stderr.getvalue())
+
+    def test_import_again(self):
+        """Test files are resumed unless asked to restart"""
+        filename = path.join(self.TEST_PATH, 'normal_to_parse.xml')
+        call_command('import_questions', filename, workers=1,
+                     stdout=StringIO(), stderr=StringIO())
+        stdout = StringIO()
+        call_command('import_questions', filename, workers=1,
+                     stdout=stdout, stderr=StringIO())
+        self.assertIn('Added 0 of 0 questions', stdout.getvalue())
+        self.assertIn('3 already loaded', stdout.getvalue())
+
+        stdout = StringIO()
+        stderr = StringIO()
+        call_command('import_questions', filename, workers=1, restart=True,
+                     stdout=stdout, stderr=stderr)
+        self.assertIn('Added 0 of 3 questions', stdout.getvalue())
+        self.assertIn('The question already exists', stderr.getvalue())
+
+    def test_invalid_file(self):
+        """Test files which can not be parsed are reported"""
+        stderr = StringIO()
+        call_command('import_questions',
+                     path.join(self.TEST_PATH, 'without_topic.xml'),
+                     workers=1, stdout=StringIO(), stderr=stderr)
+        self.assertIn('without_topic.xml', stderr.getvalue())
+
+    def test_parse_file_in_chunks(self):
+        """Test the workers send the questions back in bounded chunks"""
+        filename = path.join(self.TEST_PATH, 'normal_to_parse.xml')
+        chunks = queue.Queue()
+        parse_file(filename, chunks, 2)
+        items = [chunks.get() for _ in range(chunks.qsize())]
+        with open(filename, 'rb') as f:
+            self.assertEquals(items[0], ('hash', file_hash(f)))
+        self.assertEquals([len(value) for kind, value in items[1:-1]],
+                          [2, 1])
+        self.assertEquals(items[-1], ('end', None))
+
+        parse_file(path.join(self.TEST_PATH, 'missing.xml'), chunks, 2)
+        kind, error = chunks.get()
+        self.assertEquals(kind, 'end')
+        self.assertIn('missing.xml', error)
+
+    def test_no_files(self):
+        """Test patterns must match some file"""
+        with self.assertRaises(CommandError):
+            call_command('import_questions',
+                         path.join(self.TEST_PATH, 'missing*.xml'))
+
+
+class TestExport(TestCase):
+    """Testing the export of questions"""
+
+    def setUp(self):
+        """Create questions with some answers"""
+        subject = factories.SubjectFactory.create(name='S')
+        topic = factories.TopicFactory.create(name='T <&>', subject=subject)
+        other = factories.TopicFactory.create(name='U', subject=subject)
+        self.questions = []
+        for i in range(5):
+            question = factories.QuestionFactory.create(
+                text='Pregunta número {} "<&>"'.format(i),
+                topic=topic if i % 2 else other)
+            factories.AnswerFactory.create(question=question, text='no',
+                                           is_correct=False)
+            factories.AnswerFactory.create(question=question, text='sí',
+                                           is_correct=True)
+            factories.AnswerFactory.create(question=question, text='quizás',
+                                           is_correct=False)
+            self.questions.append(question)
+        self.expected = [question_data(q) for q in self.questions]
+
+        # questions without correct answers can not be written in XML
+        self.incorrect = factories.QuestionFactory.create(text='?',
+                                                          topic=topic)
+        factories.AnswerFactory.create(question=self.incorrect, text='no',
+                                       is_correct=False)
+
+    def test_questions_are_fetched_in_chunks(self):
+        """Test each chunk of questions takes a constant amount of queries"""
+        # three chunks of two questions and the empty one after them
+        with self.assertNumQueries(7):
+            questions = list(iter_questions(Question.objects.all(),
+                                            chunk_size=2))
+            self.assertEquals([question_data(q) for q in questions[:5]],
+                              self.expected)
+
+    def test_xml_round_trip(self):
+        """Test the exported XML is valid and loads the same questions"""
+        exporter = XMLExporter()
+        content = ''.join(exporter.export(iter_questions(
+            Question.objects.all(), chunk_size=2)))
+        self.assertEquals(exporter.exported, 5)
+        self.assertEquals(exporter.skipped, 1)
+
+        parser = XMLParser(BytesIO(content.encode('utf-8')))
+        self.assertEquals(list(parser.parse_questions()), self.expected)
+
+    def test_jsonl(self):
+        """Test every question is exported as a line of JSON"""
+        exporter = JSONLinesExporter()
+        lines = list(exporter.export(iter_questions(Question.objects.all())))
+        self.assertEquals([json.loads(line) for line in lines],
+                          self.expected + [question_data(self.incorrect)])
+
+    def test_admin_action(self):
+        """Test the selected questions are downloaded"""
+        User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.post(reverse('admin:chm_question_changelist'), {
+            'action': 'export_jsonl',
+            '_selected_action': [q.pk for q in self.questions[:2]],
+        })
+        self.assertTrue(response.streaming)
+        self.assertEquals(response['Content-Disposition'],
+                          'attachment; filename="questions.jsonl"')
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEquals([json.loads(line) for line in content.splitlines()],
+                          self.expected[:2])
+
+    def test_command(self):
+        """Test the command writes the questions of the given topic"""
+        directory = tempfile.mkdtemp()
+        try:
+            filename = path.join(directory, 'export.xml')
+            stderr = StringIO()
+            call_command('export_questions', output=filename, topic='U',
+                         stderr=stderr)
+            with open(filename, 'rb') as f:
+                questions = list(XMLParser(f).parse_questions())
+            self.assertEquals(questions, self.expected[::2])
+            self.assertIn('Exported 3 questions', stderr.getvalue())
+        finally:
+            shutil.rmtree(directory)
+
+        stdout = StringIO()
+        call_command('export_questions', format='jsonl', subject='S',
+                     stdout=stdout, stderr=StringIO())
+        self.assertEquals(len(stdout.getvalue().splitlines()), 6)
+
+    def test_nothing_to_export(self):
+        """Test an XML export without questions is refused"""
+        self.assertTrue(JSONLinesExporter.exportable(
+            Question.objects.none()))
+        self.assertFalse(XMLExporter.exportable(
+            Question.objects.filter(pk=self.incorrect.pk)))
+
+        with self.assertRaises(CommandError):
+            call_command('export_questions', topic='missing',
+                         stdout=StringIO(), stderr=StringIO())
+
+        User.objects.create_superuser('admin', 'admin@test.com', 'admin')
+        self.client.login(username='admin', password='admin')
+        response = self.client.post(reverse('admin:chm_question_changelist'), {
+            'action': 'export_xml',
+            '_selected_action': [self.incorrect.pk],
+        }, follow=True)
+        self.assertFalse(response.streaming)
+        self.assertEquals([m.level for m in response.context['messages']],
+                          [messages.ERROR])
+
+
 class TestSimilarity(TestCase):
     """
     Testing similarity function.
@@ -469,6 +1101,92 @@ class TestSimilarity(TestCase):
             snd_not_similar = self.not_similar[i]['snd']
             self.assertIs(is_similar(fst_not_similar, snd_not_similar), False)
 
+    def test_is_similar_max_distance(self):
+        """Test the threshold given to is_similar is respected"""
+        self.assertIs(is_similar('abcdef', 'abcxyz', max_distance=4), True)
+        self.assertIs(is_similar('abcdef', 'abcxyz', max_distance=3), False)
+        self.assertIs(is_similar('abc', 'abc', max_distance=1), True)
+
+    def test_distance_within_agrees_with_distance(self):
+        """Test the bounded distance matches the full Levenshtein distance"""
+        for i in range(500):
+            fst = random_string(random.randint(0, 15))
+            snd = fst[:random.randint(0, len(fst))] + random_string(
+                random.randint(0, 5))
+            expected = distance(fst, snd)
+            for k in range(8):
+                if expected <= k:
+                    self.assertEqual(distance_within(fst, snd, k), expected)
+                else:
+                    self.assertIsNone(distance_within(fst, snd, k))
+
+    def test_distance_within_length_difference(self):
+        """Test strings whose lengths differ more than k are discarded"""
+        self.assertIsNone(distance_within('a' * 10, 'a' * 20, 9))
+        self.assertEqual(distance_within('a' * 10, 'a' * 20, 10), 10)
+        self.assertEqual(distance_within('', 'abc', 3), 3)
+
+
+class TestSimilarityIndex(TestCase):
+    """Testing the index used to look for similar questions"""
+
+    def setUp(self):
+        """Set up a topic with some questions"""
+        subject = factories.SubjectFactory.create(name='S')
+        self.topic = factories.TopicFactory.create(name='T', subject=subject)
+        self.questions = [
+            factories.QuestionFactory.create(text=random_string(40),
+                                             topic=self.topic)
+            for _ in range(20)
+        ]
+
+    def candidates(self, text):
+        return set(models.QuestionGram.objects.candidates(self.topic, text))
+
+    def test_similar_questions_are_candidates(self):
+        """Test every similar question is returned as a candidate"""
+        for question in self.questions:
+            text = 'ab' + question.text[2:-1] + 'xy'
+            self.assertIn(question, self.candidates(text))
+            self.assertTrue(Question(text=text, topic=self.topic)
+                            .similar_exists())
+
+    def test_different_questions_are_not_candidates(self):
+        """Test questions sharing few q-grams are discarded"""
+        for question in self.questions:
+            text = question.text[::-1]
+            self.assertNotIn(question, self.candidates(text))
+
+    def test_short_texts_are_compared_with_every_question(self):
+        """Test the index is not used when texts are too short"""
+        question = factories.QuestionFactory.create(text='ABCD',
+                                                    topic=self.topic)
+        self.assertIn(question, self.candidates('XYZW'))
+
+    def test_index_follows_changes(self):
+        """Test the index is updated when a question is saved or deleted"""
+        question = self.questions[0]
+        old_text = question.text
+        question.text = random_string(40)
+        question.save()
+        self.assertNotIn(question, self.candidates(old_text))
+        self.assertIn(question, self.candidates(question.text))
+
+        # delete() sets the pk of the question to None
+        pk = question.pk
+        self.assertTrue(models.QuestionGram.objects.filter(
+            question_id=pk).exists())
+        question.delete()
+        self.assertFalse(models.QuestionGram.objects.filter(
+            question_id=pk).exists())
+
+    def test_rebuild_command(self):
+        """Test the management command rebuilds the whole index"""
+        models.QuestionGram.objects.all().delete()
+        call_command('rebuild_similarity_index', stdout=StringIO())
+        for question in self.questions:
+            self.assertIn(question, self.candidates(question.text))
+
 
 class TestXSD(TestCase):
     """
@@ -687,6 +1405,65 @@ class TestXMLParser(TestCase):
         self.assertEquals(answer2['text'], "Obvio que sí")
         self.assertTrue(answer2['is_correct'])
 
+    def test_parse_questions_from_invalid(self):
+        """Test no question is yielded from a file not matching the schema"""
+        path_without_topic = path.join(BASE_DIR, 'static', 'xml_files',
+                                       'test', 'without_topic.xml')
+        with open(path_without_topic, "rb") as f:
+            with self.assertRaises(etree.XMLSyntaxError):
+                for question in XMLParser(f).parse_questions():
+                    self.assertIn('topic', question)
+
+    def test_parsers_share_schema(self):
+        """Test the schema is compiled once and shared by every parser"""
+        with open(self.NORMAL_TO_PARSE_PATH, "rb") as f:
+            fst = XMLParser(f)
+            snd = XMLParser(f)
+        self.assertIs(fst.schema, snd.schema)
+        self.assertIs(fst.schema, schemas.get(DEFAULT_SCHEMA_VERSION))
+
+    def test_schema_registry(self):
+        """Test each version is compiled once, even from several threads"""
+        registry = SchemaRegistry()
+        registry.register('test', XMLParser.SCHEMA_PATH)
+        self.assertEquals(registry.compile_times, {})
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+                       registry.get('test'))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(len(results), 8)
+        for schema in results:
+            self.assertIs(schema, results[0])
+        self.assertEquals(list(registry.compile_times), ['test'])
+
+        with self.assertRaises(ValueError):
+            registry.get('unknown')
+
+    @skipUnless(path.exists('/proc/self/statm'), 'Needs /proc/self/statm')
+    def test_parse_questions_uses_constant_memory(self):
+        """
+            Test the memory used while parsing a big file does not grow
+            with the amount of questions parsed.
+        """
+        parser = XMLParser(QuestionStream(20000))
+        baseline = None
+        high_water_mark = 0
+        for i, question in enumerate(parser.parse_questions()):
+            if i == 1000:
+                baseline = resident_memory()
+            if i % 1000 == 0:
+                high_water_mark = max(high_water_mark, resident_memory())
+
+        self.assertEquals(i, 19999)
+        self.assertEquals(question['question'][:22], 'Question number 19999 ')
+        # A parser keeping the whole tree uses dozens of megabytes
+        self.assertLess(high_water_mark - baseline, 5 * 1024 * 1024)
+
 
 
 def batch_voting(*votes):
@@ -758,3 +1535,1162 @@ class TestVoting(TestCase):
         )
         for votes, expected_difficulty in cases:
             self.assertEqual(batch_voting(*votes), expected_difficulty)
+
+
+class TestQuestionSampling(TestCase):
+    """Testing the random selection of questions"""
+
+    def setUp(self):
+        subject = Subject.objects.create(name='S')
+        self.topic = Topic.objects.create(name='T', subject=subject)
+        self.questions = [
+            Question.objects.create(text=str(i), topic=self.topic,
+                                    difficulty=i % 5 + 1)
+            for i in range(10)
+        ]
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+
+    def test_sample_ids_is_uniform(self):
+        """Test every question is drawn with the same probability"""
+        rng = random.Random(42)
+        trials = 3000
+        counts = dict((q.pk, 0) for q in self.questions)
+        for _ in range(trials):
+            pks = sample_ids(Question.objects.all(), 3, rng)
+            self.assertEquals(len(set(pks)), 3)
+            for pk in pks:
+                counts[pk] += 1
+
+        expected = trials * 3 / len(self.questions)
+        chi2 = sum((c - expected) ** 2 / expected for c in counts.values())
+        # critical value of the chi-squared distribution with 9 degrees of
+        # freedom for p = 0.001
+        self.assertLess(chi2, 27.88)
+
+    def test_sample_fewer_candidates(self):
+        """Test every candidate is returned when there are not enough"""
+        pks = sample_ids(Question.objects.filter(difficulty=1), 5)
+        self.assertEquals(sorted(pks),
+                          [q.pk for q in self.questions if q.difficulty == 1])
+
+    def test_choose_questions(self):
+        """Test only the ids of the candidates and the chosen rows are read"""
+        form = QuizForm({
+            'topics': [self.topic.pk],
+            'nr_of_questions': 3,
+            'min_difficulty': 4,
+            'seconds_per_question': 10,
+            'selection_algorithm': QuizForm.MIN_DIFFICULTY,
+        }, user=self.user)
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(2):
+            questions = form.choose_questions()
+        self.assertEquals(len(set(questions)), 3)
+        for question in questions:
+            self.assertGreaterEqual(question.difficulty, 4)
+
+
+class TestMakeQuiz(TestCase):
+    """Testing the creation of quizzes"""
+
+    def setUp(self):
+        subject = Subject.objects.create(name='S')
+        self.topics = [Topic.objects.create(name=str(i), subject=subject)
+                       for i in range(3)]
+        for i in range(30):
+            question = Question.objects.create(text=str(i),
+                                               topic=self.topics[i % 3])
+            factories.AnswerFactory.create(question=question, text='no')
+            factories.AnswerFactory.create(question=question, text='yes',
+                                           is_correct=True)
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+
+    def form(self, nr_of_questions):
+        form = QuizForm({
+            'topics': [t.pk for t in self.topics],
+            'nr_of_questions': nr_of_questions,
+            'min_difficulty': 1,
+            'seconds_per_question': 10,
+            'selection_algorithm': QuizForm.RANDOM,
+        }, user=self.user)
+        self.assertTrue(form.is_valid())
+        return form
+
+    def test_queries_do_not_depend_on_the_questions(self):
+        """Test the quiz is saved with a constant amount of queries"""
+        form = self.form(5)
+        with CaptureQueriesContext(connection) as few:
+            form.make_quiz()
+        form = self.form(25)
+        with CaptureQueriesContext(connection) as many:
+            quiz = form.make_quiz()
+        self.assertEquals(len(few), len(many))
+
+        self.assertEquals(quiz.questions.count(), 25)
+        self.assertEquals(set(quiz.topics.all()), set(self.topics))
+
+    def test_quiz_is_prefetched(self):
+        """Test the new quiz is converted to json without any query"""
+        cache.clear()
+        quiz = self.form(10).make_quiz()
+        with self.assertNumQueries(0):
+            data = quiz.to_json()
+        self.assertEquals(len(data['questions']), 10)
+        for question in data['questions']:
+            self.assertEquals(len(question['answers']), 2)
+
+        # the order in which the questions were chosen is kept
+        self.assertEquals(
+            [q['id'] for q in data['questions']],
+            list(quiz.questions.order_by('pk').values_list('question_id',
+                                                           flat=True)))
+
+
+class TestQuestionMastery(TestCase):
+    """Testing the mastery of the questions kept for every user"""
+
+    def setUp(self):
+        subject = Subject.objects.create(name='S')
+        self.topic = Topic.objects.create(name='T', subject=subject)
+        self.questions = []
+        for i in range(6):
+            question = Question.objects.create(text=str(i), topic=self.topic)
+            factories.AnswerFactory.create(question=question, text='no')
+            factories.AnswerFactory.create(question=question, text='yes',
+                                           is_correct=True)
+            self.questions.append(question)
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.client.login(username='user', password='user')
+
+    def take_quiz(self, answers, questions=None):
+        """
+        Take a quiz answering the given questions right (True) or wrong
+        (False), leaving the other ones blank
+        """
+        quiz = Quiz.objects.create(user=self.user, nr_of_questions=6,
+                                   seconds_per_question=10)
+        quiz.topics.add(self.topic)
+        for question in questions or self.questions:
+            models.QuestionOnQuiz.objects.create(quiz=quiz, question=question)
+        for question, right in answers.items():
+            answer = question.answers.get(is_correct=right)
+            self.client.post(reverse('answer_question'), {
+                'quiz_id': quiz.pk,
+                'question_id': question.pk,
+                'answers': json.dumps([answer.pk]),
+            })
+        self.client.post(reverse('correct_quiz'),
+                         {'json': json.dumps({'quiz_id': quiz.pk})})
+        return quiz
+
+    def mastery(self):
+        return dict(
+            (m.question_id, (m.right, m.wrong, m.blank, m.score))
+            for m in models.QuestionMastery.objects.filter(user=self.user)
+        )
+
+    def test_answers_are_recorded(self):
+        """Test answers and blanks of finished quizzes are counted"""
+        q = self.questions
+        quiz = self.take_quiz({q[0]: True, q[1]: False},
+                              questions=q[:3])
+        self.assertEquals(self.mastery(), {
+            q[0].pk: (1, 0, 0, -1),
+            q[1].pk: (0, 1, 0, 2),
+            q[2].pk: (0, 0, 1, 1),
+        })
+
+        # finishing the quiz again changes nothing
+        quiz.finish()
+        self.assertEquals(self.mastery()[q[2].pk], (0, 0, 1, 1))
+
+        # answers after the quiz finished, whose blanks were already
+        # recorded, are ignored
+        for question in q[1:3]:
+            qoq = quiz.questions.get(question=question)
+            self.assertFalse(qoq.answer(models.QuestionOnQuiz.STATUS.right))
+        self.assertEquals(self.mastery()[q[1].pk], (0, 1, 0, 2))
+        self.assertEquals(self.mastery()[q[2].pk], (0, 0, 1, 1))
+        self.assertEquals(quiz.answer({q[2].pk: 'right'}), 0)
+        self.assertEquals(quiz.questions.get(question=q[2]).state,
+                          models.QuestionOnQuiz.STATUS.not_answered)
+
+    def test_answer_is_replaced(self):
+        """Test a new answer to the same question replaces the previous one"""
+        q = self.questions
+        quiz = Quiz.objects.create(user=self.user, nr_of_questions=1,
+                                   seconds_per_question=10)
+        qoq = models.QuestionOnQuiz.objects.create(quiz=quiz, question=q[1])
+        self.assertTrue(qoq.answer(models.QuestionOnQuiz.STATUS.wrong))
+        self.assertTrue(qoq.answer(models.QuestionOnQuiz.STATUS.right))
+        self.assertEquals(self.mastery()[q[1].pk], (1, 0, 0, -1))
+
+    def test_rebuild(self):
+        """Test the command computes the same mastery from the history"""
+        q = self.questions
+        self.take_quiz({q[0]: True, q[1]: False, q[2]: False})
+        self.take_quiz({q[0]: True, q[3]: True})
+        expected = self.mastery()
+
+        models.QuestionMastery.objects.all().delete()
+        call_command('rebuild_question_mastery', stdout=StringIO())
+        self.assertEquals(self.mastery(), expected)
+
+    def test_help_improve(self):
+        """Test questions are chosen by score with a few indexed queries"""
+        q = self.questions
+        self.take_quiz({q[0]: True, q[1]: False, q[2]: False, q[3]: True},
+                       questions=q[:4])
+        self.take_quiz({q[0]: True, q[2]: True}, questions=q[:3])
+        # scores: q0 -2, q1 2, q2 1, q3 -1, q4 and q5 never seen
+
+        form = QuizForm({
+            'topics': [self.topic.pk],
+            'nr_of_questions': 5,
+            'min_difficulty': 1,
+            'seconds_per_question': 10,
+            'selection_algorithm': QuizForm.HELP_IMPROVE,
+        }, user=self.user)
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(4):
+            questions = form.choose_questions()
+        self.assertEquals(questions[:2], [q[0], q[3]])
+        self.assertEquals(set(questions[2:4]), {q[4], q[5]})
+        self.assertEquals(questions[4], q[2])
+
+
+class TestSpacedRepetition(TestCase):
+    """Testing the spaced repetition schedule of the questions"""
+
+    def setUp(self):
+        subject = Subject.objects.create(name='S')
+        self.topic = Topic.objects.create(name='T', subject=subject)
+        self.questions = [Question.objects.create(text=str(i),
+                                                  topic=self.topic)
+                          for i in range(6)]
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+
+    def test_sm2(self):
+        """Test the intervals grow with right answers and reset otherwise"""
+        repetitions, interval, ease = 0, 0.0, INITIAL_EASE
+        intervals = []
+        for quality in (4, 4, 4, 4, 1, 4):
+            repetitions, interval, ease = sm2(repetitions, interval, ease,
+                                              quality)
+            intervals.append(interval)
+        self.assertEquals(intervals, [1, 6, 15, 38, 1, 1])
+        self.assertAlmostEqual(ease, 1.96)
+
+        # the ease never goes below its minimum
+        for _ in range(10):
+            repetitions, interval, ease = sm2(repetitions, interval, ease, 0)
+        self.assertEquals(ease, MIN_EASE)
+
+    def test_answers_are_scheduled(self):
+        """Test answering a question schedules its next review"""
+        quiz = Quiz.objects.create(user=self.user, nr_of_questions=2,
+                                   seconds_per_question=10)
+        right = models.QuestionOnQuiz.objects.create(
+            quiz=quiz, question=self.questions[0])
+        models.QuestionOnQuiz.objects.create(quiz=quiz,
+                                             question=self.questions[1])
+        before = timezone.now()
+        right.answer(models.QuestionOnQuiz.STATUS.right)
+        quiz.finish()
+
+        schedules = dict((s.question_id, s)
+                         for s in models.ReviewSchedule.objects.all())
+        self.assertEquals(schedules[self.questions[0].pk].repetitions, 1)
+        self.assertEquals(schedules[self.questions[1].pk].repetitions, 0)
+        for schedule in schedules.values():
+            self.assertGreaterEqual(schedule.due,
+                                    before + timedelta(days=1))
+
+    def test_due_soonest(self):
+        """Test due reviews come first, then new questions, then the rest"""
+        now = timezone.now()
+        q = self.questions
+        for question, days in ((q[0], 3), (q[1], -2), (q[2], -5), (q[3], 1)):
+            models.ReviewSchedule.objects.create(
+                user=self.user, question=question,
+                due=now + timedelta(days=days))
+
+        form = QuizForm({
+            'topics': [self.topic.pk],
+            'nr_of_questions': 5,
+            'min_difficulty': 1,
+            'seconds_per_question': 10,
+            'selection_algorithm': QuizForm.SPACED_REPETITION,
+        }, user=self.user)
+        self.assertTrue(form.is_valid())
+        with self.assertNumQueries(4):
+            questions = form.choose_questions()
+        self.assertEquals(questions, [q[2], q[1], q[4], q[5], q[3]])
+
+
+class TestTopicDifficultyCount(TestCase):
+    """Testing the amount of questions kept for every topic"""
+
+    def setUp(self):
+        subject = Subject.objects.create(name='S')
+        self.topics = [Topic.objects.create(name=str(i), subject=subject)
+                       for i in range(2)]
+
+    def counts(self):
+        """The counters that should be kept, computed from the questions"""
+        expected = dict(
+            ((row['topic'], row['difficulty']), row['total'])
+            for row in Question.objects.values(
+                'topic', 'difficulty'
+            ).annotate(total=Count('pk')).order_by()
+        )
+        counts = dict(
+            ((c.topic_id, c.difficulty), c.count)
+            for c in models.TopicDifficultyCount.objects.exclude(count=0)
+        )
+        self.assertEquals(counts, expected)
+
+    def test_counts_are_kept(self):
+        """Test creating, voting, moving and deleting questions"""
+        questions = [Question.objects.create(text=str(i),
+                                             topic=self.topics[i % 2])
+                     for i in range(6)]
+        self.counts()
+
+        questions[0].vote(5)
+        questions[0].save(update_fields=['real_difficulty', 'number_ranked',
+                                         'difficulty'])
+        self.counts()
+
+        questions[1].topic = self.topics[0]
+        questions[1].save()
+        self.counts()
+
+        questions[2].delete()
+        self.counts()
+
+        QuestionLoader(LoadQuestionsMessageManager()).load({
+            'subject': 'S',
+            'topic': '1',
+            'question': random_string(30),
+            'answers': [{'text': 'yes', 'is_correct': True}],
+        } for _ in range(3))
+        self.counts()
+
+        self.topics[1].delete()
+        self.counts()
+
+    def test_form_uses_counts(self):
+        """Test the form tells how many questions meet the criteria"""
+        for i in range(4):
+            question = Question.objects.create(text=str(i),
+                                               topic=self.topics[0])
+            question.vote(i + 1)
+            question.save()
+        user = User.objects.create_user('user', 'user@test.com', 'user')
+        form = QuizForm({
+            'topics': [t.pk for t in self.topics],
+            'nr_of_questions': 3,
+            'min_difficulty': 3,
+            'seconds_per_question': 10,
+            'selection_algorithm': QuizForm.MIN_DIFFICULTY,
+        }, user=user)
+        self.assertFalse(form.is_valid())
+        self.assertIn('2 questions meet the current criteria',
+                      form.non_field_errors()[0])
+        self.assertEquals(
+            models.TopicDifficultyCount.objects.questions(self.topics), 4)
+
+
+class TestStratifiedSelection(TestCase):
+    """Testing the selection of questions split among topics"""
+
+    def setUp(self):
+        subject = Subject.objects.create(name='S')
+        self.big = Topic.objects.create(name='big', subject=subject)
+        self.small = Topic.objects.create(name='small', subject=subject)
+        for i in range(100):
+            Question.objects.create(text=str(i), topic=self.big,
+                                    difficulty=i % 2 + 1)
+        for i in range(5):
+            Question.objects.create(text=str(i), topic=self.small,
+                                    difficulty=3)
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+
+    def choose(self, k, algorithm):
+        form = QuizForm({
+            'topics': [self.big.pk, self.small.pk],
+            'nr_of_questions': k,
+            'min_difficulty': 1,
+            'seconds_per_question': 10,
+            'selection_algorithm': algorithm,
+        }, user=self.user)
+        self.assertTrue(form.is_valid())
+        questions = form.choose_questions()
+        self.assertEquals(len(set(questions)), k)
+        return Counter((q.topic_id, q.difficulty) for q in questions)
+
+    def test_allocate(self):
+        """Test the draws are split without exceeding any stratum"""
+        sizes = {'a': 60, 'b': 30, 'c': 10}
+        self.assertEquals(allocate(10, sizes), {'a': 6, 'b': 3, 'c': 1})
+        self.assertEquals(allocate(30, sizes, equal=True),
+                          {'a': 10, 'b': 10, 'c': 10})
+        self.assertEquals(allocate(50, sizes, equal=True),
+                          {'a': 20, 'b': 20, 'c': 10})
+        self.assertEquals(allocate(500, sizes), sizes)
+        for k in range(20):
+            for equal in (True, False):
+                allocation = allocate(k, {'a': 7, 'b': 1, 'c': 3}, equal)
+                self.assertEquals(sum(allocation.values()), min(k, 11))
+                self.assertLessEqual(allocation['b'], 1)
+
+    def test_proportional(self):
+        """Test topics and difficulties get questions by their size"""
+        counts = self.choose(21, QuizForm.STRATIFIED)
+        self.assertEquals(counts[(self.big.pk, 1)], 10)
+        self.assertEquals(counts[(self.big.pk, 2)], 10)
+        self.assertEquals(counts[(self.small.pk, 3)], 1)
+
+    def test_equal(self):
+        """Test small topics are not drowned by big ones"""
+        counts = self.choose(10, QuizForm.STRATIFIED_EQUAL)
+        self.assertEquals(counts[(self.small.pk, 3)], 5)
+        self.assertEquals(counts[(self.big.pk, 1)] +
+                          counts[(self.big.pk, 2)], 5)
+
+    def test_queries_do_not_depend_on_the_bank(self):
+        """Test each question is sampled with an index lookup"""
+        for i in range(100, 1000):
+            Question.objects.create(text=str(i), topic=self.big)
+        form = QuizForm({
+            'topics': [self.big.pk],
+            'nr_of_questions': 4,
+            'min_difficulty': 1,
+            'seconds_per_question': 10,
+            'selection_algorithm': QuizForm.STRATIFIED,
+        }, user=self.user)
+        self.assertTrue(form.is_valid())
+        with CaptureQueriesContext(connection) as queries:
+            questions = form.choose_questions()
+        self.assertEquals(len(set(questions)), 4)
+        self.assertLessEqual(len(queries), 3 + 4 * 4 + 2)
+
+
+class TestAdaptiveSelection(TestCase):
+    """Testing the selection of questions adapted to the user ability"""
+
+    def setUp(self):
+        subject = Subject.objects.create(name='S')
+        self.topic = Topic.objects.create(name='T', subject=subject)
+        self.questions = []
+        for i in range(25):
+            question = Question.objects.create(text=str(i), topic=self.topic,
+                                               real_difficulty=i // 5 + 1,
+                                               difficulty=i // 5 + 1)
+            self.questions.append(question)
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+
+    def answer(self, user, questions, state):
+        quiz = Quiz.objects.create(user=user, nr_of_questions=1,
+                                   seconds_per_question=10)
+        models.QuestionOnQuiz.objects.bulk_create(
+            models.QuestionOnQuiz(quiz=quiz, question=question, state=state)
+            for question in questions)
+
+    def choose(self):
+        form = QuizForm({
+            'topics': [self.topic.pk],
+            'nr_of_questions': 5,
+            'min_difficulty': 1,
+            'seconds_per_question': 10,
+            'selection_algorithm': QuizForm.ADAPTIVE,
+        }, user=self.user)
+        self.assertTrue(form.is_valid())
+        return form.choose_questions()
+
+    def test_estimate_abilities(self):
+        """Test the abilities of several groups are estimated at once"""
+        b = np.array([-1.0, 0.0, 1.0, -1.0, 0.0, 1.0])
+        outcomes = np.array([1.0, 1.0, 1.0, 1.0, 0.0, 0.0])
+        groups = np.array([0, 0, 0, 1, 1, 1])
+        theta = estimate_abilities(groups, b, outcomes, 3)
+        self.assertGreater(theta[0], theta[2])
+        self.assertLess(theta[1], theta[2])
+        self.assertEquals(theta[2], 0.0)
+        self.assertAlmostEqual(
+            theta[1], estimate_abilities(np.zeros(3, dtype=int), b[3:],
+                                         outcomes[3:], 1)[0])
+
+    def test_calibrate(self):
+        """Test the difficulties are recovered from simulated answers"""
+        rng = np.random.RandomState(0)
+        true_b = np.linspace(-2, 2, 10)
+        true_theta = rng.normal(size=300)
+        users, questions = np.meshgrid(np.arange(300), np.arange(10))
+        users, questions = users.ravel(), questions.ravel()
+        outcomes = (rng.random_sample(len(users)) <
+                    probability(true_theta[users], true_b[questions]))
+        b, theta = calibrate(users, questions, outcomes.astype(float), 300,
+                             np.zeros(10))
+        self.assertGreater(np.corrcoef(b, true_b)[0, 1], 0.95)
+        self.assertGreater(np.corrcoef(theta, true_theta)[0, 1], 0.6)
+
+    def test_new_user_gets_medium_questions(self):
+        """Test questions around the average difficulty are chosen"""
+        for question in self.choose():
+            self.assertEquals(question.difficulty, 3)
+
+    def test_questions_follow_ability(self):
+        """Test good users get harder questions and bad users easier ones"""
+        self.answer(self.user, self.questions[5:20],
+                    models.QuestionOnQuiz.STATUS.right)
+        for question in self.choose():
+            self.assertGreaterEqual(question.difficulty, 4)
+
+        self.answer(self.user, self.questions[5:20] * 3,
+                    models.QuestionOnQuiz.STATUS.wrong)
+        for question in self.choose():
+            self.assertLessEqual(question.difficulty, 2)
+
+    def test_calibrate_command(self):
+        """Test the command refits the difficulties from every answer"""
+        easy, hard = self.questions[24], self.questions[0]
+        for i in range(10):
+            user = User.objects.create_user(str(i), str(i) + '@test.com')
+            self.answer(user, [easy], models.QuestionOnQuiz.STATUS.right)
+            self.answer(user, [hard], models.QuestionOnQuiz.STATUS.wrong)
+
+        stdout = StringIO()
+        call_command('calibrate_questions', stdout=stdout)
+        self.assertIn('Calibrated 2 questions with 20 answers of 10 users',
+                      stdout.getvalue())
+        easy.refresh_from_db()
+        hard.refresh_from_db()
+        self.assertLess(easy.calibrated_difficulty,
+                        hard.calibrated_difficulty)
+        self.assertIsNone(self.questions[12].calibrated_difficulty)
+
+        # the questions are read and updated in chunks
+        calibrated = easy.calibrated_difficulty, hard.calibrated_difficulty
+        call_command('calibrate_questions', chunk_size=1, stdout=StringIO())
+        easy.refresh_from_db()
+        hard.refresh_from_db()
+        self.assertAlmostEqual(easy.calibrated_difficulty, calibrated[0])
+        self.assertAlmostEqual(hard.calibrated_difficulty, calibrated[1])
+
+
+class TestCorrectAnswersCache(TestCase):
+    """Testing the cache used to grade the answers"""
+
+    def setUp(self):
+        cache.clear()
+        subject = Subject.objects.create(name='S')
+        topic = Topic.objects.create(name='T', subject=subject)
+        self.question = Question.objects.create(text='?', topic=topic)
+        self.right = factories.AnswerFactory.create(question=self.question,
+                                                    text='yes',
+                                                    is_correct=True)
+        self.wrong = factories.AnswerFactory.create(question=self.question,
+                                                    text='no')
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.client.login(username='user', password='user')
+        self.quiz = Quiz.objects.create(user=self.user, nr_of_questions=1,
+                                        seconds_per_question=10)
+        self.qoq = models.QuestionOnQuiz.objects.create(
+            quiz=self.quiz, question=self.question)
+
+    def answer(self, answer):
+        self.client.post(reverse('answer_question'), {
+            'quiz_id': self.quiz.pk,
+            'question_id': self.question.pk,
+            'answers': json.dumps([answer.pk]),
+        })
+        self.qoq.refresh_from_db()
+        return self.qoq.state
+
+    def test_answers_are_read_once(self):
+        """Test grading does not read the answers once they are cached"""
+        self.assertEquals(correct_answers(self.question.pk),
+                          {self.right.pk})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEquals(self.answer(self.right),
+                              models.QuestionOnQuiz.STATUS.right)
+        self.assertFalse([q for q in queries.captured_queries
+                          if 'chm_answer' in q['sql']])
+
+    def test_changes_invalidate_the_cache(self):
+        """Test editing or deleting answers is seen when grading"""
+        self.assertEquals(self.answer(self.right),
+                          models.QuestionOnQuiz.STATUS.right)
+        self.wrong.is_correct = True
+        self.wrong.save()
+        self.assertEquals(self.answer(self.right),
+                          models.QuestionOnQuiz.STATUS.wrong)
+        self.wrong.delete()
+        self.assertEquals(self.answer(self.right),
+                          models.QuestionOnQuiz.STATUS.right)
+
+
+class TestCacheInvalidationOnCommit(TransactionTestCase):
+    """Testing the caches are invalidated when the changes are committed"""
+
+    def setUp(self):
+        cache.clear()
+        subject = Subject.objects.create(name='S')
+        topic = Topic.objects.create(name='T', subject=subject)
+        self.question = Question.objects.create(text='?', topic=topic)
+        self.right = factories.AnswerFactory.create(question=self.question,
+                                                    text='yes',
+                                                    is_correct=True)
+        self.wrong = factories.AnswerFactory.create(question=self.question,
+                                                    text='no')
+
+    def test_stale_answers_are_forgotten(self):
+        """Test answers cached while an edit is not committed are dropped"""
+        self.assertEquals(correct_answers(self.question.pk),
+                          {self.right.pk})
+        with transaction.atomic():
+            self.right.is_correct = False
+            self.right.save()
+            self.wrong.is_correct = True
+            self.wrong.save()
+            # a request which still reads the old answers caches them
+            cache.set(CORRECT_ANSWERS_KEY.format(self.question.pk),
+                      [self.right.pk])
+            cache.set(QUESTION_KEY.format(self.question.pk), {'id': 0})
+        self.assertEquals(correct_answers(self.question.pk),
+                          {self.wrong.pk})
+        self.assertEquals(questions_json([self.question.pk])[
+            self.question.pk]['id'], self.question.pk)
+
+    def test_shared_cache_check(self):
+        """Test caches kept by each process are reported in production"""
+        with self.settings(DEBUG=False):
+            self.assertEquals([warning.id
+                               for warning in shared_cache_check(None)],
+                              ['chm.W001'])
+        with self.settings(DEBUG=False, CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.memcached.'
+                           'MemcachedCache'}}):
+            self.assertEquals(shared_cache_check(None), [])
+
+
+class TestAnswerQuestions(TestCase):
+    """Testing the submission of several answers at once"""
+
+    def setUp(self):
+        cache.clear()
+        subject = Subject.objects.create(name='S')
+        topic = Topic.objects.create(name='T', subject=subject)
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.client.login(username='user', password='user')
+        self.quiz = Quiz.objects.create(user=self.user, nr_of_questions=10,
+                                        seconds_per_question=10)
+        self.questions = []
+        for i in range(10):
+            question = Question.objects.create(text=str(i), topic=topic)
+            factories.AnswerFactory.create(question=question, text='no')
+            factories.AnswerFactory.create(question=question, text='yes',
+                                           is_correct=True)
+            models.QuestionOnQuiz.objects.create(quiz=self.quiz,
+                                                 question=question)
+            self.questions.append(question)
+
+    def post(self, questions, right=True, **kwargs):
+        data = dict(kwargs, quiz_id=self.quiz.pk, answers=[{
+            'question_id': question.pk,
+            'answers': [question.answers.get(is_correct=right).pk],
+        } for question in questions])
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post(reverse('answer_questions'),
+                                        {'json': json.dumps(data)})
+        return response, len(queries)
+
+    def states(self):
+        return dict(self.quiz.questions.values_list('question_id', 'state'))
+
+    def test_answers_are_graded(self):
+        """Test every answer is graded and recorded"""
+        response, queries = self.post(self.questions[:4])
+        self.assertEquals(response.json(),
+                          {'success': 'True', 'answered': 4})
+        response, _ = self.post(self.questions[4:6], right=False)
+        states = self.states()
+        for question in self.questions[:4]:
+            self.assertEquals(states[question.pk],
+                              models.QuestionOnQuiz.STATUS.right)
+        for question in self.questions[4:6]:
+            self.assertEquals(states[question.pk],
+                              models.QuestionOnQuiz.STATUS.wrong)
+        self.assertEquals(
+            models.QuestionMastery.objects.get(
+                question=self.questions[4]).wrong, 1)
+
+        # the same answers again change nothing
+        self.post(self.questions[:4])
+        self.assertEquals(
+            models.QuestionMastery.objects.get(
+                question=self.questions[0]).right, 1)
+
+    def test_queries_do_not_depend_on_the_answers(self):
+        """Test the answers are graded and saved with bulk queries"""
+        few = self.post(self.questions[:2])[1]
+        many = self.post(self.questions[2:])[1]
+        self.assertEquals(few, many)
+
+        # questions already scheduled and in the mastery of the user
+        few = self.post(self.questions[:2], right=False)[1]
+        many = self.post(self.questions[2:], right=False)[1]
+        self.assertEquals(few, many)
+        self.assertEquals(models.ReviewSchedule.objects.filter(
+            repetitions=0, interval=1.0).count(), 10)
+
+    def test_finish(self):
+        """Test the quiz can be finished with the last answers"""
+        response, _ = self.post(self.questions[:8], finish=True)
+        self.assertEquals(response.json()['results_url'],
+                          reverse('quiz_results', args=[self.quiz.pk]))
+        self.quiz.refresh_from_db()
+        self.assertEquals(self.quiz.state, Quiz.STATUS.finished)
+        self.assertEquals(models.QuestionMastery.objects.filter(
+            blank=1).count(), 2)
+
+        # a finished quiz can not be answered
+        response, _ = self.post(self.questions[8:])
+        self.assertEquals(response.status_code, 403)
+
+    def test_other_users_quiz(self):
+        """Test users can not answer the quizzes of other users"""
+        User.objects.create_user('other', 'other@test.com', 'other')
+        self.client.login(username='other', password='other')
+        response, _ = self.post(self.questions)
+        self.assertEquals(response.status_code, 403)
+
+
+class TestQuizToJson(TestCase):
+    """Testing the conversion of quizzes to json"""
+
+    def setUp(self):
+        cache.clear()
+        subject = Subject.objects.create(name='S')
+        self.topic = Topic.objects.create(name='T', subject=subject)
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.client.login(username='user', password='user')
+
+    def create_quiz(self, n):
+        quiz = Quiz.objects.create(user=self.user, nr_of_questions=n,
+                                   seconds_per_question=10)
+        quiz.topics.add(self.topic)
+        for i in range(n):
+            question = Question.objects.create(text=str(i), topic=self.topic)
+            for j in range(3):
+                factories.AnswerFactory.create(question=question,
+                                               text=str(j))
+            models.QuestionOnQuiz.objects.create(
+                quiz=quiz, question=question,
+                state=models.QuestionOnQuiz.STATUS.right if i % 2 else
+                models.QuestionOnQuiz.STATUS.not_answered)
+        return Quiz.objects.get(pk=quiz.pk)
+
+    def test_queries_do_not_depend_on_the_questions(self):
+        """Test the quiz takes a fixed amount of queries"""
+        for n in (1, 5, 20):
+            quiz = self.create_quiz(n)
+            with self.assertNumQueries(3):
+                data = quiz.to_json()
+            self.assertEquals(len(data['questions']), n)
+            for question in data['questions']:
+                self.assertEquals(question['topic'], 'T')
+                self.assertEquals(len(question['answers']), 3)
+
+            # the questions are cached now
+            with self.assertNumQueries(1):
+                self.assertEquals(quiz.to_json(), data)
+            with self.assertNumQueries(1):
+                data = quiz.to_json(exclude_answered=True)
+            self.assertEquals(len(data['questions']), (n + 1) // 2)
+
+    def test_changes_invalidate_the_cache(self):
+        """Test editing questions, answers or topics is seen in quizzes"""
+        quiz = self.create_quiz(1)
+        quiz.to_json()
+        question = quiz.questions.get().question
+
+        question.text = 'edited'
+        question.save()
+        self.assertEquals(quiz.to_json()['questions'][0]['text'], 'edited')
+
+        answer = question.answers.first()
+        answer.text = 'edited'
+        answer.save()
+        self.assertEquals(quiz.to_json()['questions'][0]['answers'][0],
+                          {'id': answer.pk, 'text': 'edited'})
+        answer.delete()
+        self.assertEquals(len(quiz.to_json()['questions'][0]['answers']), 2)
+
+        self.topic.name = 'edited'
+        self.topic.save()
+        self.assertEquals(quiz.to_json()['questions'][0]['topic'], 'edited')
+
+    def test_resume_quiz(self):
+        """Test the pending questions are shown to resume the quiz"""
+        quiz = self.create_quiz(4)
+        response = self.client.post(reverse('resume_quiz'),
+                                    {'quiz_id': quiz.pk})
+        self.assertEquals(len(response.context['quiz']['questions']), 2)
+
+
+class TestQuizResult(TestCase):
+    """Testing the result saved when a quiz finishes"""
+
+    def setUp(self):
+        self.subjects = [Subject.objects.create(name=name)
+                         for name in ('S0', 'S1')]
+        self.topics = [Topic.objects.create(name='T', subject=subject)
+                       for subject in self.subjects]
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.client.login(username='user', password='user')
+
+    def create_quiz(self, states):
+        """
+        Create a quiz whose i-th question has the i-th state, the questions
+        are split between both subjects
+        """
+        quiz = Quiz.objects.create(user=self.user,
+                                   nr_of_questions=len(states),
+                                   seconds_per_question=10)
+        quiz.topics.add(*self.topics)
+        for i, state in enumerate(states):
+            question = Question.objects.create(text=str(i),
+                                               topic=self.topics[i % 2])
+            models.QuestionOnQuiz.objects.create(quiz=quiz, question=question,
+                                                 state=state)
+        return quiz
+
+    def test_finish(self):
+        """Test the result is counted in total and for each subject"""
+        status = models.QuestionOnQuiz.STATUS
+        quiz = self.create_quiz([status.right, status.wrong, status.right,
+                                 status.right, status.not_answered])
+        with CaptureQueriesContext(connection) as queries:
+            quiz.finish()
+        self.assertEquals(len([q for q in queries.captured_queries
+                               if 'GROUP BY' in q['sql']]), 1)
+
+        quiz = Quiz.objects.get(pk=quiz.pk)
+        self.assertEquals((quiz.right, quiz.wrong, quiz.blank), (3, 1, 1))
+        self.assertEquals(quiz.score(), 60)
+        self.assertEquals(quiz.detailed_score(), [
+            {'state': status.not_answered, 'total': 1},
+            {'state': status.right, 'total': 3},
+            {'state': status.wrong, 'total': 1},
+        ])
+        results = dict((result.subject, result)
+                       for result in quiz.results.all())
+        self.assertEquals(
+            (results[self.subjects[0]].right, results[self.subjects[0]].wrong,
+             results[self.subjects[0]].blank), (2, 0, 1))
+        self.assertEquals(results[self.subjects[1]].score(), 50)
+
+        # changes after the quiz finished are not counted
+        quiz.questions.update(state=status.wrong)
+        quiz.finish()
+        self.assertEquals(Quiz.objects.get(pk=quiz.pk).right, 3)
+
+    def test_answer_after_finish(self):
+        """Test answers arriving after the quiz finished are rejected"""
+        status = models.QuestionOnQuiz.STATUS
+        quiz = self.create_quiz([status.not_answered] * 2)
+        questions = [qoq.question for qoq in quiz.questions.order_by('pk')]
+        for question in questions:
+            factories.AnswerFactory.create(question=question, text='yes',
+                                           is_correct=True)
+
+        def answer(question):
+            return self.client.post(reverse('answer_question'), {
+                'quiz_id': quiz.pk,
+                'question_id': question.pk,
+                'answers': json.dumps([question.answers.get().pk]),
+            })
+
+        self.assertEquals(answer(questions[0]).status_code, 200)
+        self.client.post(reverse('correct_quiz'),
+                         {'json': json.dumps({'quiz_id': quiz.pk})})
+        self.assertEquals(answer(questions[1]).status_code, 403)
+
+        quiz = Quiz.objects.get(pk=quiz.pk)
+        self.assertEquals((quiz.right, quiz.wrong, quiz.blank), (1, 0, 1))
+        self.assertEquals(
+            list(quiz.questions.order_by('pk').values_list('state',
+                                                           flat=True)),
+            [status.right, status.not_answered])
+
+    def test_results_page_queries(self):
+        """Test the results page does not query each question"""
+        status = models.QuestionOnQuiz.STATUS
+        for n in (2, 10):
+            quiz = self.create_quiz([status.right] * n)
+            quiz.finish()
+            with self.assertNumQueries(5):
+                response = self.client.get(reverse('quiz_results',
+                                                   args=[quiz.pk]))
+            self.assertContains(response, '100.0 %')
+
+    def test_stats_detail_queries(self):
+        """Test the stats of a subject do not query each quiz"""
+        status = models.QuestionOnQuiz.STATUS
+        url = reverse('stats_detail', args=[self.subjects[0].pk])
+        queries = []
+        for states in ([status.right, status.wrong],
+                       [status.wrong, status.right]):
+            self.create_quiz(states).finish()
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(url)
+            queries.append(len(captured))
+
+        self.assertEquals(queries[0], queries[1])
+        self.assertEquals(response.context['quizes_avg'], [100, 0])
+        self.assertEquals(response.context['average_score'], '50.00 %')
+
+
+class TestLearningCoeffs(TestCase):
+    """Testing the learning coefficients of the users"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.other = User.objects.create_user('other', 'other@test.com', 'o')
+        self.client.login(username='user', password='user')
+        self.subjects = []
+        self.topics = []
+        for i in range(3):
+            subject = Subject.objects.create(name='S{}'.format(i))
+            self.subjects.append(subject)
+            self.topics.append([Topic.objects.create(name=str(j),
+                                                     subject=subject)
+                                for j in range(3)])
+
+    def answer(self, topic, states, user=None, finish=True):
+        """Create a quiz answering a new question of the topic per state"""
+        quiz = Quiz.objects.create(user=user or self.user,
+                                   nr_of_questions=len(states),
+                                   seconds_per_question=10)
+        for state in states:
+            question = Question.objects.create(text=state, topic=topic)
+            models.QuestionOnQuiz.objects.create(quiz=quiz, question=question,
+                                                 state=state)
+        if finish:
+            quiz.finish()
+        return quiz
+
+    def test_coefficients(self):
+        """Test the coefficients of the topics and their subjects"""
+        status = models.QuestionOnQuiz.STATUS
+        topics = self.topics[0]
+        self.answer(topics[0], [status.right, status.right, status.wrong,
+                                status.not_answered])
+        self.answer(topics[1], [status.wrong])
+        self.answer(topics[1], [status.right], finish=False)
+        self.answer(topics[1], [status.right]).abort()
+        self.answer(topics[1], [status.right], user=self.other)
+        self.answer(self.topics[1][0], [status.not_answered])
+
+        with self.assertNumQueries(2):
+            subject_coeffs, topic_coeffs = learning_coeffs(self.user)
+
+        self.assertAlmostEqual(topic_coeffs[topics[0].pk], 200 / 3)
+        self.assertEquals(topic_coeffs[topics[1].pk], 0)
+        self.assertEquals(topic_coeffs[topics[2].pk], 0)
+        self.assertAlmostEqual(subject_coeffs[self.subjects[0].pk], 200 / 9)
+        self.assertEquals(subject_coeffs[self.subjects[1].pk], 0)
+        self.assertNotIn(self.subjects[2].pk, subject_coeffs)
+
+        self.assertAlmostEqual(self.subjects[0].learning_coeff(self.user),
+                               200 / 9)
+        self.assertAlmostEqual(topics[0].learning_coeff(self.user), 200 / 3)
+        self.assertEquals(self.subjects[2].learning_coeff(self.user), 0)
+
+    def test_stats_page_queries(self):
+        """Test the stats page does not query each subject"""
+        status = models.QuestionOnQuiz.STATUS
+        queries = []
+        for topics in self.topics[:2]:
+            self.answer(topics[0], [status.right, status.wrong])
+            with CaptureQueriesContext(connection) as captured:
+                response = self.client.get(reverse('show_stats'))
+            queries.append(len(captured))
+        self.assertEquals(queries[0], queries[1])
+        self.assertEquals([subject.learning_coeff
+                           for subject in response.context['subjects']],
+                          [50 / 3, 50 / 3])
+
+
+class TestTopicStats(TestCase):
+    """Testing the statistics of the users on each topic"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.client.login(username='user', password='user')
+        subject = Subject.objects.create(name='S')
+        self.topics = [Topic.objects.create(name=str(i), subject=subject)
+                       for i in range(2)]
+        status = models.QuestionOnQuiz.STATUS
+        self.quiz = self.create_quiz([status.right, status.wrong,
+                                      status.right, status.not_answered])
+
+    def create_quiz(self, states):
+        """Create a quiz whose questions alternate between both topics"""
+        quiz = Quiz.objects.create(user=self.user,
+                                   nr_of_questions=len(states),
+                                   seconds_per_question=10)
+        for i, state in enumerate(states):
+            question = Question.objects.create(text=str(i),
+                                               topic=self.topics[i % 2])
+            models.QuestionOnQuiz.objects.create(quiz=quiz, question=question,
+                                                 state=state)
+        return quiz
+
+    def stats(self):
+        return dict(
+            (stats.topic_id, (stats.right, stats.wrong, stats.blank))
+            for stats in models.TopicStats.objects.filter(user=self.user)
+        )
+
+    def test_finish_and_abort(self):
+        """Test finished quizzes are recorded until they are aborted"""
+        self.assertEquals(self.stats(), {})
+        self.quiz.finish()
+        self.quiz.finish()
+        self.assertEquals(self.stats(), {self.topics[0].pk: (2, 0, 0),
+                                         self.topics[1].pk: (0, 1, 1)})
+        stats = models.TopicStats.objects.get(topic=self.topics[0])
+        self.assertIsNotNone(stats.last_activity)
+
+        status = models.QuestionOnQuiz.STATUS
+        quiz = self.create_quiz([status.wrong])
+        quiz.finish()
+        self.assertEquals(self.stats()[self.topics[0].pk], (2, 1, 0))
+
+        self.client.post(reverse('discard_quiz'), {'quiz_id': self.quiz.pk})
+        self.assertEquals(Quiz.objects.get(pk=self.quiz.pk).state,
+                          Quiz.STATUS.aborted)
+        self.assertEquals(self.stats(), {self.topics[0].pk: (0, 1, 0),
+                                         self.topics[1].pk: (0, 0, 0)})
+        self.quiz.abort()
+        self.assertEquals(self.stats()[self.topics[0].pk], (0, 1, 0))
+
+    def test_answer_after_finish(self):
+        """Test answers after the quiz finished do not change the stats"""
+        status = models.QuestionOnQuiz.STATUS
+        quiz = self.create_quiz([status.not_answered] * 2)
+        qoqs = list(quiz.questions.order_by('pk'))
+        self.assertTrue(qoqs[0].answer(status.right))
+        quiz.finish()
+        self.assertFalse(qoqs[1].answer(status.right))
+        self.assertEquals(quiz.answer({qoqs[1].question_id: status.right}), 0)
+        self.assertEquals(self.stats(), {self.topics[0].pk: (1, 0, 0),
+                                         self.topics[1].pk: (0, 0, 1)})
+
+        # the stats still match the answers
+        expected = self.stats()
+        call_command('rebuild_topic_stats', stdout=StringIO())
+        self.assertEquals(self.stats(), expected)
+
+    def test_abort_in_progress(self):
+        """Test aborting a quiz which did not finish does not change stats"""
+        self.quiz.abort()
+        self.assertEquals(self.stats(), {})
+
+    def test_rebuild(self):
+        """Test the command computes the same statistics from scratch"""
+        status = models.QuestionOnQuiz.STATUS
+        self.quiz.finish()
+        self.create_quiz([status.right, status.right]).finish()
+        self.create_quiz([status.wrong]).abort()
+        self.create_quiz([status.wrong])
+        expected = self.stats()
+
+        out = StringIO()
+        call_command('rebuild_topic_stats', stdout=out)
+        self.assertEquals(self.stats(), expected)
+        self.assertIn('2 topics', out.getvalue())
+
+    def test_stats_detail(self):
+        """Test the stats of a subject are read from the statistics"""
+        self.quiz.finish()
+        self.create_quiz([models.QuestionOnQuiz.STATUS.right])
+        response = self.client.get(reverse('stats_detail',
+                                           args=[self.topics[0].subject.pk]))
+        self.assertEquals(response.context['total_questions'], 4)
+        self.assertEquals(response.context['correct_answers'], 2)
+        self.assertEquals(response.context['incorrect_answers'], 1)
+        self.assertEquals(response.context['blank_questions'], 1)
+        self.assertEquals(response.context['subject'].learning_coeff, 50)
+
+
+class TestPerformanceChart(TestCase):
+    """Testing the scores shown in the performance chart of a subject"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@test.com', 'user')
+        self.client.login(username='user', password='user')
+        self.subject = Subject.objects.create(name='S')
+        self.topics = [Topic.objects.create(name=str(i), subject=self.subject)
+                       for i in range(2)]
+
+    def test_lttb(self):
+        """Test the series is reduced keeping its ends and its peaks"""
+        points = [(x, 0.0) for x in range(100)]
+        points[37] = (37, 10.0)
+        points[71] = (71, -10.0)
+        sampled = lttb(points, 10)
+        self.assertEquals(len(sampled), 10)
+        self.assertEquals(sampled[0], points[0])
+        self.assertEquals(sampled[-1], points[-1])
+        self.assertIn(points[37], sampled)
+        self.assertIn(points[71], sampled)
+        self.assertEquals(sampled, sorted(sampled))
+        self.assertEquals(lttb(points[:5], 10), points[:5])
+
+    def test_downsample(self):
+        """Test the scores are averaged by day and then reduced"""
+        start = timezone.now().replace(hour=0, minute=0, second=0,
+                                       microsecond=0)
+        scores = [(start + timedelta(hours=8 * i), float(i % 3 * 50))
+                  for i in range(30)]
+        self.assertEquals(downsample(scores, 30), scores)
+
+        daily = downsample(scores, 10)
+        self.assertEquals(daily, [(start + timedelta(days=i), 50.0)
+                                  for i in range(10)])
+
+        reduced = downsample(scores, 5)
+        self.assertEquals(len(reduced), 5)
+        self.assertEquals(reduced[0], daily[0])
+        self.assertEquals(reduced[-1], daily[-1])
+
+    def test_scores_of_quizzes_with_many_topics(self):
+        """Test quizzes with several topics of the subject appear once"""
+        status = models.QuestionOnQuiz.STATUS
+        for states in ([status.right, status.wrong],
+                       [status.right, status.right]):
+            quiz = Quiz.objects.create(user=self.user,
+                                       nr_of_questions=len(states),
+                                       seconds_per_question=10)
+            quiz.topics.add(*self.topics)
+            for topic, state in zip(self.topics, states):
+                question = Question.objects.create(text=state, topic=topic)
+                models.QuestionOnQuiz.objects.create(
+                    quiz=quiz, question=question, state=state)
+            quiz.finish()
+
+        with self.assertNumQueries(1):
+            scores = subject_scores(self.user, self.subject.pk)
+        self.assertEquals([score for when, score in scores], [50, 100])
+
+        response = self.client.get(reverse('stats_detail',
+                                           args=[self.subject.pk]))
+        self.assertEquals(response.context['total_quizes'], 2)
+        self.assertEquals(len(response.context['quizes']), 2)
+        self.assertEquals(response.context['quizes_avg'], [50, 100])
+        self.assertEquals(response.context['average_score'], '75.00 %')
@@ -4,6 +4,7 @@ import json
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.exceptions import PermissionDenied
+from django.db.models import Sum
 from django.http import JsonResponse
 from django.http import Http404
 from django.shortcuts import get_object_or_404
@@ -12,15 +13,20 @@ from django.shortcuts import render
 from django.urls import reverse
 from django.utils.translation import ugettext_lazy as _
 
+from chm.caches import correct_answers
+from chm.caches import correct_answers_many
 from chm.forms import FlagForm
 from chm.forms import QuizForm
-from chm.models import Answer
 from chm.models import Flag
 from chm.models import Question
 from chm.models import QuestionOnQuiz
 from chm.models import Quiz
 from chm.models import Subject
 from chm.models import Topic
+from chm.models import TopicStats
+from chm.stats import downsample
+from chm.stats import learning_coeffs
+from chm.stats import subject_scores
 
 
 def index(request):
@@ -80,8 +86,7 @@ def correct_quiz(request):
             raise PermissionDenied
 
         # set quiz as finished, since user answered last question
-        quiz.state = Quiz.STATUS.finished
-        quiz.save()
+        quiz.finish()
         return quiz_immediate_results(request, quiz.id)
     else:
         return redirect(login)
@@ -98,19 +103,22 @@ def rate_question(request):
             return Http404(_("Wrong difficulty or question ID"))
         question = get_object_or_404(Question, id=qid)
         question.vote(difficulty)
-        question.save()
+        question.save(update_fields=['real_difficulty', 'number_ranked',
+                                     'difficulty'])
         return JsonResponse({'ok': True})
     return JsonResponse({'ok': False})
 
 
 def quiz_immediate_results(request, id):
     """Show results obtained in quiz"""
-    quiz = get_object_or_404(Quiz, id=id)
+    quiz = get_object_or_404(Quiz.objects.select_related('user'), id=id)
     if quiz.user != request.user:
         raise PermissionDenied
 
     context = {
         'quiz': quiz,
+        'topics': quiz.topics.select_related('subject'),
+        'questions': quiz.questions.select_related('question').order_by('pk'),
         'allow_rating': True,
     }
 
@@ -122,12 +130,14 @@ def quiz_results(request, id):
     This quiz was not just taken. Do nota allow user
     to re-rate questions of this quiz"""
 
-    quiz = get_object_or_404(Quiz, id=id)
+    quiz = get_object_or_404(Quiz.objects.select_related('user'), id=id)
     if quiz.user != request.user:
         raise PermissionDenied
 
     context = {
         'quiz': quiz,
+        'topics': quiz.topics.select_related('subject'),
+        'questions': quiz.questions.select_related('question').order_by('pk'),
         'allow_rating': False,
     }
 
@@ -211,31 +221,72 @@ def answer_question(request):
     if request.method == 'POST':
         # import ipdb; ipdb.set_trace()  # XXX BREAKPOINT
         qoq = get_object_or_404(
-            QuestionOnQuiz,
+            QuestionOnQuiz.objects.select_related('quiz'),
             quiz_id=int(request.POST['quiz_id']),
             question_id=int(request.POST['question_id'])
         )
+        # fail with 403 if user didn't take this quiz or it is not pending,
+        # its result was saved when it finished
+        if request.user.pk != qoq.quiz.user_id or \
+                qoq.quiz.state != Quiz.STATUS.in_progress:
+            raise PermissionDenied
+
         user_answers_set = set(map(lambda a: int(a),
                                    json.loads(request.POST['answers'])))
 
-        correct_answers = Answer.objects.filter(
-            question=qoq.question,
-            is_correct=True
-        ).values_list('pk', flat=True)
-
-        correct_answers_set = set(correct_answers)
+        correct_answers_set = correct_answers(qoq.question_id)
 
         if user_answers_set == correct_answers_set:
-            qoq.state = QuestionOnQuiz.STATUS.right
+            saved = qoq.answer(QuestionOnQuiz.STATUS.right)
         else:
-            qoq.state = QuestionOnQuiz.STATUS.wrong
+            saved = qoq.answer(QuestionOnQuiz.STATUS.wrong)
+
+        # the quiz finished meanwhile
+        if not saved:
+            raise PermissionDenied
 
-        qoq.save()
         return JsonResponse({'success': "True"})
     else:
         return JsonResponse({'success': "False"})
 
 
+@login_required
+def answer_questions(request):
+    """
+    POST only view for submitting the answers to several questions of a
+    quiz at once. The JSON data contains the quiz_id, a list of answers,
+    each one with a question_id and the ids of the chosen answers, and
+    optionally finish, to finish the quiz as correct_quiz does.
+    """
+    if request.method == 'POST':
+        data = json.loads(request.POST['json'])
+        quiz = get_object_or_404(Quiz, pk=int(data['quiz_id']))
+
+        # fail with 403 if user didn't take this quiz or it is not pending
+        if request.user != quiz.user or \
+                quiz.state != Quiz.STATUS.in_progress:
+            raise PermissionDenied
+
+        user_answers = dict(
+            (int(answer['question_id']), set(map(int, answer['answers'])))
+            for answer in data['answers']
+        )
+        correct = correct_answers_many(list(user_answers))
+        states = dict(
+            (pk, QuestionOnQuiz.STATUS.right if answers == correct[pk]
+             else QuestionOnQuiz.STATUS.wrong)
+            for pk, answers in user_answers.items()
+        )
+        result = {'success': "True", 'answered': quiz.answer(states)}
+
+        if data.get('finish'):
+            quiz.finish()
+            result['results_url'] = reverse('quiz_results', args=[quiz.pk])
+        return JsonResponse(result)
+    else:
+        return JsonResponse({'success': "False"})
+
+
 @login_required
 def discard_quiz(request):
     """POST only view to put quiz in aborted state"""
@@ -243,8 +294,7 @@ def discard_quiz(request):
         quiz = get_object_or_404(Quiz, pk=int(request.POST['quiz_id']))
 
         if request.user == quiz.user:
-            quiz.state = Quiz.STATUS.aborted
-            quiz.save()
+            quiz.abort()
             return JsonResponse({'success': "True"})
 
         else:
@@ -285,13 +335,10 @@ def show_stats(request):
     """Show user stats"""
     # produce a bunch of data for the UI to consume
     context = {}
-    subjects_id = QuestionOnQuiz.objects.filter(
-        quiz__user=request.user,
-        quiz__state=Quiz.STATUS.finished,
-    ).values('question__topic__subject').distinct()
-    subjects = Subject.objects.filter(id__in=subjects_id)
+    subject_coeffs, topic_coeffs = learning_coeffs(request.user)
+    subjects = Subject.objects.filter(id__in=list(subject_coeffs))
     for subject in subjects:
-        subject.learning_coeff = subject.learning_coeff(request.user)
+        subject.learning_coeff = subject_coeffs[subject.pk]
     context['subjects'] = subjects
     return render(request, 'stats.html', context)
 
@@ -303,35 +350,32 @@ def stats_detail(request, id):
     subject = get_object_or_404(Subject, id=id)
     subject.learning_coeff = subject.learning_coeff(request.user)
 
+    # a quiz is joined once per topic of the subject
     quizes = Quiz.objects.filter(
         user=request.user,
         topics__subject=subject
-    ).order_by('datetime')
+    ).distinct().order_by('datetime')
+
+    scores = subject_scores(request.user, subject.pk)
 
-    # performance chart
+    # performance chart, of a bounded amount of points
+    chart = downsample(scores)
 
     # x axis
-    quizes_dates = [quiz.datetime.strftime('%Y-%m-%d %H:%M')
-                    for quiz in quizes.filter(state=Quiz.STATUS.finished)]
+    quizes_dates = [when.strftime('%Y-%m-%d %H:%M') for when, score in chart]
     # y axis
-    quizes_avg = [quiz.score(question__topic__subject=subject)
-                  for quiz in quizes.filter(state=Quiz.STATUS.finished)]
+    quizes_avg = [score for when, score in chart]
 
-    # General stats
-    qq = QuestionOnQuiz.objects.filter(
-        quiz__in=quizes.exclude(state=Quiz.STATUS.aborted),
-        question__topic__subject=subject
-    )
-
-    correct = qq.filter(state=QuestionOnQuiz.STATUS.right)
-    incorrect = qq.filter(state=QuestionOnQuiz.STATUS.wrong)
-    not_answered = qq.filter(state=QuestionOnQuiz.STATUS.not_answered)
-
-    sum_score = sum([q.score(question__topic__subject=subject)
-                     for q in quizes])
+    # General stats, of the finished quizzes
+    totals = TopicStats.objects.filter(
+        user=request.user,
+        topic__subject=subject
+    ).aggregate(right=Sum('right'), wrong=Sum('wrong'), blank=Sum('blank'))
+    totals = dict((key, total or 0) for key, total in totals.items())
 
     try:
-        avg_score = '{:.2f} %'.format(sum_score / quizes.count())
+        avg_score = '{:.2f} %'.format(
+            sum(score for when, score in scores) / len(scores))
     except ZeroDivisionError:
         avg_score = 'N/A'
 
@@ -340,10 +384,10 @@ def stats_detail(request, id):
         'quizes': quizes.order_by('datetime'),
         'total_quizes': quizes.count(),
         'average_score': avg_score,
-        'total_questions': qq.count(),
-        'correct_answers': correct.count(),
-        'incorrect_answers': incorrect.count(),
-        'blank_questions': not_answered.count(),
+        'total_questions': sum(totals.values()),
+        'correct_answers': totals['right'],
+        'incorrect_answers': totals['wrong'],
+        'blank_questions': totals['blank'],
 
         # performance plot
         'quizes_dates': quizes_dates,
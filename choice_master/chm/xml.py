@@ -1,22 +1,99 @@
+import logging
+import threading
+import time
 from os import path
 from lxml import etree
 from choice_master.settings import BASE_DIR
 
+logger = logging.getLogger(__name__)
+
+SCHEMA_PATH = path.join(BASE_DIR, 'static', 'xml_files', 'question.xml')
+DEFAULT_SCHEMA_VERSION = '1'
+
+
+class SchemaRegistry(object):
+    """
+    The SchemaRegistry object holds the XSD schemas used to validate the
+    uploaded files. Each version of the schema is compiled only once, the
+    first time it is needed, and then shared by every parser of the process.
+    """
+
+    def __init__(self):
+        """Create an empty registry."""
+        self._paths = {}
+        self._schemas = {}
+        self._lock = threading.Lock()
+        # seconds spent compiling each version of the schema
+        self.compile_times = {}
+
+    def register(self, version, schema_path):
+        """
+        Register a new version of the schema. The schema is not compiled
+        until it is requested.
+        :param version: The name of the version
+        :param schema_path: The path of the XSD file
+        :type version: string
+        :type schema_path: string
+        """
+        with self._lock:
+            self._paths[version] = schema_path
+            self._schemas.pop(version, None)
+
+    def get(self, version=DEFAULT_SCHEMA_VERSION):
+        """
+        Return the compiled schema of the given version, compiling it if it
+        was not requested before.
+        :param version: The name of the version
+        :type version: string
+        :return: The compiled schema
+        :rtype: etree.XMLSchema
+        """
+        schema = self._schemas.get(version)
+        if schema is None:
+            with self._lock:
+                schema = self._schemas.get(version)
+                if schema is None:
+                    schema = self._compile(version)
+                    self._schemas[version] = schema
+        return schema
+
+    def _compile(self, version):
+        """Compile the given version of the schema. Hold the lock."""
+        try:
+            schema_path = self._paths[version]
+        except KeyError:
+            raise ValueError('Unknown schema version: {}'.format(version))
+
+        start = time.time()
+        with open(schema_path, "rb") as f:
+            schema = etree.XMLSchema(etree.parse(f))
+        elapsed = time.time() - start
+
+        self.compile_times[version] = elapsed
+        logger.info('Compiled XML schema version %s in %.3f seconds',
+                    version, elapsed)
+        return schema
+
+
+schemas = SchemaRegistry()
+schemas.register(DEFAULT_SCHEMA_VERSION, SCHEMA_PATH)
+
 
 class XMLParser(object):
-    SCHEMA_PATH = path.join(BASE_DIR, 'static', 'xml_files', 'question.xml')
+    SCHEMA_PATH = SCHEMA_PATH
 
-    def __init__(self, xmlfile):
+    def __init__(self, xmlfile, schema_version=DEFAULT_SCHEMA_VERSION):
         """
         Create a new XMLParser using the given file.
         :param xmlfile: The file object to parse
+        :param schema_version: The version of the schema used to validate
+        the file
         :xmlfile: xml file-like object
+        :type schema_version: string
         :return: None
         :rtype: NoneType
         """
-        with open(self.SCHEMA_PATH, "r") as f:
-            xmlschema_doc = etree.parse(f)
-        self.schema = etree.XMLSchema(xmlschema_doc)
+        self.schema = schemas.get(schema_version)
         self.xmlfile = xmlfile
 
     def parse_questions(self):
@@ -24,7 +101,8 @@ class XMLParser(object):
         Yield dictionary containing a question parsed from the file setted
         after creating the object. A file might contain several questions, thus
         several dictionaries might be yielded. A dictionary contains only the
-        information of one question.
+        information of one question. The file is processed as a stream, so
+        the memory used does not depend on the size of the file.
 
         :return: A dictionary containing: 'subject' (string), 'topic' (string),
         'question' (string), 'answers' (list of dictionaries containing: 'text'
@@ -34,6 +112,14 @@ class XMLParser(object):
         """
         gen = etree.iterparse(self.xmlfile, tag='question', schema=self.schema)
         for _, data in gen:
+            # validation errors are only raised once the whole file is read,
+            # but the invalid questions must not be yielded
+            errors = gen.error_log.filter_from_errors()
+            if errors:
+                error = errors.last_error
+                raise etree.XMLSyntaxError(error.message, error.type,
+                                           error.line, error.column)
+
             result = {'subject': data.attrib['subject'],
                       'topic': data.attrib['topic'],
                       'question': data[0].text,
@@ -44,4 +130,10 @@ class XMLParser(object):
                        'is_correct': data[i].tag == "correct"}
                 result['answers'].append(ans)
 
+            # The parser keeps building the whole tree, so free the question
+            # and the ones already processed in order to use constant memory
+            data.clear()
+            while data.getprevious() is not None:
+                del data.getparent()[0]
+
             yield result
@@ -109,6 +109,20 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/1.10/topics/cache/
+
+# the memory of each process is only valid for a single process, since the
+# caches of app chm are invalidated when questions change (see chm.caches).
+# Configure a shared cache such as memcached in local_settings.py when the
+# site is served by several processes.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.10/ref/settings/#auth-password-validators
 